@@ -0,0 +1,257 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+"""Distributed Optimal and Predictive Energy Resources
+Benchmark suite.
+
+Measures model build, LP write, solve and result extraction times, peak memory
+and model size over problem sizes, using the bundled CBC solver. Each case runs
+in a fresh process so the memory peaks are per case. Results are appended to a
+history file (JSON lines) and compared to the previous run of the same case.
+
+Usage:
+
+    python benchmarks/bench_doper.py --suite quick
+    python benchmarks/bench_doper.py --suite full --history benchmarks/history.jsonl
+    python benchmarks/bench_doper.py --filter batteries
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess as sp
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None # not available on Windows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# base case, every case changes some of these
+BASE_CASE = {
+    'horizon': 24, # hours
+    'timestep': 5, # minutes
+    'batteries': 1,
+    'evs': 0,
+    'gensets': 0,
+    'load_circuits': 0,
+    'network': 'single', # one of NETWORKS
+    'nodes': 1,
+}
+
+NETWORKS = ['single', 'simple', 'powerflow'] # single node, simple power exchange, power flow
+
+def _sweep(key, values, **base):
+    """Cases which vary one dimension of the base case."""
+    return [dict(BASE_CASE, **base, **{key: v}) for v in values]
+
+SUITES = {
+    'quick': [
+        dict(BASE_CASE),
+        dict(BASE_CASE, horizon=48, timestep=15),
+        dict(BASE_CASE, batteries=10, timestep=15),
+        dict(BASE_CASE, evs=10, timestep=15),
+        dict(BASE_CASE, gensets=2, load_circuits=2, timestep=15),
+        dict(BASE_CASE, network='simple', nodes=5, batteries=5, timestep=15),
+        dict(BASE_CASE, network='powerflow', nodes=5, batteries=5, timestep=60),
+    ],
+    'full': _sweep('horizon', [24, 48, 96, 168], timestep=60)
+            + _sweep('timestep', [1, 5, 15, 30, 60])
+            + _sweep('batteries', [1, 10, 50, 100, 200], timestep=15)
+            + _sweep('evs', [10, 50, 100], timestep=15)
+            + _sweep('gensets', [2, 10], timestep=15)
+            + _sweep('load_circuits', [2, 10, 50], timestep=15)
+            + _sweep('nodes', [5, 20, 50, 100], network='simple', batteries=10, timestep=15)
+            + _sweep('nodes', [5, 10, 20, 50, 100], network='powerflow', batteries=10,
+                     timestep=60),
+}
+
+# metrics compared against the previous run and the default slow-down threshold
+TIMING_METRICS = ['build_s', 'write_s', 'solve_s', 'extract_s']
+REGRESSION_THRESHOLD = 1.25
+IMPORT_BUDGET = 3.0 # seconds for "import doper" in a fresh interpreter
+
+def case_name(case):
+    """Short unique name of a case."""
+    return '-'.join(f'{k}={case[k]}' for k in BASE_CASE)
+
+def make_case(horizon=24, timestep=5, batteries=1, evs=0, gensets=0, load_circuits=0,
+              network='single', nodes=1, seed=0):
+    """Scenario of a case, see doper.examples.scenarios.make_scenario."""
+    from doper.examples.scenarios import make_scenario
+    if network not in NETWORKS:
+        raise ValueError(f'Network "{network}" not supported, use one of {NETWORKS}.')
+    return make_scenario(nodes=1 if network == 'single' else nodes, batteries=batteries,
+                         evs=evs, gensets=gensets, load_circuits=load_circuits,
+                         horizon=horizon, timestep=timestep, powerflow=network == 'powerflow',
+                         seed=seed)
+
+def model_function(case):
+    """DOPER model function of a case, with network equations for multi-node cases."""
+    from doper.models.make_model import construct_model_function
+    from doper.models.network import add_network
+    control_model = construct_model_function()
+    if case['network'] == 'single':
+        return control_model
+
+    def network_model(inputs, parameter):
+        return add_network(control_model(inputs, parameter), inputs, parameter)
+    return network_model
+
+def run_case(case, time_limit=None):
+    '''
+        Builds, solves and post-processes one case. Run in a separate process.
+
+        Returns
+        -------
+            metrics (dict): Timings [s], peak memory [MB] and model size.
+    '''
+    from pyomo.opt import SolverFactory
+    from doper import DOPER, get_solver
+    from doper.utility import default_output_list, freeze_inputs, setup_solver
+
+    parameter, data = make_case(**case)
+    solver_path = get_solver('cbc')
+    setup_solver()
+    smart = DOPER(model=model_function(case), parameter=parameter,
+                  solver_path=solver_path, output_list=default_output_list(parameter))
+    metrics = {'timesteps': len(data)}
+
+    st = time.time()
+    smart.data = freeze_inputs(data)
+    smart.initialize_model(smart.data)
+    metrics['build_s'] = time.time() - st
+    metrics['variables'] = smart.model.nvariables()
+    metrics['constraints'] = smart.model.nconstraints()
+
+    with SolverFactory('cbc', executable=solver_path) as solver:
+        if time_limit:
+            solver.options['sec'] = time_limit
+        st = time.time()
+        result = solver.solve(smart.model, load_solutions=False, skip_trivial_constraints=True)
+        call = time.time() - st
+    # the solver reports its own subprocess time, the rest is writing and reading files
+    metrics['solve_s'] = float(result.solver.time)
+    metrics['write_s'] = call - metrics['solve_s']
+    metrics['termination'] = str(result.solver.termination_condition)
+    if metrics['termination'] not in ['optimal', 'maxTimeLimit']:
+        raise ValueError(f'Case not solved: {metrics["termination"]}.')
+
+    st = time.time()
+    smart.model.solutions.load_from(result)
+    metrics['objective'] = smart.model.objective()
+    smart.write_ts_results()
+    metrics['extract_s'] = time.time() - st
+
+    if resource:
+        scale = 1 / 1024**2 if sys.platform == 'darwin' else 1 / 1024 # bytes on macOS
+        metrics['peak_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        metrics['solver_peak_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return metrics
+
+def measure_import(repeat=3):
+    """Best wall time of "import doper" in a fresh interpreter."""
+    times = []
+    for _ in range(repeat):
+        st = time.time()
+        sp.check_call([sys.executable, '-c', 'import doper'], cwd=ROOT)
+        times.append(time.time() - st)
+    return min(times)
+
+def read_history(path):
+    """Records of previous runs."""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(record, history, threshold=REGRESSION_THRESHOLD):
+    """Metrics which are slower than threshold times the previous run of the case."""
+    previous = [r for r in history if r['case'] == record['case'] and 'error' not in r]
+    if not previous or 'error' in record:
+        return {}
+    previous = previous[-1]
+    regressions = {}
+    for k in TIMING_METRICS + ['import_s']:
+        if k in record and previous.get(k):
+            # ignore changes below 10 ms
+            if record[k] > previous[k] * threshold and record[k] - previous[k] > 0.01:
+                regressions[k] = record[k] / previous[k]
+    return regressions
+
+def _git_commit():
+    """Current git commit, if available."""
+    try:
+        return sp.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                               stderr=sp.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DOPER benchmark suite.')
+    parser.add_argument('--suite', default='quick', choices=sorted(SUITES))
+    parser.add_argument('--filter', default=None, help='only cases whose name contains this')
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'history.jsonl'),
+                        help='JSON lines file with the results of previous runs')
+    parser.add_argument('--time-limit', type=float, default=None, help='solver time limit [s]')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='report metrics slower than threshold times the previous run')
+    args = parser.parse_args(argv)
+
+    import doper
+    history = read_history(args.history)
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'version': doper.__version__,
+            'commit': _git_commit(), 'python': platform.python_version(),
+            'machine': platform.node()}
+
+    records = [dict(meta, case='import', import_s=measure_import())]
+    if records[0]['import_s'] > IMPORT_BUDGET:
+        print(f'WARNING: import doper took {records[0]["import_s"]:.2f} s, '
+              f'budget is {IMPORT_BUDGET:.2f} s.')
+    cases = [c for c in SUITES[args.suite] if not args.filter or args.filter in case_name(c)]
+    for case in cases:
+        record = dict(meta, case=case_name(case), spec=case)
+        try:
+            # fresh process per case, so the peak memory is per case
+            with ProcessPoolExecutor(1, mp_context=mp.get_context('spawn')) as pool:
+                record.update(pool.submit(run_case, case, args.time_limit).result())
+        except Exception as e:
+            record['error'] = str(e)
+        records.append(record)
+
+    # report
+    regressed = False
+    print(f'{"case":<90} {"build":>7} {"write":>7} {"solve":>7} {"extract":>7} {"peak MB":>8}')
+    for record in records:
+        if 'import_s' in record:
+            line = f'{record["case"]:<90} {record["import_s"]:7.2f}'
+        elif 'error' in record:
+            line = f'{record["case"]:<90} ERROR: {record["error"]}'
+        else:
+            line = f'{record["case"]:<90} ' \
+                + ' '.join(f'{record[k]:7.2f}' for k in TIMING_METRICS) \
+                + f' {record.get("peak_mb", float("nan")):8.1f}'
+        regressions = compare(record, history, args.threshold)
+        if regressions:
+            regressed = True
+            line += '  SLOWER: ' + ', '.join(f'{k} x{v:.2f}' for k, v in regressions.items())
+        print(line)
+
+    if args.history:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, 'a', encoding='utf8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -65,9 +65,9 @@ def compute_periods(df, tariff, parameter, return_tariff=True, weekday_map=False
 
     tz_df = parameter['site']['input_timezone']
     tz_local = parameter['site']['local_timezone']
-    # Shift to local time
-    df.index = df.index.tz_localize(f'Etc/GMT{-1*tz_df:+d}') \
-        .tz_convert(tz_local)
+    # Shift to local time, on a new frame to leave the caller's inputs unchanged
+    df = df.set_axis(df.index.tz_localize(f'Etc/GMT{-1*tz_df:+d}') \
+        .tz_convert(tz_local))
     season = tariff['seasons_map'][tariff['seasons'][df.index[0].month]]
     # Generate tariff map for selected season
     tariff_map = {}
@@ -93,8 +93,8 @@ def compute_periods(df, tariff, parameter, return_tariff=True, weekday_map=False
     df['tariff_energy_export_map'] = 0
     df['tariff_regup'] = 0
     df['tariff_regdn'] = 0
-    df.index = df.index.tz_convert(f'Etc/GMT{-1*tz_df:+d}') \
-        .tz_localize(None)
+    df = df.set_axis(df.index.tz_convert(f'Etc/GMT{-1*tz_df:+d}') \
+        .tz_localize(None))
     if return_tariff:
         return df, parameter
     return df
@@ -1,6 +1,8 @@
 import time
-from pymodbus.client import ModbusSerialClient
-from pymodbus.client import ModbusTcpClient
+import asyncio
+import numpy as np
+from pymodbus.client import ModbusSerialClient, AsyncModbusSerialClient
+from pymodbus.client import ModbusTcpClient, AsyncModbusTcpClient
 from pymodbus.client.mixin import ModbusClientMixin
 from pymodbus.framer import FramerType
 from pymodbus import pymodbus_apply_logging_config
@@ -8,10 +10,20 @@ from pymodbus import pymodbus_apply_logging_config
 MAX_RETRY = 5
 SLEEP = 0.5
 TIMEOUT = 0.5
+MAX_BLOCK = 125 # registers per read request (protocol maximum)
+MAX_GAP = 4 # unused registers read to merge two reads into one block
+MAX_WRITE_BLOCK = 123 # registers per write request (protocol maximum)
+ASYNC_MAX_RETRY = 2
+IDLE_TIMEOUT = 300 # close pooled connections unused for this long [s]
+BACKOFF = 0.1 # first retry delay of async requests, doubled on every retry
 
 # DATATYPES
 # https://github.com/pymodbus-dev/pymodbus/blob/dev/pymodbus/client/mixin.py#L680
 
+# numpy types of the registers of a value, most significant word first
+NUMPY_TYPES = {'int16': '>i2', 'uint16': '>u2', 'int32': '>i4', 'uint32': '>u4',
+               'int64': '>i8', 'uint64': '>u8', 'float32': '>f4', 'float64': '>f8'}
+
 def address_to_tuple(address):
     address = address.split(':')
     if len(address) > 1:
@@ -53,6 +65,105 @@ def modbus_client(port=None, ip=None, baudrate=9600, stopbits=1, timeout=TIMEOUT
         client.connect()
     return client
     
+def async_modbus_client(port=None, ip=None, baudrate=9600, stopbits=1, timeout=TIMEOUT,
+                        name="mb1", pmb_debug=False):
+    # asyncio client, not connected; retries are done by async_request
+    pymodbus_apply_logging_config(level=pmb_debug if pmb_debug else 'critical')
+    if ip:
+        port = port if port else 502
+        return AsyncModbusTcpClient(ip, port=port, timeout=timeout, framer=FramerType.SOCKET,
+                                    name=name, retries=0, reconnect_delay=0)
+    return AsyncModbusSerialClient(port=port, baudrate=int(baudrate),
+                                   parity='N', bytesize=8, stopbits=int(stopbits),
+                                   timeout=timeout, name=name, framer=FramerType.RTU,
+                                   retries=0, reconnect_delay=0)
+
+async def async_request(request, timeout=TIMEOUT, max_retry=ASYNC_MAX_RETRY, backoff=BACKOFF):
+    """Awaits request() with a timeout, retries with exponential backoff.
+
+    returns: the response (None if there was none) and the retries.
+    """
+    i = 0
+    while True:
+        try:
+            res = await asyncio.wait_for(request(), timeout)
+        except Exception:
+            res = None
+        if (res is not None and not res.isError()) or i >= max_retry:
+            return res, i
+        await asyncio.sleep(backoff * 2**i)
+        i += 1
+
+class ConnectionPool():
+    """Modbus clients kept open across calls, one per connection (see get_uniconn).
+
+    Clients are checked before use and reconnected if the connection was lost or
+    unused for longer than idle_timeout. Asyncio clients are bound to the event
+    loop they are used in, use the same loop for all calls.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, pmb_debug=False):
+        self.idle_timeout = idle_timeout
+        self.pmb_debug = pmb_debug
+        self.clients = {} # key: [client, last used]
+
+    def _take(self, key):
+        # pooled client of a key, None if expired
+        if key in self.clients:
+            client, last = self.clients[key]
+            if time.time() - last <= self.idle_timeout:
+                self.clients[key][1] = time.time()
+                return client
+            self.discard(key)
+        return None
+
+    def get(self, addr):
+        key = get_uniconn(addr)
+        client = self._take(key)
+        if client is None:
+            addr = address_to_tuple(addr)
+            client = modbus_client(port=addr[1], ip=addr[0], baudrate=addr[3],
+                                   pmb_debug=self.pmb_debug)
+            self.clients[key] = [client, time.time()]
+        elif not client.connected:
+            client.connect()
+        return client
+
+    async def get_async(self, addr, timeout=TIMEOUT):
+        key = ('async', get_uniconn(addr))
+        client = self._take(key)
+        if client is None:
+            addr = address_to_tuple(addr)
+            client = async_modbus_client(port=addr[1], ip=addr[0], baudrate=addr[3],
+                                         timeout=timeout, pmb_debug=self.pmb_debug)
+            self.clients[key] = [client, time.time()]
+        if not client.connected:
+            try:
+                await asyncio.wait_for(client.connect(), timeout)
+            except Exception:
+                pass
+        return client
+
+    def discard(self, key):
+        # close a client, reconnected on the next get
+        if not key in self.clients and not isinstance(key, tuple):
+            key = get_uniconn(key)
+        if key in self.clients:
+            try:
+                self.clients.pop(key)[0].close()
+            except Exception:
+                pass
+
+    def expire(self):
+        # close idle clients
+        now = time.time()
+        for key in [k for k, (_, last) in self.clients.items() if now - last > self.idle_timeout]:
+            self.discard(key)
+
+    def close(self):
+        for key in list(self.clients):
+            self.discard(key)
+
 ### Holding Registers ###
 def set_reading_method(client, holding=True):
     if holding:
@@ -62,8 +173,140 @@ def set_reading_method(client, holding=True):
     
 def swap_bytes_in_registers(registers):
     # 0x1234 -> 0x3412
-    return [((r & 0xFF) << 8) | ((r >> 8) & 0xFF) for r in registers]
-    
+    return np.asarray(registers, dtype=np.uint16).byteswap().tolist()
+
+def decode_values(registers, offsets, data_type='int16', order=['big','little'], scale=None):
+    """Decodes values of the same type from a register block at once.
+
+    registers: the register block.
+    offsets: offsets of the values in the block.
+    order: byte order in the registers and word order of the values.
+    scale: optional factors of the values.
+    returns: numpy array of the values.
+    """
+    count = register_count(data_type)
+    regs = np.asarray(registers, dtype=np.uint16)
+    words = regs[np.asarray(offsets, dtype=int)[:, None] + np.arange(count)]
+    if order[1] == 'little':
+        words = words[:, ::-1]
+    if order[0] == 'little':
+        words = words.byteswap()
+    values = np.ascontiguousarray(words).astype('>u2').view(NUMPY_TYPES[data_type])[:, 0]
+    if scale is not None:
+        values = values * np.asarray(scale)
+    return values
+
+def encode_values(values, data_type='int16', order=['big','little'], scale=None):
+    """Encodes values of the same type into registers at once, inverse of decode_values.
+
+    values: the values.
+    order: byte order in the registers and word order of the values.
+    scale: optional factors of the values.
+    returns: numpy array of the registers, one row per value.
+    """
+    values = np.asarray(values, dtype=float)
+    if scale is not None:
+        values = values / np.asarray(scale)
+    if not data_type.startswith('float'):
+        values = np.round(values)
+    words = values.astype(NUMPY_TYPES[data_type]).view('>u2')
+    words = words.reshape(len(values), register_count(data_type)).astype(np.uint16)
+    if order[1] == 'little':
+        words = words[:, ::-1]
+    if order[0] == 'little':
+        words = words.byteswap()
+    return words
+
+def register_count(data_type):
+    return ModbusClientMixin.DATATYPE[data_type.upper()].value[1]
+
+def decode_registers(registers, data_type='int16', order=['big','little']):
+    # decode a value from its registers, as read_register
+    data_type = ModbusClientMixin.DATATYPE[data_type.upper()]
+    if order[0] == 'little':
+        registers = swap_bytes_in_registers(registers)
+    return ModbusClientMixin.convert_from_registers(registers=registers,
+                                                    data_type=data_type,
+                                                    word_order=order[1])
+
+def plan_reads(reads, max_block=MAX_BLOCK, max_gap=MAX_GAP):
+    """Merges register reads into block reads.
+
+    reads: list of (key, register, count), where reads with the same key
+        (e.g. connection, device id and register type) can be merged.
+    max_block: maximum registers per block.
+    max_gap: maximum unused registers between two merged reads.
+    returns: list of blocks (key, start, count, items), items are
+        (index in reads, offset in block, count).
+    """
+    blocks = []
+    order = sorted(range(len(reads)), key=lambda i: (str(reads[i][0]), reads[i][1]))
+    for i in order:
+        key, register, count = reads[i]
+        if blocks:
+            b_key, start, b_count, items = blocks[-1]
+            end = max(start + b_count, register + count)
+            if b_key == key and register <= start + b_count + max_gap and end - start <= max_block:
+                blocks[-1] = (key, start, end - start, items + [(i, register - start, count)])
+                continue
+        blocks.append((key, register, count, [(i, 0, count)]))
+    return blocks
+
+def encode_registers(value, data_type='int16', order=['big','little']):
+    # registers of a value, as write_register
+    data_type = ModbusClientMixin.DATATYPE[data_type.upper()]
+    payload = ModbusClientMixin.convert_to_registers(value=value,
+                                                     data_type=data_type,
+                                                     word_order=order[1])
+    if order[0] == 'little':
+        payload = swap_bytes_in_registers(payload)
+    return payload
+
+def plan_writes(writes, max_block=MAX_WRITE_BLOCK):
+    """Merges register writes into block writes, only directly adjacent registers.
+
+    writes: list of (key, register, payload), see plan_reads.
+    returns: list of blocks (key, start, payload, items), items are
+        (index in writes, offset in block, count).
+    """
+    blocks = []
+    order = sorted(range(len(writes)), key=lambda i: (str(writes[i][0]), writes[i][1]))
+    for i in order:
+        key, register, payload = writes[i]
+        if blocks:
+            b_key, start, b_payload, items = blocks[-1]
+            if b_key == key and register == start + len(b_payload) \
+                    and len(b_payload) + len(payload) <= max_block:
+                blocks[-1] = (key, start, b_payload + list(payload),
+                              items + [(i, len(b_payload), len(payload))])
+                continue
+        blocks.append((key, register, list(payload), [(i, 0, len(payload))]))
+    return blocks
+
+def write_registers(client, address, payload, device_id, sleep=SLEEP, max_retry=MAX_RETRY):
+    # raw block write, returns the retries
+    res = client.write_registers(address, payload, device_id=device_id)
+    i = 0
+    while res.isError() and i < max_retry:
+        time.sleep(sleep)
+        res = client.write_registers(address, payload, device_id=device_id)
+        i += 1
+    return i
+
+def read_registers(client, address, count, device_id, holding=True, sleep=SLEEP,
+                   max_retry=MAX_RETRY):
+    # raw block read, returns the registers (None on error) and the retries
+    reader = set_reading_method(client, holding=holding)
+    res = reader(address, count=count, device_id=device_id)
+    i = 0
+    while res.isError() and i < max_retry:
+        time.sleep(sleep)
+        res = reader(address, count=count, device_id=device_id)
+        i += 1
+    if res.isError():
+        return None, i
+    return res.registers, i
+
 def read_register(client, address, device_id, data_type='int16', decode_res=True,
                   sleep=SLEEP, holding=True, order=['big','little'], batch_data=False,
                   max_retry=MAX_RETRY):
@@ -77,12 +320,9 @@ def read_register(client, address, device_id, data_type='int16', decode_res=True
         res = reader(address, count=count, device_id=device_id)
         i += 1
     if batch_data and decode_res:
-        res_dec = []
-        for rg in res.registers:
-            value = client.convert_from_registers(registers=[rg],
-                                                  data_type=data_type,
-                                                  word_order=order[1])
-            res_dec.append(value)
+        # every register is one value
+        res_dec = decode_values(res.registers, range(len(res.registers)),
+                                data_type.name.lower(), ['big', order[1]]).tolist()
         return res_dec, i
     elif not decode_res:
         return res, i
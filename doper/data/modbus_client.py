@@ -1,5 +1,6 @@
 import os
 import io
+import atexit
 import sys
 import json
 import time
@@ -19,8 +20,14 @@ except:
 # Import FMLC
 from fmlc import eFMU, controller_stack, check_error, pdlog_to_df
 
+import asyncio
 import doper.data.modbus as modbus_io
 
+# channel modes read in block reads and their data types
+READ_TYPES = {'int': 'int16', 'uint': 'uint16', 'float': 'float32'}
+REFRESH_INTERVAL = 300 # write unchanged values at least this often [s]
+POLL_TOLERANCE = 1 # read channels this early before their poll_interval [s]
+
 class dummy_connect():
     def close(self):
         pass
@@ -32,12 +39,60 @@ class communication_scada(eFMU):
                       'channels': None,
                       'sleep-between': None,
                       'pmb-debug': None,
-                      'mode': None}
+                      'mode': None,
+                      'block-size': None, # registers per block read, 1 reads channels one by one
+                      'max-gap': None, # unused registers to merge reads
+                      'async': None, # poll connections concurrently with asyncio
+                      'device-timeout': None, # timeout per request in async mode
+                      'idle-timeout': None, # keep connections open across calls, 0 to close after each call
+                      'deadband': None, # skip writes changed by at most this (also per channel), None writes all
+                      'refresh-interval': None} # write unchanged values at least every refresh-interval seconds
         self.output = {'output-data': None,
                        'duration': None}
 
         self.init = True
+        self.single_reads = set() # channels which failed in block reads
+        self.pool = None # connections kept across calls
+        self.loop = None # event loop of the pooled async clients
+        self.broken = set() # ids of clients whose requests raised or timed out
+        self.last_written = {} # last written value and time of each channel
+        self.read_cache = {} # last valid read and time of each channel
+        atexit.register(self.close)
         
+    def get_pool(self):
+        # connection pool, None if connections are closed after each call
+        idle_timeout = self.input.get('idle-timeout')
+        idle_timeout = modbus_io.IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        if not idle_timeout:
+            self.close()
+            return None
+        if self.pool is None:
+            self.pool = modbus_io.ConnectionPool(pmb_debug=self.pmb_debug)
+        self.pool.idle_timeout = idle_timeout
+        return self.pool
+
+    def release(self, clients):
+        # keep healthy pooled clients, close others
+        broken, self.broken = self.broken, set()
+        if self.pool is None:
+            [client.close() for client in clients.values()]
+            return
+        for key, client in clients.items():
+            if not client.connected or id(client) in broken:
+                self.pool.discard(key)
+        self.pool.expire()
+
+    def close(self):
+        # close all connections
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.loop is not None:
+            # async clients close in their loop
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+            self.loop = None
+
     def res_to_msg(self, res):
         if not 'error' in res.columns:
             msg = 'No result returned. Check channels dataframe.'
@@ -47,6 +102,195 @@ class communication_scada(eFMU):
             msg = 'Done.'
         return msg
         
+    def plan_blocks(self, channels):
+        # merge int, uint and float channels into block reads,
+        # returns blocks (key, start, count, items) with items (channel index, offset, count)
+        block_size = self.input.get('block-size') or modbus_io.MAX_BLOCK
+        max_gap = self.input.get('max-gap')
+        max_gap = modbus_io.MAX_GAP if max_gap is None else max_gap
+        reads, idx = [], []
+        for i, c in enumerate(channels):
+            if c['register'] == -1 or c['mode'] not in READ_TYPES:
+                continue
+            addr = modbus_io.address_to_tuple(c['address'])
+            if (c['name'], c['address'], c['register']) in self.single_reads:
+                continue
+            key = (modbus_io.get_uniconn(c['address']), addr[2], c.get('holding', True))
+            reads.append((key, c['register'], modbus_io.register_count(READ_TYPES[c['mode']])))
+            idx.append(i)
+        return [(key, start, count, [(idx[j], offset, n) for j, offset, n in items])
+                for key, start, count, items in modbus_io.plan_reads(reads, block_size, max_gap)]
+
+    def decode_block(self, channels, regs, items, duration):
+        # decode the channels of a block read, all channels of the same type and order at once
+        groups = {}
+        for i, offset, n in items:
+            c = channels[i]
+            order = c.get('order', ['big','little'])
+            if isinstance(order, str):
+                order = json.loads(order)
+            groups.setdefault((READ_TYPES[c['mode']], tuple(order)), []).append((i, offset))
+        res = {}
+        for (data_type, order), group in groups.items():
+            idx = [i for i, _ in group]
+            scale = [channels[i].get('scale') or 1 for i in idx]
+            try:
+                values = modbus_io.decode_values(regs, [offset for _, offset in group], data_type,
+                                                 order, scale if any(f != 1 for f in scale) else None)
+                values, errors = values.tolist(), [''] * len(idx)
+            except Exception as e:
+                values, errors = [channels[i]['default'] for i in idx], [f'ERROR: {e}'] * len(idx)
+            for i, value, error in zip(idx, values, errors):
+                res[i] = {'value': value, 'error': error, 'valid': int(error == ''),
+                          'duration': duration}
+        return res
+
+    def mark_single_reads(self, channels, items, res):
+        # a failed block whose channels can be read one by one (e.g. unmapped registers
+        # in the gaps), keep reading these channels one by one
+        if len(items) > 1 and any(res[i]['valid'] for i, _, _ in items):
+            self.single_reads.update((channels[i]['name'], channels[i]['address'],
+                                      channels[i]['register']) for i, _, _ in items)
+
+    def read_blocks(self, channels, clients, sleep=0.5, max_tries=1):
+        # read int, uint and float channels in merged block reads
+        res = {}
+        for key, start, count, items in self.plan_blocks(channels):
+            st = time.time()
+            try:
+                regs, i = modbus_io.read_registers(clients[key[0]], start, count, key[1],
+                                                   holding=key[2], sleep=sleep)
+                if regs is None or i > max_tries:
+                    regs = None
+            except Exception:
+                self.broken.add(id(clients[key[0]]))
+                regs = None
+            if regs is None:
+                # failed, read one by one
+                for i, _, _ in items:
+                    st_single = time.time()
+                    value, error = self.read_modbus(channels[i], clients[key[0]], sleep=sleep,
+                                                    max_tries=max_tries, dev_id=key[1])
+                    res[i] = {'value': value, 'error': error, 'valid': int(error == ''),
+                              'duration': time.time()-st_single}
+                self.mark_single_reads(channels, items, res)
+            else:
+                res.update(self.decode_block(channels, regs, items, time.time()-st))
+            if self.input['sleep-between']:
+                time.sleep(self.input['sleep-between'])
+        return res
+
+    async def poll_connection(self, channels, blocks, singles, timeout):
+        # poll the devices of one connection (gateway or serial port) one after another
+        res = {}
+        address = channels[blocks[0][3][0][0] if blocks else singles[0]]['address']
+        if self.pool is not None:
+            client = await self.pool.get_async(address, timeout)
+        else:
+            addr = modbus_io.address_to_tuple(address)
+            client = modbus_io.async_modbus_client(port=addr[1], ip=addr[0], baudrate=addr[3],
+                                                   timeout=timeout, pmb_debug=self.pmb_debug)
+        down = set() # devices which did not respond
+        def failed(i, error):
+            res[i] = {'value': channels[i]['default'], 'error': error, 'valid': 0, 'duration': 0}
+
+        async def request(func):
+            # no response if the request raised or timed out
+            r = await modbus_io.async_request(func, timeout=timeout)
+            if r[0] is None:
+                self.broken.add(id(client))
+            return r
+
+        async def read(device_id, holding, start, count):
+            reader = client.read_holding_registers if holding else client.read_input_registers
+            return await request(lambda: reader(start, count=count, device_id=device_id))
+
+        try:
+            if not client.connected:
+                try:
+                    await asyncio.wait_for(client.connect(), timeout)
+                except Exception:
+                    pass
+            if not client.connected:
+                for i in [i for b in blocks for i, _, _ in b[3]] + singles:
+                    failed(i, f'ERROR: Could not connect to {channels[i]["address"]}.')
+                return res
+
+            for key, start, count, items in blocks:
+                st = time.time()
+                if key[1] in down:
+                    [failed(i, 'ERROR: Device not responding.') for i, _, _ in items]
+                    continue
+                r, _ = await read(key[1], key[2], start, count)
+                if r is None:
+                    down.add(key[1])
+                    [failed(i, 'ERROR: Device not responding.') for i, _, _ in items]
+                elif not r.isError():
+                    res.update(self.decode_block(channels, r.registers, items, time.time()-st))
+                else:
+                    # failed, read one by one
+                    for i, offset, n in items:
+                        st = time.time()
+                        r, _ = await read(key[1], key[2], channels[i]['register'], n)
+                        if r is None or r.isError():
+                            failed(i, f'ERROR: Could not read value: {r}')
+                        else:
+                            res.update(self.decode_block(channels, r.registers, [(i, 0, n)],
+                                                         time.time()-st))
+                    self.mark_single_reads(channels, items, res)
+
+            for i in singles:
+                c = channels[i]
+                st = time.time()
+                device_id = modbus_io.address_to_tuple(c['address'])[2]
+                if c['mode'] not in READ_TYPES and c['mode'] != 'coil':
+                    failed(i, f'ERROR: Mode "{c["mode"]}" not implemented.')
+                    continue
+                if device_id in down:
+                    failed(i, 'ERROR: Device not responding.')
+                    continue
+                if c['mode'] in READ_TYPES:
+                    # channels of failed blocks, read one by one
+                    n = modbus_io.register_count(READ_TYPES[c['mode']])
+                    r, _ = await read(device_id, c.get('holding', True), c['register'], n)
+                    if r is None or r.isError():
+                        failed(i, f'ERROR: Could not read value: {r}')
+                    else:
+                        res.update(self.decode_block(channels, r.registers, [(i, 0, n)],
+                                                     time.time()-st))
+                    continue
+                r, _ = await request(
+                    lambda: client.read_coils(c['register'], count=1, device_id=device_id))
+                if r is None or r.isError():
+                    failed(i, f'ERROR: Could not read value: {r}')
+                else:
+                    res[i] = {'value': r.bits[0], 'error': '', 'valid': 1,
+                              'duration': time.time()-st}
+        finally:
+            if self.pool is None:
+                client.close()
+            elif down or not client.connected or id(client) in self.broken:
+                # reconnect on the next call
+                self.pool.discard(('async', modbus_io.get_uniconn(address)))
+        return res
+
+    async def read_async(self, channels):
+        # poll all connections concurrently
+        timeout = self.input.get('device-timeout') or modbus_io.TIMEOUT
+        blocks = self.plan_blocks(channels)
+        in_blocks = {i for b in blocks for i, _, _ in b[3]}
+        connections = {}
+        for b in blocks:
+            connections.setdefault(b[0][0], ([], []))[0].append(b)
+        for i, c in enumerate(channels):
+            if c['register'] != -1 and i not in in_blocks:
+                connections.setdefault(modbus_io.get_uniconn(c['address']), ([], []))[1].append(i)
+        res = {}
+        for r in await asyncio.gather(*[self.poll_connection(channels, b, singles, timeout)
+                                        for b, singles in connections.values()]):
+            res.update(r)
+        return res
+
     def read_modbus(self, channel, client, sleep=0.5, max_tries=1, dev_id=0):
         register = channel['register']
         mode = channel['mode']
@@ -85,6 +329,7 @@ class communication_scada(eFMU):
             else:
                 return [r, '']                
         except Exception as e:
+            self.broken.add(id(client))
             return default, f'ERROR: {e}'
         
     def write_modbus(self, channel, value, client, sleep=0.5, max_tries=1, dev_id=0):
@@ -105,7 +350,7 @@ class communication_scada(eFMU):
                 i = modbus_io.write_register(client, register, dev_id, int(value),
                     data_type='uint16', sleep=sleep, order=order)
             elif mode == 'float':
-                i = modbus_io.write_register(client, register, dev_id, int(value),
+                i = modbus_io.write_register(client, register, dev_id, float(value),
                     data_type='float32', sleep=sleep, order=order)
             elif mode == 'coil':
                 i = modbus_io.write_coil(client, register, dev_id, value, sleep=sleep)
@@ -117,6 +362,7 @@ class communication_scada(eFMU):
             else:
                 return ''
         except Exception as e:
+            self.broken.add(id(client))
             return f'ERROR: {e}'
 
     def get_scada(self):
@@ -126,7 +372,7 @@ class communication_scada(eFMU):
         try:
             # connect modbus
             clients = {'dummy': dummy_connect()}
-            channels = json.loads(self.input['channels'])
+            channels = all_channels = json.loads(self.input['channels'])
             
             if pd.DataFrame(channels)['name'].duplicated().any():
                 raise ValueError(f'Duplicated entries in channel names.')
@@ -138,99 +384,224 @@ class communication_scada(eFMU):
             #client = ModbusTcpClient(host=address[0], port=address[1], framer=ModbusSocketFramer)
             #client.connect()
 
+            # channels with a poll_interval which are not due are served from the cache
+            now = time.time()
+            cached = {}
+            for c in channels:
+                entry = self.read_cache.get((c['name'], c['address'], c['register']))
+                if entry is not None and c.get('poll_interval') \
+                        and now - entry[1] + POLL_TOLERANCE < c['poll_interval']:
+                    cached[c['name']] = dict(entry[0], age=now-entry[1], duration=0)
+            channels = [c for c in channels if not c['name'] in cached]
+
             # connect clients
             clients = {}
-            for addr in sorted(np.unique([e['address'] for e in channels])):
-                # filter same com port
-                client = modbus_io.get_uniconn(addr)
-                if not client in clients:
-                    addr2 = modbus_io.address_to_tuple(addr)
-                    clients[client] = modbus_io.modbus_client(port=addr2[1], ip=addr2[0], baudrate=addr2[3],
-                                                              pmb_debug=self.pmb_debug)
-                    # clients[addr].connect()
-            
-            # read
-            for c in channels:
+            pool = self.get_pool()
+            if self.input.get('async'):
+                # all connections concurrently, connects its own clients
+                if pool is None:
+                    blocks = asyncio.run(self.read_async(channels))
+                else:
+                    if self.loop is None:
+                        self.loop = asyncio.new_event_loop()
+                    blocks = self.loop.run_until_complete(self.read_async(channels))
+            else:
+                for addr in sorted(np.unique([e['address'] for e in channels])):
+                    # filter same com port
+                    client = modbus_io.get_uniconn(addr)
+                    if not client in clients:
+                        if pool is not None:
+                            clients[client] = pool.get(addr)
+                            continue
+                        addr2 = modbus_io.address_to_tuple(addr)
+                        clients[client] = modbus_io.modbus_client(port=addr2[1], ip=addr2[0], baudrate=addr2[3],
+                                                                  pmb_debug=self.pmb_debug)
+                        # clients[addr].connect()
+
+                # read registers in blocks
+                blocks = self.read_blocks(channels, clients)
+
+            # read others
+            for i, c in enumerate(channels):
                 st = time.time()
                 r = {}
                 addr = c['address']
-                client = clients[modbus_io.get_uniconn(addr)]
-                if c['register'] == -1:
+                if i in blocks:
+                    r = blocks[i]
+                elif c['register'] == -1:
                     # dummy; use default
                     r['value'] = c['default']
                     r['error'] = ''
                     r['valid'] = 0
                 else:
+                    client = clients[modbus_io.get_uniconn(addr)]
                     r['value'], r['error'] = self.read_modbus(c, client, dev_id=modbus_io.address_to_tuple(addr)[2])
                     r['valid'] = int(r['error'] == '')
                 r['name'] = c['name']
-                r['duration'] = time.time()-st
+                if not i in blocks:
+                    r['duration'] = time.time()-st
                 res.append(r)
-                if self.input['sleep-between']:
+                if self.input['sleep-between'] and not i in blocks:
                     time.sleep(self.input['sleep-between'])
-            res = pd.DataFrame(res)
+
+            # update the cache, serve cached values of failed reads up to max_age
+            now = time.time()
+            for c, r in zip(channels, res):
+                key = (c['name'], c['address'], c['register'])
+                r['age'] = 0
+                if r['valid']:
+                    self.read_cache[key] = ({k: r[k] for k in ['value', 'error', 'valid']}, now)
+                elif key in self.read_cache and c.get('max_age') is not None \
+                        and now - self.read_cache[key][1] <= c['max_age']:
+                    entry = self.read_cache[key]
+                    r.update(entry[0], age=now-entry[1],
+                             error=f'WARNING: Read failed, cached value served. {r["error"]}')
+            res = {r['name']: r for r in res}
+            res.update(cached)
+            res = pd.DataFrame([res[c['name']] for c in all_channels])
         except Exception as e:
             e = f'ERROR: {e}\n\n{traceback.format_exc()}'
             res = pd.DataFrame(res)
-            for c in channels:
+            for c in all_channels:
                 if not c['name'] in res['name']:
-                    res.loc[len(res), ['name', 'value', 'error', 'valid', 'duration']] = \
-                        [c['name'], c['default'], f'ERROR: {e}', int(False), 0]
+                    res.loc[len(res), ['name', 'value', 'error', 'valid', 'duration', 'age']] = \
+                        [c['name'], c['default'], f'ERROR: {e}', int(False), 0, 0]
         finally:
-            [client.close() for client in clients.values()]
+            self.release(clients)
         if 'name' in res.columns:
             res.index = res['name']
         return res
         
+    def value_changed(self, channel, value):
+        # change-of-value check with the channel or 'deadband' input, writes at least
+        # every 'refresh-interval' seconds
+        deadband = channel.get('deadband')
+        if deadband is None:
+            # not set for this channel (missing or null)
+            deadband = self.input.get('deadband')
+        if deadband is None:
+            return True
+        refresh = self.input.get('refresh-interval')
+        refresh = REFRESH_INTERVAL if refresh is None else refresh
+        last = self.last_written.get((channel['name'], channel['address'], channel['register']))
+        if last is None or time.time() - last[1] >= refresh:
+            return True
+        try:
+            return abs(float(value) - float(last[0])) > deadband
+        except (TypeError, ValueError):
+            return value != last[0]
+
     def set_scada(self):
         inputs = pd.read_json(io.StringIO(self.input['input-data']))
-        res = []
+        res = {}
+        clients = {}
+        channels = []
         
         # set scada
         try:
-            # Connect modbus
-            client = dummy_connect()
             channels = json.loads(self.input['channels'])
             
             if pd.DataFrame(channels)['name'].duplicated().any():
                 raise ValueError(f'Duplicated entries in channel names.')
+
+            # always latest element
+            values = inputs.drop_duplicates('name', keep='last').set_index('name')['value']
             
-            address = np.unique([e['address'] for e in channels])
-            if len(address) > 1:
-                raise ValueError (f'Only same addresses are supported. {address}')
-            address = modbus_io.address_to_tuple(address[0])
-            client = modbus_io.modbus_client(port=address[1], ip=address[0], baudrate=address[3],
-                                             pmb_debug=self.pmb_debug)
-            # client.connect()
-            # Write
-            for c in channels:
+            # connect and encode
+            pool = self.get_pool()
+            writes, idx = [], []
+            for i, c in enumerate(channels):
                 name = c['name']
                 st = time.time()
-                r = {}
-                if name in inputs['name'].values:
-                    v = inputs['value'][inputs['name']==name].values[-1] # FIXME always latest element
-                    r['value'] = v
-                    r['error'] = self.write_modbus(c, v, client, dev_id=address[2])
-                    r['valid'] = int(r['error'] == '')
+                r = {'name': name, 'written': 0}
+                if not name in values.index:
+                    r.update({'value': None, 'valid': int(False), 'duration': 0,
+                              'error': f'ERROR: Channel "{name}" not in input-data.'})
+                    res[i] = r
+                    continue
+                v = values[name]
+                r['value'] = v
+                if not self.value_changed(c, v):
+                    # unchanged
+                    r.update({'error': '', 'valid': int(True), 'duration': 0})
+                    res[i] = r
+                    continue
+                addr = c['address']
+                conn = modbus_io.get_uniconn(addr)
+                if not conn in clients:
+                    if pool is not None:
+                        clients[conn] = pool.get(addr)
+                    else:
+                        addr2 = modbus_io.address_to_tuple(addr)
+                        clients[conn] = modbus_io.modbus_client(port=addr2[1], ip=addr2[0], baudrate=addr2[3],
+                                                                pmb_debug=self.pmb_debug)
+                dev_id = modbus_io.address_to_tuple(addr)[2]
+                if c['mode'] in READ_TYPES and c['register'] != -1:
+                    order = c.get('order', ['big','little'])
+                    if isinstance(order, str):
+                        order = json.loads(order)
+                    try:
+                        scale = c.get('scale') or 1
+                        if scale != 1:
+                            v = float(v) / scale
+                            v = v if c['mode'] == 'float' else int(round(v))
+                        else:
+                            v = float(v) if c['mode'] == 'float' else int(v)
+                        writes.append(((conn, dev_id), c['register'],
+                                       modbus_io.encode_registers(v, READ_TYPES[c['mode']], order)))
+                        idx.append(i)
+                        res[i] = r
+                        continue
+                    except Exception as e:
+                        r['error'] = f'ERROR: {e}'
                 else:
-                    r['value'] = None
-                    r['error'] = f'ERROR: Channel "{name}" not in input-data.'
-                    r['valid'] = int(False)
-                r['name'] = name
+                    r['error'] = self.write_modbus(c, v, clients[conn], dev_id=dev_id)
+                    if self.input['sleep-between']:
+                        time.sleep(self.input['sleep-between'])
+                r['valid'] = int(r['error'] == '')
+                r['written'] = r['valid']
                 r['duration'] = time.time()-st
-                res.append(r)
-                if self.input['sleep-between']:
-                    time.sleep(self.input['sleep-between'])
-            res = pd.DataFrame(res)
+                res[i] = r
+
+            # write adjacent registers in blocks
+            for (conn, dev_id), start, payload, items in modbus_io.plan_writes(writes):
+                blocks = [(start, payload, items)]
+                for k, (b_start, b_payload, b_items) in enumerate(blocks):
+                    st = time.time()
+                    try:
+                        i = modbus_io.write_registers(clients[conn], b_start, b_payload, dev_id)
+                        error = f'ERROR: Could not write value after {i} attempts.' if i > 1 else ''
+                    except Exception as e:
+                        self.broken.add(id(clients[conn]))
+                        error = f'ERROR: {e}'
+                    if error and len(b_items) > 1:
+                        # failed, write one by one
+                        blocks += [(writes[j][1], writes[j][2], [(j, 0, n)]) for j, _, n in b_items]
+                        continue
+                    for j, _, _ in b_items:
+                        r = res[idx[j]]
+                        r.update({'error': error, 'valid': int(error == ''),
+                                  'written': int(error == ''), 'duration': time.time()-st})
+                    if self.input['sleep-between']:
+                        time.sleep(self.input['sleep-between'])
+
+            # remember written values
+            for i, r in res.items():
+                if r['written']:
+                    c = channels[i]
+                    self.last_written[(c['name'], c['address'], c['register'])] = \
+                        (r['value'], time.time())
+            res = pd.DataFrame([res[i] for i in sorted(res)])
         except Exception as e:
             e = f'ERROR: {e}\n\n{traceback.format_exc()}'
-            res = pd.DataFrame(res)
-            for c in channels:
-                if not c['name'] in res['name']:
-                    res.loc[len(res), ['name', 'value', 'error', 'valid', 'duration']] = \
-                        [c['name'], c['value'], f'ERROR: {e}', int(False), 0]
+            for i, c in enumerate(channels):
+                if not i in res or not 'valid' in res[i]:
+                    res[i] = {'name': c['name'], 'value': res.get(i, {}).get('value'),
+                              'error': f'ERROR: {e}', 'valid': int(False), 'duration': 0,
+                              'written': 0}
+            res = pd.DataFrame([res[i] for i in sorted(res)])
         finally:
-            client.close()
+            self.release(clients)
         if 'name' in res.columns:
             res.index = res['name']
         return res
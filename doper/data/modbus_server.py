@@ -4,15 +4,20 @@ import sys
 import json
 import time
 import logging
+import asyncio
+import threading
+import hashlib
 import traceback
 import numpy as np
 import pandas as pd
 import datetime as dtm
 import subprocess as sp
 
-from pymodbus.server import StartTcpServer
+from pymodbus.server import StartTcpServer, ModbusTcpServer
 # from pymodbus.framer.socket_framer import ModbusSocketFramer
 from pymodbus.datastore import ModbusSequentialDataBlock, ModbusDeviceContext, ModbusServerContext
+from pymodbus.exceptions import NoSuchIdException
+from pymodbus.constants import ExcCodes
 
 try:
     root = os.path.dirname(os.path.abspath(__file__))
@@ -26,7 +31,12 @@ from fmlc import eFMU, controller_stack, check_error, pdlog_to_df
 from fmlc.stackedclasses import PythonDB_wrapper, write_db, read_db
 
 from pymodbus.client.mixin import ModbusClientMixin
-# import doper.data.modbus as modbus_io
+import doper.data.modbus as modbus_io
+
+SERVER_MODES = ['snapshot', 'subprocess']
+SERVER_TYPES = {'float': 'float32', 'int': 'int16'} # register types of the channel modes, else uint16
+REGISTER_FUNCTIONS = [3, 4, 6, 16, 22, 23] # function codes of holding and input registers
+START_TIMEOUT = 5
 
 class registerDummy:
     def __init__(self, v):
@@ -150,6 +160,185 @@ def make_dynamic_registers(channels, db_addr):
     hr = ModbusDataBlock(1, registers)
     return hr
 
+class SnapshotContext(ModbusServerContext):
+    """Server context which keeps the registers of each device in an array.
+    Values are updated in bulk with update() and requests are served from the
+    arrays, without database calls. Channels written by Modbus clients are
+    tracked and decoded only when read().
+    """
+
+    def __init__(self, channels):
+        """Initialize the registers with the channel defaults.
+
+        :param channels: DataFrame of the channels, as for server_scada
+        """
+        # served directly by the server, as the legacy simulator context
+        self.old_simulator = True
+        self.simdevices = []
+        self.lock = threading.Lock()
+        self.names = list(channels['name'])
+        self.index = {name: i for i, name in enumerate(self.names)}
+        if 'slave_id' in channels.columns:
+            self.devices = channels['slave_id'].astype(int).values
+        else:
+            # single device, serves all device ids
+            self.devices = np.zeros(len(channels), dtype=int)
+        self.registers = channels['register'].astype(int).values
+        self.types = np.array([SERVER_TYPES.get(str(m).lower(), 'uint16') for m in channels['mode']])
+        self.counts = np.array([modbus_io.register_count(t) for t in self.types])
+
+        # registers and channel of each register, per device
+        self.blocks = {}
+        self.owners = {}
+        for device in np.unique(self.devices).tolist():
+            ix = np.flatnonzero(self.devices == device)
+            size = (self.registers[ix] + self.counts[ix]).max() + 1
+            self.blocks[device] = np.zeros(size, dtype=np.uint16)
+            self.owners[device] = np.full(size, -1, dtype=int)
+            for i in ix:
+                self.owners[device][self.registers[i]:self.registers[i]+self.counts[i]] = i
+        self.values = [None] * len(self.names)
+        self.dirty = set() # channels written by clients since the last read
+        self.update(dict(zip(channels['name'], channels['default'])))
+
+    def update(self, values):
+        """Encode changed values into the registers.
+
+        :param values: dict of channel name and value
+        :returns: number of changed channels
+        """
+        changed = [(self.index[k], v) for k, v in values.items()
+                   if k in self.index and self.values[self.index[k]] != v]
+        if not changed:
+            return 0
+        ix = np.array([i for i, _ in changed])
+        v = np.array([v for _, v in changed], dtype=float)
+        with self.lock:
+            for data_type in np.unique(self.types[ix]):
+                sel = self.types[ix] == data_type
+                words = modbus_io.encode_values(v[sel], data_type, order=['big', 'big'])
+                for i, w in zip(ix[sel], words):
+                    self.blocks[self.devices[i]][self.registers[i]:self.registers[i]+len(w)] = w
+            for i, value in changed:
+                self.values[i] = value
+                self.dirty.discard(i)
+        return len(changed)
+
+    def read(self, names=None):
+        """Current values, decoding the channels written by clients.
+
+        :param names: channel names, all if None
+        :returns: dict of channel name and value
+        """
+        with self.lock:
+            if self.dirty:
+                ix = np.array(sorted(self.dirty))
+                for device in np.unique(self.devices[ix]):
+                    for data_type in np.unique(self.types[ix]):
+                        sel = ix[(self.devices[ix] == device) & (self.types[ix] == data_type)]
+                        if len(sel):
+                            v = modbus_io.decode_values(self.blocks[device], self.registers[sel],
+                                                        data_type, order=['big', 'big'])
+                            for i, value in zip(sel, v.tolist()):
+                                self.values[i] = value
+                self.dirty.clear()
+            values = list(self.values)
+        names = self.names if names is None else names
+        return {k: values[self.index[k]] for k in names if k in self.index}
+
+    def __get_device(self, device_id):
+        """Return device key."""
+        if device_id in self.blocks:
+            return device_id
+        if 0 in self.blocks:
+            return 0
+        raise NoSuchIdException(f"device_id - {device_id} does not exist, or is out of range")
+
+    async def async_getValues(self, device_id, func_code, address, count=1):
+        """Get `count` registers from the array of the device."""
+        device = self.__get_device(device_id)
+        if func_code not in REGISTER_FUNCTIONS:
+            return ExcCodes.ILLEGAL_FUNCTION
+        if address + count > len(self.blocks[device]):
+            return ExcCodes.ILLEGAL_ADDRESS
+        with self.lock:
+            return self.blocks[device][address:address+count].tolist()
+
+    async def async_setValues(self, device_id, func_code, address, values):
+        """Set registers of the device and mark their channels as written."""
+        device = self.__get_device(device_id)
+        if func_code not in REGISTER_FUNCTIONS:
+            return ExcCodes.ILLEGAL_FUNCTION
+        if address + len(values) > len(self.blocks[device]):
+            return ExcCodes.ILLEGAL_ADDRESS
+        with self.lock:
+            self.blocks[device][address:address+len(values)] = values
+            owners = self.owners[device][address:address+len(values)]
+            self.dirty.update(np.unique(owners[owners >= 0]).tolist())
+        return None
+
+    def device_ids(self):
+        """Get the configured device ids."""
+        return list(self.blocks.keys())
+
+class SnapshotServer():
+    """In-process Modbus TCP server of a SnapshotContext, in a background thread."""
+
+    def __init__(self, channels, log_level=logging.WARN, timeout=START_TIMEOUT):
+        """Start the server at the address of the first channel.
+
+        :param channels: DataFrame of the channels, as for server_scada
+        :param log_level: log level of pymodbus
+        :param timeout: time to wait for the server to listen [s]
+        """
+        self.context = SnapshotContext(channels)
+        address = channels['address'].iloc[0].split(':')
+        self.address = (address[0], int(address[1]))
+        logging.getLogger('pymodbus').setLevel(log_level)
+        self.server = None
+        self.error = None
+        self.started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),),
+                                       daemon=True)
+        self.thread.start()
+        if not self.started.wait(timeout):
+            self.error = f'Modbus server did not start within {timeout} s.'
+        if self.error:
+            self.stop()
+            raise RuntimeError(self.error)
+
+    async def run(self):
+        try:
+            self.server = ModbusTcpServer(self.context, address=self.address)
+            await self.server.serve_forever(background=True)
+        except Exception as e:
+            self.error = f'Modbus server at {self.address} failed: {e}'
+            self.started.set()
+            return
+        self.started.set()
+        await self.server.serving
+
+    def is_alive(self):
+        return self.thread.is_alive() and self.error is None
+
+    def update(self, values):
+        return self.context.update(values)
+
+    def read(self, names=None):
+        return self.context.read(names)
+
+    def stop(self, timeout=START_TIMEOUT):
+        if self.server is not None and self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self.server.shutdown(), self.loop).result(timeout)
+        self.thread.join(timeout)
+        if not self.thread.is_alive():
+            self.loop.close()
+
+    def kill(self):
+        # same interface as the legacy subprocess
+        self.stop()
+
 def make_scada_server(slave_ids=None, log_level=logging.WARN):
     # send pid
     # print(os.getpid())
@@ -175,7 +364,7 @@ def make_scada_server(slave_ids=None, log_level=logging.WARN):
         hr = make_dynamic_registers(channels, db_addr)
         slaves = ModbusDeviceContext(hr=hr)
         single = True
-    context = ModbusServerContext(slaves=slaves, single=single)
+    context = ModbusServerContext(devices=slaves, single=single)
 
     # setup logging
     logging.basicConfig()
@@ -197,12 +386,31 @@ def kill_scada_server():
 
 class server_scada(eFMU):
     def __init__(self):
-        self.input = {'input-data':None, 'debug':None, 'timeout':None, 'channels':None}
+        self.input = {'input-data':None, 'debug':None, 'timeout':None, 'channels':None,
+                      'server-mode':None} # 'snapshot' (in-process, default) or 'subprocess'
         self.output = {'output-data':None, 'duration':None}
         
         self.init = True
         self.database = None
         self.modbus = None
+        self.modbus_channels = None
+        self.channels_hash = None
+        self.sent = {} # values written to the server, only changes are sent
+
+    def parse_channels(self):
+        # parse channels only when their content changed
+        channels_hash = hashlib.sha1(self.input['channels'].encode()).hexdigest()
+        if channels_hash != self.channels_hash:
+            self.channels = pd.read_json(io.StringIO(self.input['channels']))
+            self.channels_write = set(self.channels['name'][self.channels['access']=='r'])
+            self.channels_read = list(self.channels['name'][self.channels['access']=='w'])
+            self.channels_hash = channels_hash
+
+    def get_server_mode(self):
+        mode = self.input.get('server-mode') or SERVER_MODES[0]
+        if mode not in SERVER_MODES:
+            raise ValueError(f'Server mode "{mode}" not supported, use one of {SERVER_MODES}.')
+        return mode
 
     def check_init_db(self):
         # check if database is running and responding
@@ -218,25 +426,45 @@ class server_scada(eFMU):
             self.database = PythonDB_wrapper(self.name, 'pythonDB')
             self.database.address = '127.0.0.1:'+str(self.database.port)
             # init database
-            write_db({r[1]['name']: r[1]['default'] for r in self.channels.iterrows()}, self.database.address)
+            write_db(dict(zip(self.channels['name'], self.channels['default'])), self.database.address)
+            self.sent = {}
 
         return self.database.error
 
     def check_init_modbus(self):
-        # check if modbus is running and responding
+        mode = self.get_server_mode()
+        # check if modbus is running and responding, with the current channels
         if self.modbus:
-            try:
-                pass
-            except:
-                self.modbus.kill()
-                self.modbus = None
+            if mode == 'snapshot':
+                alive = isinstance(self.modbus, SnapshotServer) and self.modbus.is_alive()
+            else:
+                alive = isinstance(self.modbus, sp.Popen) and self.modbus.poll() is None
+            if not alive or self.modbus_channels != self.channels_hash:
+                self.close()
 
         # start modbus if not running
         if self.modbus is None:
-            log_level = 'debug' if self.input['debug'] else ''
-            self.modbus = sp.Popen([f"exec python3 -u scada_server.py {self.database.address} '{self.channels.to_json()}' {log_level}"], shell=True, cwd=root)
+            if mode == 'snapshot':
+                log_level = logging.DEBUG if self.input['debug'] else logging.WARN
+                try:
+                    self.modbus = SnapshotServer(self.channels, log_level=log_level)
+                except Exception as e:
+                    return f'ERROR: {e}\n\n{traceback.format_exc()}'
+            else:
+                log_level = ['debug'] if self.input['debug'] else []
+                self.modbus = sp.Popen([sys.executable, '-u', os.path.join(root, 'modbus_server.py'),
+                                        self.database.address, self.channels.to_json()] + log_level,
+                                       cwd=root)
+            self.modbus_channels = self.channels_hash
+            self.sent = {}
             
-        return ''       
+        return ''
+
+    def close(self):
+        # stop the modbus server
+        if self.modbus is not None:
+            self.modbus.kill()
+            self.modbus = None
         
     def compute(self):
         st = time.time()
@@ -246,10 +474,11 @@ class server_scada(eFMU):
         msg += self.check_data(self.input['input-data'], self.init)
         
         if msg == '':
-            self.channels = pd.read_json(io.StringIO(self.input['channels']))
+            self.parse_channels()
             
-            # check if pythonDB is running otherwise start it
-            msg += self.check_init_db()
+            # check if pythonDB is running otherwise start it, only for the subprocess server
+            if self.get_server_mode() == 'subprocess':
+                msg += self.check_init_db()
 
             # check if Modbus Server is running otherwise start it
             msg += self.check_init_modbus()
@@ -257,11 +486,23 @@ class server_scada(eFMU):
         # sync Modbus with Controller stack
         if msg == '':
             try:
-                channels_write = self.channels['name'][self.channels['access']=='r'].values
                 input_data = pd.read_json(io.StringIO(self.input['input-data'])).set_index('name')['value'].to_dict()
-                write_db({k:v for k,v in input_data.items() if k in channels_write}, self.database.address)
-                channels_read = self.channels['name'][self.channels['access']=='w'].values
-                self.output['output-data'] = {k:v for k,v in read_db(self.database.address).items() if k in channels_read}
+                # only send changed values
+                changed = {k:v for k,v in input_data.items()
+                           if k in self.channels_write and (k not in self.sent or self.sent[k] != v)}
+                if isinstance(self.modbus, SnapshotServer):
+                    self.modbus.update(changed)
+                    self.output['output-data'] = self.modbus.read(self.channels_read)
+                else:
+                    if changed:
+                        res = write_db(changed, self.database.address)
+                        if isinstance(res, str):
+                            raise ConnectionError(res)
+                    data = read_db(self.database.address)
+                    if isinstance(data, str):
+                        raise ConnectionError(data)
+                    self.output['output-data'] = {k:data[k] for k in self.channels_read if k in data}
+                self.sent.update(changed)
             except Exception as e:
                 msg += f'ERROR: {e}\n\n{traceback.format_exc()}'
 
@@ -0,0 +1,346 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+"""Distributed Optimal and Predictive Energy Resources
+Run log module.
+
+Append-only store of optimization runs (inputs, parameter, results and
+timings), partitioned by date and instance:
+
+    {path}/parameters/{hash}.json                 parameters, deduplicated by hash
+    {path}/date=2024-01-31/instance_id=1/*.drl    segments of batched runs
+
+Each segment holds a batch of runs as two zlib compressed tables in the
+'columnar' transport format: the runs (one row per run) and their inputs
+(all timeseries stacked). The header of a segment holds its time range, so
+reads by time range skip partitions by name and segments by header, and only
+decompress the inputs when they are requested. Writes are queued and written
+in batches by a background thread.
+
+    run_log = RunLog('./logs')
+    run_log.append('1', parameter, data, {'objective': 1.0, 'duration': 0.5})
+    run_log.close()
+    runs, inputs = RunLog('./logs').read(start='2024-01-01', end='2024-01-08')
+"""
+
+import os
+import json
+import uuid
+import atexit
+import zlib
+import queue
+import struct
+import hashlib
+import logging
+import threading
+import time as _time
+import pandas as pd
+
+from .transport import encode_frame, decode_frame
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b'DOPERRUN1\n'
+SEGMENT_EXTENSION = '.drl'
+RESULT_KEYS = ['objective', 'termination', 'duration']
+_STOP = object() # stops the background writer
+
+def parameter_hash(parameter):
+    """Hash of a parameter dict or its JSON string."""
+    if not isinstance(parameter, str):
+        parameter = json.dumps(parameter, sort_keys=True, default=str)
+    return hashlib.sha1(parameter.encode('utf8')).hexdigest()[:16]
+
+def _to_time(t):
+    """Timestamp of a bound, None if not given."""
+    return None if t is None else pd.Timestamp(t)
+
+def _naive(t):
+    """Naive timestamp (UTC for tz-aware ones), to compare bounds and runs."""
+    t = pd.Timestamp(t)
+    return t.tz_convert('UTC').tz_localize(None) if t.tzinfo else t
+
+def write_segment(path, runs, inputs, level=6):
+    '''
+        Writes a segment file. The file is written in full and then renamed,
+        so readers never see partial segments.
+
+        Input
+        -----
+            path (str): Path of the segment file.
+            runs (pandas.DataFrame): One row per run, with a 'time' column.
+            inputs (pandas.DataFrame): Stacked inputs, with a 'run_index' column
+                referring to the row of the run.
+            level (int): zlib compression level. (default=6)
+    '''
+    blobs = [zlib.compress(encode_frame(runs, 'columnar'), level),
+             zlib.compress(encode_frame(inputs, 'columnar'), level)]
+    times = runs['time'].map(_naive)
+    header = json.dumps({'first': str(times.min()), 'last': str(times.max()), 'n': len(runs),
+                         'blobs': [len(b) for b in blobs]}).encode('utf8')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SEGMENT_MAGIC + struct.pack('<I', len(header)) + header + b''.join(blobs))
+    os.replace(tmp, path)
+
+def read_segment(path, start=None, end=None, inputs=True):
+    '''
+        Reads the runs of a segment file within a time range.
+
+        Input
+        -----
+            path (str): Path of the segment file.
+            start, end (pandas.Timestamp): Time range of the runs, naive or UTC. (default=None)
+            inputs (bool): Also read the inputs. (default=True)
+
+        Returns
+        -------
+            runs (pandas.DataFrame): The runs, None if none in the time range.
+            inputs (pandas.DataFrame): The inputs of these runs, None if not requested.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError(f'Not a run log segment: {path}')
+        length = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(length).decode('utf8'))
+        if (start is not None and pd.Timestamp(header['last']) < start) \
+                or (end is not None and pd.Timestamp(header['first']) > end):
+            return None, None
+        runs = decode_frame(zlib.decompress(f.read(header['blobs'][0])))
+        times = runs['time'].map(_naive)
+        keep = pd.Series(True, index=runs.index)
+        if start is not None:
+            keep &= times >= start
+        if end is not None:
+            keep &= times <= end
+        if not keep.any():
+            return None, None
+        runs = runs[keep]
+        if not inputs:
+            return runs, None
+        data = decode_frame(zlib.decompress(f.read(header['blobs'][1])))
+        return runs, data[data['run_index'].isin(runs['run_index'])]
+
+class RunLog:
+    '''
+        Append-only run log, see the module documentation.
+
+        Input
+        -----
+            path (str): Root directory of the store.
+            batch_size (int): Runs per segment. (default=100)
+            flush_interval (float): Write a segment at least every flush_interval
+                seconds, also when the batch is not full. (default=3600)
+            background (bool): Write in a background thread, else on flush and when
+                the batch is full. (default=True)
+    '''
+
+    def __init__(self, path, batch_size=100, flush_interval=3600, background=True):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        self._pending = []
+        self._known = set() # parameter hashes already stored
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, instance_id, parameter, data, results=None):
+        '''
+            Adds a run. Only queues the run, the inputs and parameter must not be
+            modified afterwards (DOPER does not modify them).
+
+            Input
+            -----
+                instance_id (str): Instance identifier, the controller instance_id.
+                parameter (dict or str): Parameter of the run, or its JSON string.
+                data (pandas.DataFrame): Inputs of the run, with a datetime index.
+                results (dict): Results of the run, objective, termination, duration and
+                    others (e.g. setpoints), stored as JSON. (default=None)
+
+            Returns
+            -------
+                run (str): The run id, instance_id/time.
+        '''
+        if not isinstance(parameter, str):
+            parameter = json.dumps(parameter, default=str)
+        run = f'{instance_id}/{data.index[0]}'
+        self._queue.put((str(instance_id), parameter, data, results or {}, run))
+        if self.background:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, daemon=True,
+                                                name='doper-runlog')
+                self._thread.start()
+                # write the queued runs when the interpreter exits
+                atexit.register(self.close)
+        elif self._queue.qsize() >= self.batch_size:
+            self.flush()
+        return run
+
+    def _worker(self):
+        """Background writer, writes full batches and at least every flush_interval."""
+        last = _time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=min(self.flush_interval, 1))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                with self._lock:
+                    self._pending.append(item)
+            if len(self._pending) >= self.batch_size or (
+                    self._pending and _time.time() - last > self.flush_interval):
+                self._write()
+                last = _time.time()
+
+    def flush(self):
+        """Writes all queued runs."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                continue
+            with self._lock:
+                self._pending.append(item)
+        self._write()
+
+    def close(self):
+        """Stops the background writer and writes all queued runs."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _store_parameter(self, parameter):
+        """Stores a parameter once, returns its hash."""
+        key = parameter_hash(json.loads(parameter))
+        if key not in self._known:
+            path = os.path.join(self.path, 'parameters', key + '.json')
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf8') as f:
+                    f.write(parameter)
+                os.replace(path + '.tmp', path)
+            self._known.add(key)
+        return key
+
+    def _write(self):
+        """Writes the pending runs, one segment per date and instance."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            partitions = {}
+            for instance_id, parameter, data, results, run in pending:
+                key = (str(_naive(data.index[0]).date()), instance_id)
+                partitions.setdefault(key, []).append((parameter, data, results, run))
+            for (date, instance_id), items in partitions.items():
+                runs, inputs = [], []
+                for i, (parameter, data, results, run) in enumerate(items):
+                    row = {'run': run, 'run_index': i, 'instance_id': instance_id,
+                           'time': data.index[0],
+                           'parameter_hash': self._store_parameter(parameter)}
+                    row.update({k: results.get(k) for k in RESULT_KEYS})
+                    row['termination'] = str(row['termination'])
+                    row['results'] = json.dumps(results, default=str)
+                    row['columns'] = json.dumps([str(c) for c in data.columns])
+                    runs.append(row)
+                    inputs.append(data.assign(run_index=i))
+                runs = pd.DataFrame(runs)
+                runs['objective'] = runs['objective'].astype(float)
+                runs['duration'] = runs['duration'].astype(float)
+                runs['time'] = pd.to_datetime(runs['time'].map(_naive))
+                partition = os.path.join(self.path, f'date={date}', f'instance_id={instance_id}')
+                os.makedirs(partition, exist_ok=True)
+                name = f'{_time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+                write_segment(os.path.join(partition, name + SEGMENT_EXTENSION), runs,
+                              pd.concat(inputs))
+        except Exception as e:
+            logger.error(f'Could not write {len(pending)} runs to the run log: {e}')
+
+    def parameter(self, key):
+        """Parameter dict of a hash."""
+        with open(os.path.join(self.path, 'parameters', key + '.json'), 'r',
+                  encoding='utf8') as f:
+            return json.loads(f.read())
+
+    def segments(self, start=None, end=None, instance_id=None):
+        """Segment files of the date partitions in the time range."""
+        start, end = _to_time(start), _to_time(end)
+        paths = []
+        if not os.path.isdir(self.path):
+            return paths
+        for date_dir in sorted(os.listdir(self.path)):
+            if not date_dir.startswith('date='):
+                continue
+            date = pd.Timestamp(date_dir[len('date='):])
+            # partitions hold the runs starting on their date
+            if (start is not None and date + pd.Timedelta(days=1) <= _naive(start).normalize()) \
+                    or (end is not None and date > _naive(end)):
+                continue
+            for instance_dir in sorted(os.listdir(os.path.join(self.path, date_dir))):
+                if instance_id is not None and instance_dir != f'instance_id={instance_id}':
+                    continue
+                folder = os.path.join(self.path, date_dir, instance_dir)
+                paths += [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                          if f.endswith(SEGMENT_EXTENSION)]
+        return paths
+
+    def read(self, start=None, end=None, instance_id=None, inputs=True):
+        '''
+            Reads the runs of a time range with one scan over the store.
+
+            Input
+            -----
+                start, end (str or pandas.Timestamp): Time range of the first timestep
+                    of the runs, inclusive, tz-aware times are compared in UTC. (default=None)
+                instance_id (str): Only runs of this instance. (default=None)
+                inputs (bool): Also read the inputs. (default=True)
+
+            Returns
+            -------
+                runs (pandas.DataFrame): One row per run, indexed by run id, with the
+                    instance_id, time, parameter_hash, objective, termination, duration
+                    and the results as JSON string.
+                inputs (dict): Inputs dataframe of each run id, empty if not requested.
+        '''
+        bounds = [None if t is None else _naive(t) for t in [start, end]]
+        runs, data = [], {}
+        for path in self.segments(start, end, instance_id):
+            try:
+                segment_runs, segment_inputs = read_segment(path, *bounds, inputs=inputs)
+            except Exception as e:
+                logger.warning(f'Could not read run log segment {path}: {e}')
+                continue
+            if segment_runs is None:
+                continue
+            runs.append(segment_runs)
+            if inputs:
+                groups = segment_inputs.groupby('run_index', sort=False)
+                for _, run in segment_runs.iterrows():
+                    # the inputs of a segment hold the columns of all its runs
+                    data[run['run']] = groups.get_group(run['run_index'])[json.loads(run['columns'])]
+        if not runs:
+            return pd.DataFrame(), data
+        runs = pd.concat(runs).drop(columns=['run_index', 'columns']).set_index('run')
+        runs = runs.sort_values('time')
+        return runs, data
+
+    def read_runs(self, start=None, end=None, instance_id=None):
+        """Runs of a time range without inputs, see read."""
+        return self.read(start, end, instance_id, inputs=False)[0]
@@ -0,0 +1,147 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+"""Distributed Optimal and Predictive Energy Resources
+Timeseries transport module.
+
+Encodes the timeseries exchanged by DoperWrapper ("input-data" and
+"output-data"). Besides JSON, two binary columnar formats are supported:
+
+    'columnar': raw little-endian column buffers with a small JSON header,
+                no additional dependencies.
+    'feather':  Arrow IPC (Feather v2), requires pyarrow.
+
+Binary payloads are bytes and are detected by their magic number, so the
+receiver does not need to know the format in advance.
+"""
+
+import io
+import json
+import struct
+import numpy as np
+import pandas as pd
+
+FORMATS = ['json', 'columnar', 'feather']
+COLUMNAR_MAGIC = b'DOPERCOL1\n'
+FEATHER_MAGIC = b'ARROW1'
+
+def _to_array(values):
+    """Numeric little-endian array of a column, datetimes as int64 [ns] (UTC)."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        tz = getattr(values.dtype, 'tz', None)
+        dtype = f'datetime64[ns, {tz}]' if tz else 'datetime64[ns]'
+        values = pd.DatetimeIndex(values).as_unit('ns')
+        return dtype, values.asi8.astype('<i8', copy=False)
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return 'bool', values.astype(np.uint8)
+    return values.dtype.str, values.astype(values.dtype.newbyteorder('<'), copy=False)
+
+def _from_array(dtype, buffer, offset, n):
+    """Read a column written by _to_array, returns (values, offset)."""
+    if dtype.startswith('datetime64[ns'):
+        values = np.frombuffer(buffer, dtype='<i8', count=n, offset=offset)
+        offset += n * values.itemsize
+        values = pd.DatetimeIndex(values.view('datetime64[ns]'))
+        if dtype != 'datetime64[ns]':
+            values = values.tz_localize('UTC').tz_convert(dtype[len('datetime64[ns, '):-1])
+        return values, offset
+    if dtype == 'bool':
+        values = np.frombuffer(buffer, dtype=np.uint8, count=n, offset=offset).astype(bool)
+    else:
+        values = np.frombuffer(buffer, dtype=np.dtype(dtype), count=n, offset=offset)
+    return values, offset + n * values.itemsize
+
+def _encode_columnar(df):
+    """Encode a dataframe into the 'columnar' format."""
+    header = {'n': len(df), 'columns': [], 'objects': {}}
+    buffers = []
+    index_dtype, index_values = _to_array(df.index)
+    header['index'] = [df.index.name, index_dtype]
+    buffers.append(index_values)
+    for c in df.columns:
+        if pd.api.types.is_numeric_dtype(df[c]) or pd.api.types.is_datetime64_any_dtype(df[c]):
+            dtype, values = _to_array(df[c])
+            header['columns'].append([c, dtype])
+            buffers.append(values)
+        else:
+            # strings and other objects are kept in the header
+            header['columns'].append([c, 'object'])
+            header['objects'][c] = df[c].tolist()
+    header = json.dumps(header).encode('utf8')
+    return b''.join([COLUMNAR_MAGIC, struct.pack('<I', len(header)), header]
+                    + [np.ascontiguousarray(b).tobytes() for b in buffers])
+
+def _decode_columnar(payload):
+    """Decode a dataframe from the 'columnar' format."""
+    offset = len(COLUMNAR_MAGIC)
+    length = struct.unpack_from('<I', payload, offset)[0]
+    offset += 4
+    header = json.loads(bytes(payload[offset:offset+length]).decode('utf8'))
+    offset += length
+    n = header['n']
+    index_name, index_dtype = header['index']
+    index, offset = _from_array(index_dtype, payload, offset, n)
+    columns = {}
+    for c, dtype in header['columns']:
+        if dtype == 'object':
+            columns[c] = header['objects'][c]
+        else:
+            columns[c], offset = _from_array(dtype, payload, offset, n)
+    df = pd.DataFrame(columns, index=pd.Index(index, name=index_name))
+    df.columns = [c for c, _ in header['columns']]
+    return df
+
+def encode_frame(df, fmt='json', columns=None):
+    '''
+        Encodes a timeseries dataframe for the exchange between FMLC components.
+
+        Input
+        -----
+            df (pandas.DataFrame): The dataframe to encode.
+            fmt (str): The format, one of FORMATS. (default='json')
+            columns (list): Only encode these columns, all if None. (default=None)
+
+        Returns
+        -------
+            payload (str or bytes): JSON string or binary payload.
+    '''
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    if fmt == 'json':
+        return df.to_json()
+    if fmt == 'columnar':
+        return _encode_columnar(df)
+    if fmt == 'feather':
+        buffer = io.BytesIO()
+        df.reset_index().to_feather(buffer)
+        return buffer.getvalue()
+    raise ValueError(f'Transport format "{fmt}" not supported, use one of {FORMATS}.')
+
+def decode_frame(payload):
+    '''
+        Decodes a timeseries dataframe encoded with encode_frame. JSON strings
+        are parsed as in the previous versions of DoperWrapper.
+
+        Input
+        -----
+            payload (str or bytes): The encoded dataframe.
+
+        Returns
+        -------
+            df (pandas.DataFrame): The decoded dataframe.
+    '''
+    if isinstance(payload, str):
+        return pd.read_json(io.StringIO(payload))
+    payload = memoryview(payload)
+    if bytes(payload[:len(COLUMNAR_MAGIC)]) == COLUMNAR_MAGIC:
+        return _decode_columnar(payload)
+    if bytes(payload[:len(FEATHER_MAGIC)]) == FEATHER_MAGIC:
+        df = pd.read_feather(io.BytesIO(payload))
+        df = df.set_index(df.columns[0])
+        if df.index.name == 'index':
+            df.index.name = None
+        return df
+    raise ValueError('Unknown transport payload.')
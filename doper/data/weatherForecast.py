@@ -13,31 +13,49 @@ import os
 import sys
 import time
 import json
-import pygrib
+import hashlib
 import requests
+import tempfile
 import warnings
 import traceback
 import numpy as np
 import pandas as pd
-import urllib.request
 import datetime as dtm
-from pvlib.location import Location
+from concurrent.futures import ThreadPoolExecutor
 
 warnings.filterwarnings('ignore', message='The forecast module algorithms and features are highly experimental.')
 warnings.filterwarnings('ignore', message="The HRRR class was deprecated in pvlib 0.9.1 and will be removed in a future release.")
 
 try:
     root = os.path.dirname(os.path.abspath(__file__))
-    from ..resources.pvlib.forecast import HRRR
+    from .transport import encode_frame, decode_frame
 except:
     root = os.getcwd()
     sys.path.append(os.path.join(root, '..', 'doper'))
-    from resources.pvlib.forecast import HRRR
+    from data.transport import encode_frame, decode_frame
+
+def _import_hrrr():
+    """Import pvlib and the HRRR processor on first use, they are slow to import."""
+    from pvlib.location import Location
+    try:
+        from ..resources.pvlib.forecast import HRRR
+    except ImportError:
+        from resources.pvlib.forecast import HRRR
+    return HRRR, Location
 
 from fmlc.baseclasses import eFMU
 
 datetime_mask = "20[0-9][0-9]-[0-1][0-9]-[0-3][0-9] [0-2][0-9]:[0-5][0-9]:[0-5][0-9]"
 
+HRRR_URL = 'https://nomads.ncep.noaa.gov/cgi-bin/filter_hrrr_2d.pl'
+MAX_WORKERS = 4 # concurrent forecast hour downloads
+MAX_RETRY = 3 # attempts per forecast hour
+TIMEOUT = 30 # per download attempt [s]
+SLEEP = 1 # first retry delay [s], doubled on every retry
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'doper-hrrr') # shared by all forecasters on a host
+CACHE_SIZE = 500 # MB
+CACHE_AGE = 24*60*60 # s
+
 FC_TO_PVLIV_MAP = {
     'Total Cloud Cover:% (instant):lambert:atmosphere:level 0 -': 'total_clouds',
     '2 metre temperature:K (instant):lambert:heightAboveGround:level 2 m': 'Temperature_height_above_ground',
@@ -49,8 +67,86 @@ FC_TO_PVLIV_MAP = {
     'Pressure_surface': 0,
 }
 
+def hrrr_bbox(lat, lon):
+    # bounding box of the downloaded subregion (toplat, leftlon, rightlon, bottomlat)
+    return int(lat+1), int(lon-1), int(lon+1), int(lat-1)
+
+class HRRRCache():
+    '''
+    Content-addressed on-disk cache of HRRR downloads, keyed by model cycle, forecast
+    hour and bounding box. Files are written atomically, so all forecasters on a host
+    can share one directory. Files older than max_age are evicted, then the least
+    recently used ones until the cache is below max_size.
+    '''
+
+    def __init__(self, path=CACHE_DIR, max_size=CACHE_SIZE, max_age=CACHE_AGE):
+        '''
+        Input
+        -----
+        path (str): cache directory.
+        max_size (float): maximum size of the cache, in MB.
+        max_age (float): maximum age of cached files, in seconds.
+        '''
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, dt, hour, bbox):
+        '''Key of a download, dt is the model cycle (UTC).'''
+        name = f'{dt.strftime("%Y%m%d%H")}:{hour:02}:' + ':'.join(str(b) for b in bbox)
+        return hashlib.sha1(name.encode()).hexdigest()
+
+    def get(self, key):
+        '''Path of a cached file, None if not cached.'''
+        fname = os.path.join(self.path, key+'.grib2')
+        try:
+            # mark as recently used
+            os.utime(fname)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fname
+
+    def put(self, key, fname):
+        '''Move a downloaded file (in the cache directory) into the cache.'''
+        path = os.path.join(self.path, key+'.grib2')
+        os.replace(fname, path)
+        return path
+
+    def evict(self, now=None):
+        '''Remove expired files, then the least recently used above max_size.'''
+        now = time.time() if now is None else now
+        files = []
+        for entry in os.scandir(self.path):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            # also removes abandoned partial downloads
+            if now - stat.st_mtime > self.max_age:
+                self.remove(entry.path)
+            elif entry.name.endswith('.grib2'):
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(f[1] for f in files)
+        for _, fsize, fname in sorted(files):
+            if size <= self.max_size * 1e6:
+                break
+            self.remove(fname)
+            size -= fsize
+
+    def remove(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass # removed by another forecaster
+
 def download_latest_hrrr(lat, lon, dt, hour, tmp_dir='',
-                         debug=False, store_file=False):
+                         debug=False, store_file=False, url=HRRR_URL,
+                         timeout=TIMEOUT, max_retry=MAX_RETRY, sleep=SLEEP):
     '''
     Documentation and API: https://nomads.ncep.noaa.gov/gribfilter.php?ds=hrrr_2d
     Full HRRR files: https://nomads.ncep.noaa.gov/pub/data/nccf/com/hrrr/prod/
@@ -58,31 +154,38 @@ def download_latest_hrrr(lat, lon, dt, hour, tmp_dir='',
     '''
     
     # make url for download (from API)
-    url = f'https://nomads.ncep.noaa.gov/cgi-bin/filter_hrrr_2d.pl?dir=%2F'
+    url = f'{url}?dir=%2F'
     fname = f'hrrr.t{dt.strftime("%H")}z.wrfsfcf{hour:02}.grib2'
     url += f'hrrr.{dt.strftime("%Y%m%d")}%2Fconus&file={fname}'
     url += f'&var_TMP=on&lev_2_m_above_ground=on' # temperature
     url += f'&var_TCDC=on&var_HCDC=on&var_LCDC=on&var_MCDC=on&all_lev=on' # clouds
     url += f'&var_UGRD=on&var_VGRD=on&lev_10_m_above_ground=on' # wind
-    url += f'&subregion=&toplat={int(lat+1)}&leftlon={int(lon-1)}&rightlon={int(lon+1)}&bottomlat={int(lat-1)}'
+    url += '&subregion=&toplat={}&leftlon={}&rightlon={}&bottomlat={}'.format(*hrrr_bbox(lat, lon))
     
-    # download forecast
-    fname = os.path.join(tmp_dir, fname)
-    try:
-        if store_file:
-            urllib.request.urlretrieve(url, fname)
-        else:
-            fname = requests.get(url).content
-        return fname
-    except Exception as e:
-        if debug:
-            print(url)
-            print(e)
-        return None
+    # download forecast, retry with increasing delay
+    for i in range(max_retry):
+        try:
+            r = requests.get(url, timeout=timeout)
+            r.raise_for_status()
+            if not store_file:
+                return r.content
+            # unique file, hours and sites are downloaded concurrently
+            with tempfile.NamedTemporaryFile(dir=tmp_dir or os.curdir, prefix=fname+'.',
+                                             delete=False) as f:
+                f.write(r.content)
+            return f.name
+        except Exception as e:
+            if debug:
+                print(url)
+                print(e)
+            if i < max_retry-1:
+                time.sleep(sleep * 2**i)
+    return None
 
 def get_nearest_data(lat, lon, fname):
     
-    # open file
+    # open file (pygrib is imported on use)
+    import pygrib
     grib = pygrib.open(fname)
     
     # get grib locations
@@ -109,8 +212,63 @@ def get_nearest_data(lat, lon, fname):
 
     return res
 
+def get_hrrr_hour(lat, lon, dt_utc, hour, tmp_dir='', debug=False, store_file=True,
+                  decoder=get_nearest_data, cache=None, **kwargs):
+    '''
+    Downloads and decodes one forecast hour, kwargs are passed to download_latest_hrrr.
+    With a HRRRCache, cached hours are not downloaded again.
+    '''
+    st = time.time()
+
+    # get latest hrrr file
+    if cache is not None:
+        key = cache.key(dt_utc, hour, hrrr_bbox(lat, lon))
+        fcObj = cache.get(key)
+        cached = fcObj is not None
+        if not cached:
+            # download into the cache directory, to move it into the cache
+            fcObj = download_latest_hrrr(lat, lon, dt_utc, hour,
+                                         tmp_dir=cache.path,
+                                         debug=debug,
+                                         store_file=True,
+                                         **kwargs)
+    else:
+        fcObj = download_latest_hrrr(lat, lon, dt_utc, hour,
+                                     tmp_dir=tmp_dir,
+                                     debug=debug,
+                                     store_file=store_file,
+                                     **kwargs)
+
+    if fcObj and cache is not None:
+        # only files which decode are cached, broken ones are downloaded again
+        try:
+            r = decoder(lat, lon, fcObj)
+        except Exception:
+            cache.remove(fcObj)
+            raise
+        if not cached:
+            cache.put(key, fcObj)
+    elif fcObj:
+        # determine nearest gridpoint
+        try:
+            r = decoder(lat, lon, fcObj)
+        finally:
+            # FIXME: deleting file manually due to pygrib 2.1.5 bug
+            try:
+                if not debug:
+                    os.remove(fcObj)
+            except:
+                pass
+    else:
+        # no forecast received
+        r = {}
+
+    r['duration'] = time.time()-st
+    return r
+
 def get_hrrr_forecast(lat, lon, dt, tz='America/Los_Angeles', max_hour=16,
-                      tmp_dir='', debug=False, store_file=False, forecast_age=2):
+                      tmp_dir='', debug=False, store_file=False, forecast_age=2,
+                      max_workers=MAX_WORKERS, decoder=get_nearest_data, cache=None, **kwargs):
     """
     Utility function to dowlnoad NOAA's HRRR forecast data.
 
@@ -125,6 +283,10 @@ def get_hrrr_forecast(lat, lon, dt, tz='America/Los_Angeles', max_hour=16,
     debug (bool): debug flag.
     store_file (bool): store HRRR downloads.
     forecast_age (int): age of HRRR forecast, in hours. 
+    max_workers (int): concurrent downloads and decodes of forecast hours.
+    decoder (function): reads the nearest grid point of a downloaded file.
+    cache (HRRRCache): on-disk cache of downloads, None to download all hours.
+    kwargs: url, timeout, max_retry and sleep of download_latest_hrrr.
     """
 
     # convert timestep to hourly
@@ -138,39 +300,16 @@ def get_hrrr_forecast(lat, lon, dt, tz='America/Los_Angeles', max_hour=16,
     # bug in pygrib 2.1.5 does not allow object as input
     store_file = True
 
-    res = {}
-    for h in range(forecast_age, max_hour+forecast_age+1):
-        st = time.time()
-
-        # get latest hrrr file
-        fcObj = download_latest_hrrr(lat, lon, dt_utc, h,
-                                     tmp_dir=tmp_dir,
-                                     debug=debug,
-                                     store_file=store_file)
-
-        if fcObj:
-            # make readable (pygrib 2.1.5 should support but doesn't)
-            if not store_file:
-                binary_io = io.BytesIO(fcObj)
-                buffer_io = io.BufferedReader(binary_io)
-        
-            # determine nearest gridpoint
-            r = get_nearest_data(lat, lon, fcObj)
-
-            # FIXME: deleting file manually due to pygrib 2.1.5 bug
-            try:
-                if not debug:
-                    os.remove(fcObj)
-            except:
-                pass
-        else:
-            # no forecast received
-            r = {}
-
-        r['duration'] = time.time()-st
-
-        # add to output
-        res[dt_utc+pd.DateOffset(hours=h)] = r
+    # download and decode forecast hours concurrently, duration is per hour
+    hours = list(range(forecast_age, max_hour+forecast_age+1))
+    with ThreadPoolExecutor(max(1, min(max_workers, len(hours)))) as pool:
+        futures = [pool.submit(get_hrrr_hour, lat, lon, dt_utc, h, tmp_dir=tmp_dir,
+                               debug=debug, store_file=store_file, decoder=decoder,
+                               cache=cache, **kwargs)
+                   for h in hours]
+        res = {dt_utc+pd.DateOffset(hours=h): f.result() for h, f in zip(hours, futures)}
+    if cache is not None:
+        cache.evict()
         
     # make dataframe
     res = pd.DataFrame(res).transpose()
@@ -183,6 +322,7 @@ def get_noaa_hrrr_forecast(config, start_time, tz, forecaster=None, pvlib_proces
 
     # initialize on first call
     if not forecaster:
+        HRRR, Location = _import_hrrr()
         forecaster = get_hrrr_forecast
         pvlib_processor = HRRR()
         # pvlib_processor.set_location(start_time.tz, config['lat'], config['lon']) # not using alt
@@ -192,10 +332,18 @@ def get_noaa_hrrr_forecast(config, start_time, tz, forecaster=None, pvlib_proces
     if not os.path.exists(config['tmp_dir']):
         os.mkdir(config['tmp_dir'])
 
+    # shared cache of downloads
+    cache = None
+    if config.get('cache_dir'):
+        cache = HRRRCache(config['cache_dir'], max_size=config.get('cache_size', CACHE_SIZE),
+                          max_age=config.get('cache_age', CACHE_AGE))
+
     # download forecast
     forecast = forecaster(config['lat'], config['lon'], start_time,
                           tz=tz, max_hour=config['horizon'],
-                          tmp_dir=config['tmp_dir'], debug=config['debug'])
+                          tmp_dir=config['tmp_dir'], debug=config['debug'],
+                          max_workers=config.get('max_workers', MAX_WORKERS),
+                          max_retry=config.get('max_retry', MAX_RETRY), cache=cache)
 
     return forecast, forecaster, pvlib_processor
 
@@ -380,7 +528,7 @@ class weather_forecaster(eFMU):
 
             elif self.config['source'] == 'json':
                 # read forecast from json
-                self.forecast = pd.read_json(io.StringIO(self.input['input-data'])).sort_index()
+                self.forecast = decode_frame(self.input['input-data']).sort_index()
 
             else:
                 # method not implemented
@@ -425,7 +573,8 @@ class weather_forecaster(eFMU):
         # return
         self.init = False
         if self.config['json_return']:
-            self.output['output-data'] = self.data.to_json()
+            self.output['output-data'] = encode_frame(self.data,
+                                                      self.config.get('output_format', 'json'))
         else:
             self.output['output-data'] = self.data
         self.output['duration'] = time.time() - st
@@ -445,8 +594,14 @@ def get_default_config():
     config['tmp_dir'] = 'tmp'
     config['debug'] = False
     config['source'] = 'noaa_hrrr'
+    config['max_workers'] = MAX_WORKERS # concurrent hrrr downloads
+    config['max_retry'] = MAX_RETRY
+    config['cache_dir'] = CACHE_DIR # None to disable the download cache
+    config['cache_size'] = CACHE_SIZE # MB
+    config['cache_age'] = CACHE_AGE # s
     config['refresh_time'] = 15*60 # 15 minutes
     config['json_return'] = True
+    config['output_format'] = 'json' # encoding when json_return, see doper.data.transport
     config['add_solpos'] = True
     config['forecast_cols'] = {}
     config['output_cols'] = {'temp_air': [-50, 50],
@@ -8,3 +8,4 @@ Examples module.
 """
 
 from .example import *
+from .scenarios import make_scenario
@@ -94,6 +94,8 @@ def default_parameter():
     parameter['controller']['log_dir'] = './logs' # Log dir
     parameter['controller']['instance_id'] = '1' # Instance ID
     parameter['controller']['log_overtime'] = 1*60 # Log when over time
+    parameter['controller']['log_all'] = False # Log inputs and results of every solve, for doper.replay
+    parameter['controller']['log_format'] = 'csv' # Log files per solve ('csv') or batched compressed run log ('runlog')
     parameter['controller']['sp_processor'] = { # default battery setpoint processor
         "module": "doper.data.setpoint_processor",
         "name": "battery_setpoint_processor"
@@ -104,6 +106,10 @@ def default_parameter():
     # expected signature: my_fb_processor(data, parameter) -> (setpoints: dict, log)
     parameter['controller']['update_states_thr'] = {} # Per-state threshold for state input filtering; empty = always use provided inputs
     # Keys are BATTERY_STATE_KEYS; provided value used only when |expected - provided| > threshold
+    parameter['controller']['aggregate_assets'] = False # Merge identical assets into scaled assets; True or list of ['batteries', 'load_control']
+    parameter['controller']['ev_fleet'] = False # Replace EVs with one virtual battery per node; True (batteries with min_leaving_soc) or list of names
+    parameter['controller']['first_step_results'] = False # Only extract first-timestep battery setpoints in DoperWrapper; output-data holds that row only
+    parameter['controller']['report_duplicates'] = False # Log duplicate constraint rows when the model is built
     parameter['controller']['setpoint_names'] = {
         'battery_power': 'Battery %s Power Command [kW]', # template for battery power setpoint key (%s = display name)
         'battery_name_map': {}, # internal battery name -> display name; identity if empty
@@ -349,6 +355,8 @@ def parameter_add_network(parameter=None):
         'voltMin': 0.8,
         'voltMax': 1.1,
         'conservativeVoltMin': 0,
+        'lazyNetworkConstraints': False, # add voltage and current limits only where violated, re-solve
+        'lazyMaxIterations': 20, # max re-solves with lazy network limits
     }
 
     parameter['network']['nodes'] = [ # list of dict to define inputs for each node in network
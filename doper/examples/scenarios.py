@@ -0,0 +1,242 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+""""Distributed Optimal and Predictive Energy Resources
+Synthetic scenario generator.
+
+Builds consistent parameter dicts and input dataframes of arbitrary size from
+the example factories, for load and scale testing:
+
+    parameter, data = make_scenario(nodes=20, topology='meshed', batteries=40,
+                                    evs=100, horizon=48, timestep=15, seed=1)
+
+Single node scenarios (nodes=1) run with construct_model_function(), multi-node
+scenarios additionally need doper.models.network.add_network.
+"""
+
+import copy
+import numpy as np
+import pandas as pd
+
+from .example import (default_parameter, parameter_add_battery, parameter_add_genset,
+                      parameter_add_loadcontrol, parameter_add_evfleet, ts_inputs)
+
+TOPOLOGIES = ['radial', 'meshed']
+
+def network_settings(powerflow=False):
+    """Network settings of generated scenarios, simple power exchange or full power flow."""
+    return {
+        'simplePowerExchange': not powerflow,
+        'simpleNetworkLosses': 0.05,
+        'enableGenPqLimits': False,
+
+        # powerflow parameters
+        'slackBusVoltage': 1,
+        'sBase': 1000,
+        'vBase': 1,
+        'cableDerating': 1,
+        'txDerating': 1,
+
+        # power factors
+        'powerFactors': {'pv': 1, 'genset': 1, 'batteryDisc': 1, 'batteryChar': 1, 'load': 1},
+
+        # powerflow model settings
+        'enableLosses': True,
+        'thetaMin': -0.18,
+        'thetaMax': 0.09,
+        'voltMin': 0.8,
+        'voltMax': 1.1,
+        'useConsVoltMin': False,
+    }
+
+def make_edges(nodes, topology='radial', rng=None):
+    '''
+        Random network topology. Radial networks are random trees rooted at the
+        first node, meshed networks add one extra edge per five nodes.
+
+        Input
+        -----
+            nodes (int): Number of nodes.
+            topology (str): 'radial' or 'meshed'. (default='radial')
+            rng (numpy.random.Generator): Random generator. (default=None)
+
+        Returns
+        -------
+            edges (list): Pairs of node indices (parent, child), parents first.
+    '''
+    if topology not in TOPOLOGIES:
+        raise ValueError(f'Topology "{topology}" not supported, use one of {TOPOLOGIES}.')
+    rng = rng if rng is not None else np.random.default_rng(0)
+    edges = [(int(rng.integers(0, i)), i) for i in range(1, nodes)]
+    if topology == 'meshed' and nodes > 3:
+        existing = set(edges)
+        for _ in range(max(1, nodes // 5)):
+            for _ in range(100):
+                a, b = sorted(int(i) for i in rng.choice(nodes, 2, replace=False))
+                if (a, b) not in existing:
+                    existing.add((a, b))
+                    edges.append((a, b))
+                    break
+    return edges
+
+def _repeat_day(day, index):
+    """Rows of the 5-minute example day at the time of day of the index."""
+    tod = ((index - index.normalize()).total_seconds() // 300).astype(int)
+    return day.iloc[np.minimum(tod, len(day)-2)]
+
+def ev_schedule(index, vehicle, rng):
+    '''
+        Realistic plug schedule of a vehicle: plugged in overnight, leaving in
+        the morning and back in the evening of each day, using 20-50% of its
+        battery while away.
+
+        Returns
+        -------
+            avail (numpy.ndarray): Availability, 1 when plugged in.
+            demand (numpy.ndarray): External demand while away [kW].
+    '''
+    hours = (index - index[0].normalize()).total_seconds().to_numpy() / 3600
+    avail = np.ones(len(index))
+    demand = np.zeros(len(index))
+    for day in range(int(hours[-1] // 24) + 1):
+        leave = 24 * day + np.clip(rng.normal(7.5, 1), 5, 10)
+        arrive = 24 * day + np.clip(rng.normal(17.5, 1.5), 13, 22)
+        away = (hours >= leave) & (hours < arrive)
+        avail[away] = 0
+        demand[away] = vehicle['capacity'] * rng.uniform(0.2, 0.5) / (arrive - leave)
+    # plugged in at the start of the horizon
+    avail[0] = 1
+    demand[0] = 0
+    return avail, demand
+
+def make_scenario(nodes=1, batteries=1, evs=0, gensets=0, load_circuits=0, horizon=24,
+                  timestep=5, topology='radial', powerflow=False, seed=0,
+                  start='2019-01-01 00:00'):
+    '''
+        Generates a consistent parameter dict and input dataframe of the given size.
+        The assets are distributed over the nodes, the first node is the slack bus
+        and the only point of common coupling.
+
+        Input
+        -----
+            nodes (int): Number of nodes, 1 is a single node model. (default=1)
+            batteries (int): Number of stationary batteries. (default=1)
+            evs (int): Number of EVs with plug schedules. (default=0)
+            gensets (int): Number of gensets. (default=0)
+            load_circuits (int): Number of load control circuits. (default=0)
+            horizon (float): Horizon in hours. (default=24)
+            timestep (int): Timestep in minutes. (default=5)
+            topology (str): Network topology, 'radial' or 'meshed'. (default='radial')
+            powerflow (bool): Full power flow instead of simple power exchange. (default=False)
+            seed (int): Seed of the random generator. (default=0)
+            start (str): Start of the horizon. (default='2019-01-01 00:00')
+
+        Returns
+        -------
+            parameter (dict): Configuration dictionary for the optimization.
+            data (pandas.DataFrame): The input dataframe for the optimization.
+    '''
+    rng = np.random.default_rng(seed)
+    parameter = default_parameter()
+    index = pd.date_range(start, periods=int(horizon*60/timestep)+1, freq=f'{timestep}min')
+    day = _repeat_day(ts_inputs(parameter, load='B90', scale_load=1, scale_pv=1), index)
+    data = day.drop(columns=['load_demand', 'generation_pv'])
+    data.index = index
+    data['date_time'] = index
+    columns = {} # new columns, added at once
+
+    # size loads to the assets
+    size = max(1, batteries + gensets + evs / 5)
+    multinode = nodes > 1
+    node_ids = [f'N{i+1}' for i in range(nodes)]
+    loads = {}
+    for i, node in enumerate(node_ids):
+        scale_load = rng.uniform(50, 150) * size / nodes
+        load = day['load_demand'].to_numpy() * scale_load * (1 + rng.normal(0, 0.05, len(index)))
+        pv = day['generation_pv'].to_numpy() * scale_load * rng.uniform(0, 0.8)
+        suffix = f'_{node}' if multinode else ''
+        columns[f'load_demand{suffix}'] = load
+        columns[f'generation_pv{suffix}'] = pv
+        loads[node] = load.max()
+
+    # assets, distributed over the nodes
+    ders = {node: {'battery': [], 'genset': [], 'load_control': []} for node in node_ids}
+    def place(kind, name, i):
+        ders[node_ids[(i + 1) % nodes] if multinode else node_ids[0]][kind].append(name)
+
+    units = []
+    battery = parameter_add_battery()['batteries'][0]
+    for i in range(batteries):
+        units.append(dict(copy.deepcopy(battery), name=f'bat{i}',
+                          soc_initial=round(rng.uniform(0.3, 0.9), 2)))
+        place('battery', f'bat{i}', i)
+    vehicles = parameter_add_evfleet()['batteries']
+    for i in range(evs):
+        vehicle = dict(copy.deepcopy(vehicles[i % len(vehicles)]), name=f'ev{i}',
+                       soc_initial=round(rng.uniform(0.4, 0.9), 2))
+        avail, demand = ev_schedule(index, vehicle, rng)
+        columns[f'battery_ev{i}_avail'] = avail
+        columns[f'battery_ev{i}_demand'] = demand
+        units.append(vehicle)
+        place('battery', f'ev{i}', batteries + i)
+    if units:
+        parameter['system']['battery'] = True
+        parameter['batteries'] = units
+
+    if gensets:
+        genset = parameter_add_genset()['gensets'][0]
+        parameter['system']['genset'] = True
+        parameter['gensets'] = []
+        for i in range(gensets):
+            parameter['gensets'].append(dict(copy.deepcopy(genset), name=f'genset{i}'))
+            place('genset', f'genset{i}', i)
+
+    if load_circuits:
+        circuit = parameter_add_loadcontrol()['load_control'][0]
+        parameter['system']['load_control'] = True
+        parameter['load_control'] = []
+        for i in range(load_circuits):
+            parameter['load_control'].append(dict(copy.deepcopy(circuit), name=f'lc{i}',
+                                                  cost=round(rng.uniform(0.05, 0.5), 2)))
+            place('load_control', f'lc{i}', i)
+        for node in node_ids:
+            circuits = ders[node]['load_control']
+            load = columns[f'load_demand_{node}' if multinode else 'load_demand']
+            for name in circuits:
+                columns[f'load_shed_potential_{name}'] = 0.3 * load / len(circuits)
+
+    if multinode:
+        edges = make_edges(nodes, topology, rng)
+        # size lines to the load downstream of the radial tree
+        downstream = dict(loads)
+        for parent, child in reversed(edges[:nodes-1]):
+            downstream[node_ids[parent]] += downstream[node_ids[child]]
+        lines = []
+        connections = {node: [] for node in node_ids}
+        for k, (a, b) in enumerate(edges):
+            capacity = float(np.ceil(2 * max(downstream[node_ids[b]], 100)))
+            lines.append({'line_id': f'L{k+1}', 'power_capacity': capacity,
+                          'length': float(rng.uniform(100, 1000)), 'resistance': 4.64e-6,
+                          'inductance': 8.33e-7, 'ampacity': capacity})
+            connections[node_ids[a]].append({'node': node_ids[b], 'line': f'L{k+1}'})
+            connections[node_ids[b]].append({'node': node_ids[a], 'line': f'L{k+1}'})
+        parameter['network'] = {'settings': network_settings(powerflow), 'lines': lines, 'nodes': []}
+        for i, node in enumerate(node_ids):
+            parameter['network']['nodes'].append({
+                'node_id': node,
+                'pcc': i == 0,
+                'slack': i == 0,
+                'load_id': f'load_demand_{node}',
+                'ders': {
+                    'pv_id': f'generation_pv_{node}',
+                    'pv_maxS': float(np.ceil(columns[f'generation_pv_{node}'].max() * 1.2)),
+                    'battery': ders[node]['battery'] or None,
+                    'genset': ders[node]['genset'] or None,
+                    'load_control': ders[node]['load_control'] or None,
+                },
+                'connections': connections[node],
+            })
+    data = pd.concat([data, pd.DataFrame(columns, index=index)], axis=1)
+    return parameter, data
@@ -0,0 +1,320 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+""""Distributed Optimal and Predictive Energy Resources
+Asset aggregation module.
+
+Identical assets (same parameters, same node and same availability/input
+profiles) are merged into a single scaled asset before the model is built,
+which removes one binary per unit and timestep and the symmetry between the
+units. Merged load circuits switch an integer number of their units, so the
+aggregated problem has the same optimum as the original one. Results are split
+back to the individual units after the solve.
+"""
+
+import copy
+import json
+import numpy as np
+import pandas as pd
+
+# asset types that can be aggregated
+# type: (parameter key, pyomo set name, per-unit input columns, extensive columns)
+AGGREGATION_TYPES = {
+    'batteries': ('batteries', 'batteries',
+                  ['battery_{}_avail', 'battery_{}_demand'],
+                  ['battery_{}_demand']),
+    'load_control': ('load_control', 'load_circuits',
+                     ['load_shed_potential_{}'],
+                     []),
+}
+
+# extensive parameters (scaled with the number of units in a group)
+EXTENSIVE_PARAMETERS = {
+    'batteries': ['capacity', 'power_charge', 'power_discharge', 'maxS', 'battery_power'],
+    'load_control': ['units', 'load_connected'],
+}
+
+# default values of extensive parameters when not provided
+PARAMETER_DEFAULTS = {
+    'units': 1,
+    'load_connected': 1,
+}
+
+# default columns of unit inputs when not provided
+DEFAULT_INPUTS = {
+    'battery_{}_avail': 1,
+    'battery_{}_demand': 0,
+}
+
+# model data which is the same for each unit of a group (not split)
+INTENSIVE_DATA = ['battery_soc', 'battery_available', 'battery_chargeXORdischarge']
+
+# model data counting the units of a group which are on (or switched off)
+COUNT_DATA = ['load_circuits_on', 'der_shed_load']
+
+def _asset_names(parameter, asset_type):
+    """Names of assets of a type; unnamed assets are numbered as in add_loadControl."""
+    return [asset.get('name', f'{ii+1}') for ii, asset
+            in enumerate(parameter.get(AGGREGATION_TYPES[asset_type][0], []))]
+
+def _unique_name(name, existing):
+    """Return name, suffixed with a counter if it is already in existing."""
+    unique = name
+    ii = 1
+    while unique in existing:
+        unique = f'{name}_{ii}'
+        ii += 1
+    return unique
+
+def _asset_node(parameter, asset_type, name):
+    """Return the node_id an asset is located at (None for single-node models)."""
+    if 'network' not in parameter:
+        return None
+    der_key = 'battery' if asset_type == 'batteries' else 'load_control'
+    for node in parameter['network']['nodes']:
+        ders = node.get('ders') or {}
+        location = ders.get(der_key)
+        if location == name or (isinstance(location, list) and name in location):
+            return node['node_id']
+    return None
+
+def _asset_key(inputs, parameter, asset_type, asset, name):
+    """Hashable key describing everything which makes an asset unique except its name."""
+    properties = {k: v for k, v in asset.items() if k != 'name'}
+    profiles = []
+    for template in AGGREGATION_TYPES[asset_type][2]:
+        col = template.format(name)
+        if col in inputs.columns:
+            profiles.append(inputs[col].to_numpy(dtype=float).tobytes())
+        else:
+            profiles.append(DEFAULT_INPUTS.get(template, None))
+    return (json.dumps(properties, sort_keys=True, default=str),
+            _asset_node(parameter, asset_type, name),
+            tuple(profiles))
+
+def find_identical_assets(inputs, parameter, asset_type):
+    '''
+    Group assets of a given type which are identical in their parameters,
+    node location and input profiles.
+
+    Parameters
+    ----------
+    inputs : pandas.DataFrame
+        timeseries inputs of the optimization
+    parameter : dict
+        DOPER parameter dict
+    asset_type : str
+        'batteries' or 'load_control'
+
+    Returns
+    -------
+    groups : list of list
+        asset names per group, in order of first appearance
+
+    '''
+    groups = {}
+    assets = parameter.get(AGGREGATION_TYPES[asset_type][0], [])
+    for asset, name in zip(assets, _asset_names(parameter, asset_type)):
+        key = _asset_key(inputs, parameter, asset_type, asset, name)
+        groups.setdefault(key, []).append(name)
+    return list(groups.values())
+
+def aggregate_assets(inputs, parameter, asset_types=True):
+    '''
+    Merge identical assets into single assets with scaled capacity and power.
+
+    Merged load circuits carry the number of units, of which any integer
+    number can be shed. Merged batteries are exact as each unit of a group
+    follows the same trajectory.
+
+    Parameters
+    ----------
+    inputs : pandas.DataFrame
+        timeseries inputs of the optimization
+    parameter : dict
+        DOPER parameter dict
+    asset_types : bool or list, optional
+        asset types to aggregate; True for all of AGGREGATION_TYPES. The default is True.
+
+    Returns
+    -------
+    inputs : pandas.DataFrame
+        inputs with columns for the aggregated assets
+    parameter : dict
+        parameter with aggregated assets
+    asset_groups : dict
+        mapping of asset type to {aggregated name: [unit names]}, groups with
+        more than one unit only
+
+    '''
+    if asset_types is True:
+        asset_types = list(AGGREGATION_TYPES.keys())
+    system_flags = {'batteries': 'battery', 'load_control': 'load_control'}
+
+    asset_groups = {}
+    new_parameter = None
+    new_columns = {}
+    for asset_type in asset_types:
+        param_key = AGGREGATION_TYPES[asset_type][0]
+        if not parameter['system'].get(system_flags[asset_type]) or not parameter.get(param_key):
+            continue
+        groups = [g for g in find_identical_assets(inputs, parameter, asset_type) if len(g) > 1]
+        if not groups:
+            continue
+        if new_parameter is None:
+            new_parameter = copy.deepcopy(parameter)
+        asset_groups[asset_type] = {}
+        names = _asset_names(new_parameter, asset_type)
+        for asset, name in zip(new_parameter[param_key], names):
+            asset['name'] = name
+        assets = {a['name']: a for a in new_parameter[param_key]}
+        existing = set(names)
+        replaced = {}
+        for group in groups:
+            n = len(group)
+            name = _unique_name(f'{group[0]}_x{n}', existing)
+            existing.add(name)
+            asset_groups[asset_type][name] = group
+
+            # scaled asset
+            asset = copy.deepcopy(assets[group[0]])
+            asset['name'] = name
+            for k in EXTENSIVE_PARAMETERS[asset_type]:
+                if asset.get(k, PARAMETER_DEFAULTS.get(k)) is not None:
+                    asset[k] = asset.get(k, PARAMETER_DEFAULTS.get(k)) * n
+            replaced[group[0]] = asset
+            for unit in group[1:]:
+                replaced[unit] = None
+
+            # scaled inputs
+            for col in AGGREGATION_TYPES[asset_type][2]:
+                unit_col = col.format(group[0])
+                if unit_col not in inputs.columns:
+                    continue
+                scale = n if col in AGGREGATION_TYPES[asset_type][3] else 1
+                new_columns[col.format(name)] = inputs[unit_col] * scale
+
+            # node location
+            if 'network' in new_parameter:
+                der_key = 'battery' if asset_type == 'batteries' else 'load_control'
+                for node in new_parameter['network']['nodes']:
+                    ders = node.get('ders') or {}
+                    location = ders.get(der_key)
+                    if isinstance(location, list) and group[0] in location:
+                        ders[der_key] = [name if l == group[0] else l for l in location
+                                         if l not in group[1:]]
+                    elif location == group[0]:
+                        ders[der_key] = name
+
+        new_parameter[param_key] = [replaced.get(a['name'], a) for a in new_parameter[param_key]
+                                    if replaced.get(a['name'], a) is not None]
+
+    if not asset_groups:
+        return inputs, parameter, asset_groups
+    if new_columns:
+        inputs = pd.concat([inputs, pd.DataFrame(new_columns, index=inputs.index)], axis=1,
+                           copy=False)
+    return inputs, new_parameter, asset_groups
+
+def _column(df_label, name):
+    """Results column label of an indexed output item."""
+    try:
+        return df_label % name
+    except TypeError:
+        return f'{df_label}{name}'
+
+def disaggregate_results(df, output_list, asset_groups):
+    '''
+    Split results of aggregated assets back to the individual units.
+
+    Extensive values (power, energy) are divided equally between the units of
+    a group, intensive values (SOC, binaries) are copied. For load circuits
+    the first units of a group are on; the number of units on is taken from
+    the 'load_circuits_on' output if present, and shed load is split between
+    the units which are off.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        results dataframe from DOPER.write_ts_results
+    output_list : list
+        output instructions used to create df
+    asset_groups : dict
+        groups as returned by aggregate_assets
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        results with one column per unit instead of per group
+
+    '''
+    set_to_type = {v[1]: k for k, v in AGGREGATION_TYPES.items()}
+
+    # number of units on per load circuit group
+    units_on = {}
+    for outputItem in output_list:
+        if outputItem['data'] != 'load_circuits_on':
+            continue
+        for name in asset_groups.get('load_control', {}):
+            col = _column(outputItem['df_label'], name)
+            if col in df.columns:
+                units_on[name] = np.round(df[col].to_numpy(dtype=float))
+
+    new_columns = {}
+    drop_columns = []
+    for outputItem in output_list:
+        asset_type = set_to_type.get(outputItem.get('index'))
+        if asset_type not in asset_groups:
+            continue
+        for name, group in asset_groups[asset_type].items():
+            col = _column(outputItem['df_label'], name)
+            if col not in df.columns:
+                continue
+            values = df[col].to_numpy(dtype=float)
+            n = len(group)
+            on = units_on.get(name)
+            for ii, unit in enumerate(group):
+                if outputItem['data'] in INTENSIVE_DATA:
+                    unit_values = values
+                elif outputItem['data'] == 'load_circuits_on' or \
+                        (outputItem['data'] in COUNT_DATA and on is None):
+                    unit_values = (ii < np.round(values)).astype(float)
+                elif outputItem['data'] in COUNT_DATA:
+                    # units switched off are the ones following the units on
+                    unit_values = ((ii >= on) & (ii < on + np.round(values))).astype(float)
+                elif on is not None:
+                    unit_values = np.where(ii >= on, values / np.maximum(n - on, 1), 0.)
+                else:
+                    unit_values = values / n
+                new_columns[_column(outputItem['df_label'], unit)] = unit_values
+            drop_columns.append(col)
+    if not new_columns:
+        return df
+    df = df.drop(columns=drop_columns)
+    return df.assign(**new_columns)
+
+def unit_scale(asset_groups, asset_type, name):
+    '''
+    Return the aggregated name and number of units for a given unit name.
+
+    Parameters
+    ----------
+    asset_groups : dict
+        groups as returned by aggregate_assets
+    asset_type : str
+        'batteries' or 'load_control'
+    name : str
+        name of the unit
+
+    Returns
+    -------
+    (str, int)
+        name of the asset in the model, and number of units it represents
+
+    '''
+    for group_name, group in asset_groups.get(asset_type, {}).items():
+        if name in group:
+            return group_name, len(group)
+    return name, 1
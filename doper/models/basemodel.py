@@ -10,7 +10,6 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary
 import logging
 
@@ -25,6 +24,8 @@ def get_root(f=None):
 root = get_root()
 
 from ..utility import pandas_to_dict, unpack_ts_input, add_second_index, pyomo_read_parameter, get_root, constructNodeInput, mapExternalGen
+from ..utility import fix_disabled
+from .bounds import grid_import_bound, grid_export_bound
 
 
 
@@ -41,7 +42,7 @@ def base_model(inputs, parameter):
         -------
             model (pyomo.environ.ConcreteModel): The complete model to be optimized.
     '''
-    inputs = inputs.copy(deep=True)
+    inputs = inputs.copy(deep=False) # columns are added locally, the input buffer is shared
     if type(inputs.index[0]) == type(pd.to_datetime(0)):
         inputs.index = inputs.index.view(np.int64)/1e9 # Convert datetime to UNIX
         
@@ -165,6 +166,7 @@ def base_model(inputs, parameter):
         model.powerExchangeOut = Var(model.ts, model.nodes, bounds=(0,0), doc='simple power exchange injected from node [kW] - disabled')
         model.powerExchangeIn = Var(model.ts, model.nodes, bounds=(0,0), doc='simple power exchange absorbed at node [kW] - disabled')
         model.powerExchangeLosses = Var(model.ts, model.nodes, bounds=(0,0), doc='simple power exchange losses in network [kW] - disabled')
+        fix_disabled(model.powerExchangeOut, model.powerExchangeIn, model.powerExchangeLosses)
         
     else:
         # for multi-node models, construct node-ts dataframe containing data for pyomo param initialization
@@ -187,6 +189,7 @@ def base_model(inputs, parameter):
             model.powerExchangeOut = Var(model.ts, model.nodes, bounds=(0, 0), doc='simple power exchange injected from node [kW] - disabled')
             model.powerExchangeIn = Var(model.ts, model.nodes, bounds=(0, 0), doc='simple power exchange absorbed at node [kW] - disabled')
             model.powerExchangeLosses = Var(model.ts, model.nodes, bounds=(0,0), doc='simple power exchange losses in network [kW] - disabled')
+            fix_disabled(model.powerExchangeOut, model.powerExchangeIn, model.powerExchangeLosses)
         
         for nn, node in enumerate(parameter['network']['nodes']):
             
@@ -243,6 +246,12 @@ def base_model(inputs, parameter):
     ext_power_dict = mapExternalGen(parameter, inputs, model)
     model.external_gen_power = Param(model.ts, model.nodes, initialize=ext_power_dict, \
                                        doc='generation power from generic external power source [kW]')
+
+    # tightest valid big-M for grid import/export switching constraints
+    model.grid_import_bigM = Param(model.ts, initialize=grid_import_bound(model, parameter), \
+                                   doc='grid import big-M [kW]')
+    model.grid_export_bigM = Param(model.ts, initialize=grid_export_bound(model, parameter), \
+                                   doc='grid export big-M [kW]')
     
    
     # Variables
@@ -314,6 +323,8 @@ def base_model(inputs, parameter):
         model.sum_battery_discharge_grid_power = Var(model.ts, model.nodes, bounds=(0,0), doc='total battery grid discharge [kW] - disabled')
         model.sum_battery_charge_grid_power_site = Var(model.ts, bounds=(0,0), doc='total battery grid charge [kW] - disabled')
         model.sum_battery_discharge_grid_power_site = Var(model.ts, bounds=(0,0), doc='total battery grid discharge [kW] - disabled')
+        fix_disabled(model.sum_battery_charge_grid_power, model.sum_battery_discharge_grid_power,
+                     model.sum_battery_charge_grid_power_site, model.sum_battery_discharge_grid_power_site)
        
         
     if parameter['system']['genset']:
@@ -329,6 +340,8 @@ def base_model(inputs, parameter):
         model.fuel_cost_total = Var(bounds=(0, 0), doc='total fuel cost over horizon [$] - disabled')
         model.sum_genset_co2 = Var(bounds=(0, 0), doc='total co2 emissions from gensets [kg] - disabled')
         model.co2_profile_genset = Var(model.ts, bounds=(0, 0), doc='timeseries profile of CO2 from gensets [kg] - disabled')
+        fix_disabled(model.sum_genset_power, model.sum_genset_power_site, model.fuel_cost_total,
+                     model.sum_genset_co2, model.co2_profile_genset)
         
     
     # load control
@@ -345,11 +358,14 @@ def base_model(inputs, parameter):
         model.load_shed_site = Var(model.ts, bounds=(0, 0), doc='total load shed [kW] - disabled')
         model.load_shed_der_total = Var(bounds=(0, 0), doc='total load shed derivative over horizon [-]')
         model.load_shed_act_total = Var(bounds=(0, 0), doc='total load circuit activations over accounting horizon [-] - disabled')
+        fix_disabled(model.load_shed, model.load_shed_cost_total, model.load_shed_site,
+                     model.load_shed_der_total, model.load_shed_act_total)
       
     if parameter['system']['hvac_control']:
         model.building_load_dynamic = Var(model.ts, model.nodes, bounds=(None, None), doc='dynamic building load demand [kW]')
     else:
         model.building_load_dynamic = Var(model.ts, model.nodes, bounds=(0, 0), doc='dynamic building load demand [kW]')
+        fix_disabled(model.building_load_dynamic)
     
     # if parameter['site']['regulation_reserved']:
     #     model.sum_regulation_up = Param(model.ts, \
@@ -365,14 +381,26 @@ def base_model(inputs, parameter):
                
     ### Base Model Eqns ### 
         
-    # grid outage constraints   
+    # grid outage: fix grid exchange instead of constraining it
+    for ts in model.ts:
+        if model.grid_available[ts] == 0:
+            model.grid_importXORexport[ts].fix(0)
+            for nn in model.nodes:
+                model.grid_import[ts, nn].fix(0)
+                model.grid_export[ts, nn].fix(0)
+
+    # grid outage constraints (only partial availability, otherwise fixed or covered by import xor export)
     def outage_import(model, ts, nodes):
-        return model.grid_import[ts, nodes] <= model.grid_available[ts] * model.dynamic_import_max[ts]
+        if model.grid_available[ts] in [0, 1]:
+            return Constraint.Skip
+        return model.grid_import[ts, nodes] <= model.grid_available[ts] * model.grid_import_bigM[ts]
     model.constraint_outage_import = Constraint(model.ts, model.nodes, rule=outage_import, \
                                                   doc='constraint outage import')
                                                   
     def outage_export(model, ts, nodes):
-        return model.grid_export[ts, nodes] <= model.grid_available[ts] * model.dynamic_export_max[ts]
+        if model.grid_available[ts] in [0, 1]:
+            return Constraint.Skip
+        return model.grid_export[ts, nodes] <= model.grid_available[ts] * model.grid_export_bigM[ts]
     model.constraint_outage_export = Constraint(model.ts, model.nodes, rule=outage_export, \
                                                   doc='constraint outage export')
  
@@ -424,24 +452,24 @@ def base_model(inputs, parameter):
                                                  doc='summation of input load and load shedding')
 
     # Site constraints
-    def site_grid_imports(model, ts, nodes):
+    def site_grid_imports(model, ts):
         return model.grid_import_site[ts] == sum(model.grid_import[ts, node] for node in model.nodes)
-    model.constraint_site_grid_imports = Constraint(model.ts, model.nodes, 
+    model.constraint_site_grid_imports = Constraint(model.ts, 
                                                     rule=site_grid_imports, doc='site-total grid imports aggregation')
     
-    def site_grid_exports(model, ts, nodes):
+    def site_grid_exports(model, ts):
         return model.grid_export_site[ts] == sum(model.grid_export[ts, node] for node in model.nodes)
-    model.constraint_site_grid_exports = Constraint(model.ts, model.nodes, 
+    model.constraint_site_grid_exports = Constraint(model.ts, 
                                                     rule=site_grid_exports, doc='site-total grid exports aggregation')
     
-    def site_load_served_agg(model, ts, nodes):
+    def site_load_served_agg(model, ts):
         return model.load_served_site[ts] == sum(model.load_served[ts, node] for node in model.nodes)
-    model.constraint_site_load_served_agg = Constraint(model.ts, model.nodes, 
+    model.constraint_site_load_served_agg = Constraint(model.ts, 
                                                     rule=site_load_served_agg, doc='site-total load served')
     
-    def site_pv_gen_agg(model, ts, nodes):
+    def site_pv_gen_agg(model, ts):
         return model.generation_pv_site[ts] == sum(model.actual_generation_pv[ts, node] for node in model.nodes)
-    model.constraint_site_pv_gen_agg = Constraint(model.ts, model.nodes, 
+    model.constraint_site_pv_gen_agg = Constraint(model.ts, 
                                                     rule=site_pv_gen_agg, doc='site-total pv gen')
     
     def demand_maximum_periods(model, ts):
@@ -461,11 +489,11 @@ def base_model(inputs, parameter):
 
     # Grid Import XOR Export
     def grid_import_XOR_export(model, ts, nodes):
-        return model.grid_import[ts, nodes] <=  model.grid_importXORexport[ts] * model.dynamic_import_max[ts]
+        return model.grid_import[ts, nodes] <=  model.grid_importXORexport[ts] * model.grid_import_bigM[ts]
     model.constraint_grid_import_XOR_export = Constraint(model.ts, model.nodes, rule=grid_import_XOR_export, \
                                                          doc='grid import xor export')  
     def grid_export_XOR_import(model, ts, nodes):
-        return model.grid_export[ts, nodes] <=  (1 - model.grid_importXORexport[ts]) * model.dynamic_export_max[ts]
+        return model.grid_export[ts, nodes] <=  (1 - model.grid_importXORexport[ts]) * model.grid_export_bigM[ts]
     model.constraint_grid_export_XOR_import = Constraint(model.ts, model.nodes, rule=grid_export_XOR_import, \
                                                          doc='grid export xor import')  
 
@@ -11,7 +11,6 @@ import sys
 import logging
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary, Any
 
 def get_root(f=None):
@@ -25,7 +24,6 @@ def get_root(f=None):
 root = get_root()
 
 from ..utility import pandas_to_dict, pyomo_read_parameter, get_root, extract_properties
-from ..plotting import plot_streams
 
 def add_battery(model, inputs, parameter):
     
@@ -48,6 +46,7 @@ def add_battery(model, inputs, parameter):
                 f'Battery {bb+1} missing required parameter: {pp}'
                 
     # check that initial and final SOCs are within allowed bounds
+    soc_final = {}
     for b in range(0, len(parameter['batteries'])):
         assert parameter['batteries'][b]['soc_initial'] >= parameter['batteries'][b]['soc_min'], \
             f"Battery SOC intial < SOC min for battery {b}"
@@ -55,18 +54,18 @@ def add_battery(model, inputs, parameter):
         assert parameter['batteries'][b]['soc_initial'] <= parameter['batteries'][b]['soc_max'], \
             f"Battery SOC initial > SOC max for battery {b}"
         # if final SOC state is given, check that it is within allowed bounds   
-        if 'soc_final' in parameter['batteries'][b]:
-            if parameter['batteries'][b]['soc_final'] == True:
-                # if no final SOC state is given, set it to the initial SOC
-                parameter['batteries'][b]['soc_final'] = parameter['batteries'][b]['soc_initial']
-            # assert final SOC within bounds, if defined
-            if parameter['batteries'][b]['soc_final']:
-                assert parameter['batteries'][b]['soc_final'] >= parameter['batteries'][b]['soc_min'], \
-                    f"Battery SOC final < SOC min for battery {b}"
-                assert parameter['batteries'][b]['soc_final'] <= parameter['batteries'][b]['soc_max'], \
-                    f"Battery SOC final > SOC max for battery {b}"
-        else:
-            parameter['batteries'][b]['soc_final'] = False
+        # (the parameter is not modified, final SOCs are kept locally)
+        name = parameter['batteries'][b]['name']
+        soc_final[name] = parameter['batteries'][b].get('soc_final', False)
+        if soc_final[name] == True:
+            # if no final SOC state is given, set it to the initial SOC
+            soc_final[name] = parameter['batteries'][b]['soc_initial']
+        # assert final SOC within bounds, if defined
+        if soc_final[name]:
+            assert soc_final[name] >= parameter['batteries'][b]['soc_min'], \
+                f"Battery SOC final < SOC min for battery {b}"
+            assert soc_final[name] <= parameter['batteries'][b]['soc_max'], \
+                f"Battery SOC final > SOC max for battery {b}"
     
     # extract list of battery asset names for define pyomo set
     batteryListInput = [battery['name'] for battery in parameter['batteries']]
@@ -77,10 +76,12 @@ def add_battery(model, inputs, parameter):
     # check for existence of battery availability and external load columns in input df
     # these are only needed if battery is an EV. If they are not present, create them 
     # with full availability and 0 external load
-    for b in model.batteries:
-       if f'battery_{b}_avail' not in inputs.columns:
-           inputs[f'battery_{b}_avail'] = 1
-           inputs[f'battery_{b}_demand'] = 0
+    missing = [b for b in model.batteries if f'battery_{b}_avail' not in inputs.columns]
+    if missing:
+        inputs = inputs.copy(deep=False) # add columns without modifying the caller's inputs
+        for b in missing:
+            inputs[f'battery_{b}_avail'] = 1
+            inputs[f'battery_{b}_demand'] = 0
     
     model.battery_available = Param(model.ts, model.batteries, \
                                     initialize= \
@@ -113,7 +114,7 @@ def add_battery(model, inputs, parameter):
                                 doc='battery max discharging power [kW]')
     model.bat_self_discharge = Param(model.batteries, initialize=extract_properties(parameter, 'batteries', 'self_discharging', batteryListInput), \
                                 doc='battery self discharge rate [-/hr]')
-    model.bat_soc_end = Param(model.batteries, initialize=extract_properties(parameter, 'batteries', 'soc_final', batteryListInput), \
+    model.bat_soc_end = Param(model.batteries, initialize=soc_final, \
                                 doc='battery end SOC [-]', within=Any)
     model.bat_soc_init = Param(model.batteries, initialize=extract_properties(parameter, 'batteries', 'soc_initial', batteryListInput), \
                                 doc='battery initial SOC [-]')
@@ -225,21 +226,31 @@ def add_battery(model, inputs, parameter):
     model.battery_soc = Var(model.ts, model.batteries, bounds=(0, None), doc='battery soc [-]')
     model.battery_agg_soc = Var(model.ts, bounds=(0, None), doc='battery aggregated state-of-charge [-]')
     
+    # availability scales the power limits, e.g. the plugged in share of a virtual EV fleet battery
     def battery_charge_power_bounds(model, ts, battery):
-        return (0, model.bat_power_charge[battery])
+        return (0, model.bat_power_charge[battery] * min(model.battery_available[ts, battery], 1))
     model.battery_charge_grid_power = Var(model.ts, model.batteries, bounds=battery_charge_power_bounds, \
                                       doc='limit battery charge [kW]')
     def battery_discharge_power_bounds(model, ts, battery):
-        return (0, model.bat_power_discharge[battery])
+        return (0, model.bat_power_discharge[battery] * min(model.battery_available[ts, battery], 1))
     model.battery_discharge_grid_power = Var(model.ts, model.batteries, bounds=battery_discharge_power_bounds, \
                                         doc='limit battery discharge [kW]')
 
     model.battery_net_grid_power = Var(model.ts, model.batteries, \
                                        doc='net battery grid power (charge - discharge) [kW]')
     
+    # optional time-varying energy bounds, e.g. the envelope of a virtual EV fleet battery
+    energy_envelope = {}
+    for bound in ['energy_min', 'energy_max']:
+        envelope_batteries = [b for b in model.batteries if f'battery_{b}_{bound}' in inputs.columns]
+        energy_envelope[bound] = pandas_to_dict(inputs[[f'battery_{b}_{bound}' for b in envelope_batteries]], \
+                                                columns=envelope_batteries, convertTs=True) \
+                                 if envelope_batteries else {}
     def battery_energy_bounds(model, ts, battery):
-        return (model.bat_soc_min[battery]*model.bat_capacity[battery], \
-                model.bat_soc_max[battery]*model.bat_capacity[battery])
+        return (max(model.bat_soc_min[battery]*model.bat_capacity[battery], \
+                    energy_envelope['energy_min'].get((ts, battery), 0)), \
+                min(model.bat_soc_max[battery]*model.bat_capacity[battery], \
+                    energy_envelope['energy_max'].get((ts, battery), float('inf'))))
     model.battery_energy = Var(model.ts, model.batteries, bounds=battery_energy_bounds, \
                                 doc='battery stored energy [kWh]')
     # Note: double check how this is implemented. Shoulds be applied to energy in storage, not bounds by a max
@@ -351,8 +362,20 @@ def add_battery(model, inputs, parameter):
                                                           doc='constraint battery energy balance')
     
     
+    # fix battery power when unavailable instead of constraining it
+    for ts in model.ts:
+        for b in model.batteries:
+            if model.battery_available[ts, b] == 0:
+                model.battery_chargeXORdischarge[ts, b].fix(0)
+                model.battery_charge_power[ts, b].fix(0)
+                model.battery_discharge_power[ts, b].fix(0)
+                model.battery_charge_grid_power[ts, b].fix(0)
+                model.battery_discharge_grid_power[ts, b].fix(0)
+
     # Battery Charing XOR Discharging
     def battery_charge_XOR_discharge(model, ts, battery):
+        if model.battery_available[ts, battery] == 0:
+            return Constraint.Skip
         return model.battery_charge_power[ts, battery] <=  model.battery_chargeXORdischarge[ts, battery] \
                                                             * model.bat_power_charge[battery] \
                                                             * model.battery_available[ts, battery]
@@ -360,6 +383,8 @@ def add_battery(model, inputs, parameter):
                                                                 rule=battery_charge_XOR_discharge, \
                                                                 doc='constraint battery charging xor discharging')  
     def battery_discharge_XOR_charge(model, ts, battery):
+        if model.battery_available[ts, battery] == 0:
+            return Constraint.Skip
         return model.battery_discharge_power[ts, battery] <=  (1 - model.battery_chargeXORdischarge[ts, battery]) \
                                                                 * model.bat_power_discharge[battery] \
                                                                 * model.battery_available[ts, battery]
@@ -503,15 +528,15 @@ def add_battery(model, inputs, parameter):
                                                               doc='sum of all battery discharging')
             
     # sum site-wide battery input & output
-    def site_total_battery_charge(model, ts, nodes):
+    def site_total_battery_charge(model, ts):
         return model.sum_battery_charge_grid_power_site[ts] ==  sum(model.sum_battery_charge_grid_power[ts, node] for node in model.nodes)
-    model.constraint_site_total_battery_charge = Constraint(model.ts,  model.nodes, \
+    model.constraint_site_total_battery_charge = Constraint(model.ts, \
                                                                     rule=site_total_battery_charge, \
                                                                     doc='site total battery charging power')
         
-    def site_total_battery_discharge(model, ts, nodes):
+    def site_total_battery_discharge(model, ts):
         return model.sum_battery_discharge_grid_power_site[ts] ==  sum(model.sum_battery_discharge_grid_power[ts, node] for node in model.nodes)
-    model.constraint_site_total_battery_discharge = Constraint(model.ts,  model.nodes, \
+    model.constraint_site_total_battery_discharge = Constraint(model.ts, \
                                                                     rule=site_total_battery_discharge, \
                                                                     doc='site total battery discharging power')
     
@@ -583,6 +608,9 @@ def plot_battery1(df, model, plot=True, tight=True):
                 fig (matplotlib figure): Figure of the plot.
                 axs (numpy.ndarray of matplotlib.axes._subplots.AxesSubplot): Axis of the plot.
     '''
+    # plotting is optional, import on use
+    import matplotlib.pyplot as plt
+    from ..plotting import plot_streams
     n = 5
     if 'Battery 0 Temperature [C]' in df.columns:
         n += 1
@@ -0,0 +1,150 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+""""Distributed Optimal and Predictive Energy Resources
+Big-M bounds module.
+
+Derives the tightest valid big-M values of the model's switching constraints
+from asset capacities, timeseries inputs and site limits, so that constraints
+are not built with large constant Ms.
+"""
+
+from pyomo.environ import value
+
+def _battery_power(parameter, key):
+    """Sum of battery power limits [kW] from parameter."""
+    if not parameter['system'].get('battery'):
+        return 0
+    return sum(b[key] for b in parameter.get('batteries', []))
+
+def _genset_capacity(parameter):
+    """Sum of genset capacities [kW] from parameter."""
+    if not parameter['system'].get('genset'):
+        return 0
+    return sum(g['capacity'] for g in parameter.get('gensets', []))
+
+def _site_balance_applies(model, parameter):
+    """Site import/export is bounded by the nodal balance (no losses, no free loads)."""
+    return not model.multiNode and not parameter['system'].get('hvac_control', False)
+
+def grid_import_bound(model, parameter):
+    '''
+    Tightest valid upper bound of the grid import per timestep.
+
+    For single-node models the import can never exceed the load plus the
+    maximal battery charging power, otherwise the dynamic import limit applies.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        model with ts, nodes, load_input and dynamic_import_max
+    parameter : dict
+        DOPER parameter dict
+
+    Returns
+    -------
+    dict
+        import bound [kW] indexed by ts
+
+    '''
+    bound = {ts: value(model.dynamic_import_max[ts]) for ts in model.ts}
+    if not _site_balance_applies(model, parameter):
+        return bound
+    charge = _battery_power(parameter, 'power_charge')
+    for ts in model.ts:
+        load = sum(max(value(model.load_input[ts, n]), 0) for n in model.nodes)
+        bound[ts] = min(bound[ts], load + charge)
+    return bound
+
+def grid_export_bound(model, parameter):
+    '''
+    Tightest valid upper bound of the grid export per timestep.
+
+    For single-node models the export can never exceed pv, external
+    generation, maximal battery discharging power and genset capacity,
+    otherwise the dynamic export limit applies.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        model with ts, nodes, generation_pv, external_gen_power and dynamic_export_max
+    parameter : dict
+        DOPER parameter dict
+
+    Returns
+    -------
+    dict
+        export bound [kW] indexed by ts
+
+    '''
+    bound = {ts: value(model.dynamic_export_max[ts]) for ts in model.ts}
+    if not _site_balance_applies(model, parameter):
+        return bound
+    dispatchable = _battery_power(parameter, 'power_discharge') + _genset_capacity(parameter)
+    for ts in model.ts:
+        gen = sum(max(value(model.generation_pv[ts, n]), 0)
+                  + max(value(model.external_gen_power[ts, n]), 0) for n in model.nodes)
+        bound[ts] = min(bound[ts], gen + dispatchable)
+    return bound
+
+def pcc_bound(model, limit, dynamic_limit):
+    '''
+    Bound of import or export at a point of common coupling per timestep.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        model with ts
+    limit : float
+        static site limit, e.g. parameter['site']['import_max']
+    dynamic_limit : pyomo.core.base.param.IndexedParam
+        dynamic site limit indexed by ts, e.g. model.dynamic_import_max
+
+    Returns
+    -------
+    dict
+        bound [kW] indexed by ts
+
+    '''
+    return {ts: min(limit, value(dynamic_limit[ts])) for ts in model.ts}
+
+def fuel_flow_bound(model):
+    '''
+    Maximal fuel consumption rate per fuel when all gensets using it run at
+    full capacity.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        model with gensets and fuels
+
+    Returns
+    -------
+    dict
+        fuel consumption bound [kW] indexed by fuel
+
+    '''
+    return {f: sum(value(model.genset_capacities[g]) * value(model.genset_effs[g])
+                   * value(model.genset_fuels[g, f]) for g in model.gensets)
+            for f in model.fuels}
+
+def fuel_reserves_bound(model):
+    '''
+    Maximal fuel consumption rate from reserves per fuel. Limited by the
+    consumption rate and the reserves, which are shared over the horizon.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        model with gensets, fuels and fuel_reserves
+
+    Returns
+    -------
+    dict
+        fuel from reserves bound [kW] indexed by fuel
+
+    '''
+    flow = fuel_flow_bound(model)
+    return {f: min(flow[f], value(model.fuel_reserves[f])) for f in model.fuels}
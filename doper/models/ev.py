@@ -8,108 +8,93 @@ EV model module.
 """
 
 import numpy as np
-from pyomo.environ import Var, Constraint
+from pyomo.environ import Set, Var, Constraint
 
 
-def _get_avail(inputs, b):
-    """Convert availability to list."""
-    avail = inputs[f'battery_{b}_avail']
+def _get_avail(inputs, batteries):
+    """Convert availability of batteries to (battery x ts) matrix."""
+    avail = inputs[[f'battery_{b}_avail' for b in batteries]]
     ts = (avail.index.view(np.int64) / 1e9).tolist()
-    return avail.tolist(), ts
+    return avail.to_numpy().T, ts
+
+def _get_edges(avail):
+    """Return (battery, ts_in, ts_out) index arrays of every complete plug-in session."""
+    plugged = np.atleast_2d(np.asarray(avail) == 1).astype(np.int8)
+    step = np.diff(plugged, axis=1)
+    arrivals = np.zeros_like(plugged)
+    arrivals[:, 0] = plugged[:, 0]
+    arrivals[:, 1:] = step == 1
+    departures = np.zeros_like(plugged)
+    departures[:, 1:] = step == -1
+    # arrivals and departures alternate per battery, the k-th departure ends the k-th session
+    rows_in, cols_in = np.nonzero(arrivals)
+    rows_out, cols_out = np.nonzero(departures)
+    first_in = np.concatenate([[0], np.cumsum(arrivals.sum(axis=1))[:-1]])
+    first_out = np.concatenate([[0], np.cumsum(departures.sum(axis=1))[:-1]])
+    rank = np.arange(len(rows_out)) - first_out[rows_out]
+    return rows_out, cols_in[first_in[rows_out] + rank], cols_out
 
 def _get_sessions(avail, ts):
     """Return (ts_in, ts_out) pairs for every complete plug-in session."""
-    sessions = []
-    n = len(avail)
-    ts_in = ts[0] if avail[0] == 1 else None
-    for i in range(1, n):
-        if avail[i - 1] == 0 and avail[i] == 1:
-            ts_in = ts[i]
-        elif ts_in is not None and avail[i - 1] == 1 and avail[i] == 0:
-            sessions.append((ts_in, ts[i]))
-            ts_in = None
-    return sessions
+    _, cols_in, cols_out = _get_edges(avail)
+    return [(ts[i], ts[j]) for i, j in zip(cols_in, cols_out)]
 
 def _get_departures(avail, ts):
     """Return all timestamps where avail transitions 1->0."""
-    return [ts[i] for i in range(1, len(avail)) if avail[i - 1] == 1 and avail[i] == 0]
+    return [ts[j] for j in _get_edges(avail)[2]]
 
 def add_ev(model, inputs, parameter):
     """Add EV constraints and revenue/cost equations."""
 
     batt_param_map = {b['name']: b for b in parameter['batteries']}
-    batt_sessions = {}
-    counter = 0
-
-    # make min_leaving_soc constraints
-    for b in model.batteries:
-
-        # battery parameters
-        bp = batt_param_map[b]
-        min_soc = bp.get('min_leaving_soc', False)
-        added = bp.get('min_added_soc', 0) or 0
-
-        # skip
-        if min_soc is False:
-            continue
-
-        # convert plug-in times
-        avail, ts = _get_avail(inputs, b)
-        changed = any(avail[i] != avail[i - 1] for i in range(1, len(avail)))
-
-        # get all sessions [(ts_in, ts_out)]
-        batt_sessions[b] = _get_sessions(avail, ts)
-
-        # capacity
-        cap = model.bat_capacity[b]
-
-        if min_soc is True:
-            # do nothing if no full session
-            if not changed:
-                continue
-            # apply constraint for every complete session
-            for ts_in, ts_out in batt_sessions[b]:
-                model.add_component(
-                    f'constraint_ev_min_leaving_energy_{b}_{counter}',
-                    Constraint(expr=(
-                        model.battery_energy[ts_out, b]
-                        >= model.battery_energy[ts_in, b] + added * cap
-                    ))
-                )
-                counter += 1
-        else:
-            # fixed >= min_soc when unplug
-            min_soc_b = float(min_soc) * cap + added * cap
-            for ts_out in _get_departures(avail, ts):
-                model.add_component(
-                    f'constraint_ev_min_leaving_energy_{b}_{counter}',
-                    Constraint(expr=(model.battery_energy[ts_out, b] >= min_soc_b))
-                )
-                counter += 1
+    min_soc = {b: batt_param_map[b].get('min_leaving_soc', False) for b in model.batteries}
+    added = {b: batt_param_map[b].get('min_added_soc', 0) or 0 for b in model.batteries}
+
+    # get all sessions of batteries with min_leaving_soc [(ts_in, ts_out)]
+    evs = [b for b in model.batteries if min_soc[b] is not False]
+    batt_sessions = {b: [] for b in evs}
+    if evs:
+        avail, ts = _get_avail(inputs, evs)
+        for row, i, j in zip(*_get_edges(avail)):
+            batt_sessions[evs[row]].append((ts[i], ts[j]))
+
+    # sessions and departures with min leaving energy
+    model.ev_sessions = Set(dimen=3, ordered=True, doc='complete plug-in sessions (battery, ts_in, ts_out)',
+                            initialize=[(b, ts_in, ts_out) for b in evs if min_soc[b] is True
+                                        for ts_in, ts_out in batt_sessions[b]])
+    model.ev_departures = Set(dimen=2, ordered=True, doc='departures (battery, ts_out)',
+                              initialize=[(b, ts_out) for b in evs if min_soc[b] is not True
+                                          for _, ts_out in batt_sessions[b]])
+
+    # energy added during every complete session
+    def ev_min_leaving_energy(model, b, ts_in, ts_out):
+        return model.battery_energy[ts_out, b] >= \
+            model.battery_energy[ts_in, b] + added[b] * model.bat_capacity[b]
+    model.constraint_ev_min_leaving_energy = Constraint(model.ev_sessions, rule=ev_min_leaving_energy,
+                                                        doc='min energy added per EV session')
+
+    # fixed >= min_soc when unplug
+    def ev_min_leaving_soc(model, b, ts_out):
+        return model.battery_energy[ts_out, b] >= \
+            (float(min_soc[b]) + added[b]) * model.bat_capacity[b]
+    model.constraint_ev_min_leaving_soc = Constraint(model.ev_departures, rule=ev_min_leaving_soc,
+                                                     doc='min EV energy at departure')
 
     # ev charging revenue
     model.battery_ev_charging_revenue = Var(model.batteries, doc='per-battery EV charging revenue [$]',
                                             bounds=(None, None))
     model.ev_charging_revenue = Var(doc='total EV charging revenue [$]', bounds=(None, None))
 
-    for b in model.batteries:
+    # revenue for each charging session, 0 if no session
+    def battery_ev_charging_revenue(model, b):
         rate = batt_param_map[b].get('charging_revenue', 0)
-        sessions = batt_sessions.get(b, [])
-
-        if rate and sessions:
-            # revenue for each charging session
-            expr = model.battery_ev_charging_revenue[b] == sum(
-                rate * (model.battery_energy[ts_out, b] - model.battery_energy[ts_in, b])
-                for ts_in, ts_out in sessions
-            )
-        else:
-            # no session
-            expr = model.battery_ev_charging_revenue[b] == 0
-
-        model.add_component(
-            f'constraint_battery_ev_charging_revenue_{b}',
-            Constraint(expr=expr)
+        return model.battery_ev_charging_revenue[b] == sum(
+            rate * (model.battery_energy[ts_out, b] - model.battery_energy[ts_in, b])
+            for ts_in, ts_out in batt_sessions.get(b, []) if rate
         )
+    model.constraint_battery_ev_charging_revenue = Constraint(
+        model.batteries, rule=battery_ev_charging_revenue, doc='per-battery EV charging revenue'
+    )
     # total ev chrging revenue
     model.constraint_ev_charging_revenue = Constraint(
         expr=model.ev_charging_revenue == sum(
@@ -122,22 +107,18 @@ def add_ev(model, inputs, parameter):
                                             bounds=(0, None))
     model.ev_discharging_cost = Var(doc='total EV discharging cost [$]', bounds=(0, None))
 
-    for b in model.batteries:
+    # apply rate, 0 if no cost
+    def battery_ev_discharging_cost(model, b):
         rate = batt_param_map[b].get('discharging_cost', 0)
-        if rate:
-            # apply rate
-            expr = model.battery_ev_discharging_cost[b] == rate * sum(
-                model.battery_discharge_grid_power[ts, b] / model.timestep_scale_fwd[ts]
-                for ts in model.accounting_ts
-            )
-        else:
-            # no cost
-            expr = model.battery_ev_discharging_cost[b] == 0
-
-        model.add_component(
-            f'constraint_battery_ev_discharging_cost_{b}',
-            Constraint(expr=expr)
+        if not rate:
+            return model.battery_ev_discharging_cost[b] == 0
+        return model.battery_ev_discharging_cost[b] == rate * sum(
+            model.battery_discharge_grid_power[ts, b] / model.timestep_scale_fwd[ts]
+            for ts in model.accounting_ts
         )
+    model.constraint_battery_ev_discharging_cost = Constraint(
+        model.batteries, rule=battery_ev_discharging_cost, doc='per-battery EV discharging cost'
+    )
     # total ev discharging cost
     model.constraint_ev_discharging_cost = Constraint(
         expr=model.ev_discharging_cost == sum(
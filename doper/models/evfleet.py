@@ -0,0 +1,429 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+""""Distributed Optimal and Predictive Energy Resources
+EV fleet aggregation module.
+
+The EVs of a fleet are replaced by one virtual battery per node before the
+model is built, so the model size does not depend on the number of vehicles.
+The virtual battery stores the net energy delivered to the fleet since the
+start of the horizon. Its time-varying energy envelope is the sum of the
+per-vehicle envelopes of each plug-in session, derived from the
+`battery_{name}_avail` and `battery_{name}_demand` inputs and the
+`min_leaving_soc` and `min_added_soc` parameters. Its availability is the
+share of the fleet charging power which is plugged in.
+
+The envelope is an outer approximation of the fleet flexibility. After the
+solve, the virtual battery power is split to the vehicles with a
+least-laxity-first dispatch, which charges the vehicles closest to missing
+their departure requirement first.
+"""
+
+import copy
+import numpy as np
+import pandas as pd
+
+from .aggregation import _asset_node, _unique_name
+from .ev import _get_edges
+
+# name of the virtual battery (suffixed with the node for multinode models)
+FLEET_NAME = 'ev_fleet'
+
+def _fleet_vehicles(parameter, fleet):
+    """Names of the batteries in the fleet; True selects all batteries with min_leaving_soc."""
+    if fleet is True:
+        return [b['name'] for b in parameter.get('batteries', [])
+                if b.get('min_leaving_soc', False) is not False]
+    return [b['name'] for b in parameter.get('batteries', []) if b['name'] in fleet]
+
+def _hours(index):
+    """Hours since the first timestep, with one more step appended after the horizon."""
+    hours = (index - index[0]).total_seconds().to_numpy() / 3600
+    last = hours[-1] - hours[-2] if len(hours) > 1 else 1
+    return np.append(hours, hours[-1] + last)
+
+def fleet_arrays(inputs, vehicles):
+    '''
+    Collect vehicle parameters and schedules of a fleet as arrays.
+
+    Parameters
+    ----------
+    inputs : pandas.DataFrame
+        timeseries inputs of the optimization
+    vehicles : list of dict
+        battery parameters of the vehicles in the fleet
+
+    Returns
+    -------
+    fleet : dict
+        vehicle names, parameter arrays (n,), availability and demand (n x ts),
+        hours since start (ts+1) and the index of the departure ending the
+        current session per timestep (n x ts), which is len(ts) for sessions
+        which are open at the end of the horizon
+
+    '''
+    n_ts = len(inputs.index)
+    names = [v['name'] for v in vehicles]
+    def column(template, default):
+        return np.array([inputs[template.format(b)].to_numpy(dtype=float)
+                         if template.format(b) in inputs.columns else np.full(n_ts, default)
+                         for b in names]).reshape(len(names), n_ts)
+    def prop(key, default=0):
+        return np.array([float(v.get(key, default) or 0) for v in vehicles])
+    fleet = {
+        'names': names,
+        'capacity': prop('capacity'),
+        'eff_charge': prop('efficiency_charging', 1),
+        'eff_discharge': prop('efficiency_discharging', 1),
+        'power_charge': prop('power_charge'),
+        'power_discharge': prop('power_discharge'),
+        'soc_min': prop('soc_min'),
+        'soc_max': prop('soc_max', 1),
+        'soc_initial': prop('soc_initial'),
+        'added': prop('min_added_soc'),
+        # True: energy added per session, number: min leaving soc, NaN: none
+        'session_added': np.array([v.get('min_leaving_soc', False) is True for v in vehicles]),
+        'leaving_soc': np.array([np.nan if v.get('min_leaving_soc', False) in (True, False, None)
+                                 else float(v['min_leaving_soc']) for v in vehicles]),
+        'avail': column('battery_{}_avail', 1),
+        'demand': column('battery_{}_demand', 0),
+        'hours': _hours(inputs.index),
+    }
+    # the departure ending the session of each plugged in timestep
+    rows, cols_in, cols_out = _get_edges(np.hstack([fleet['avail'], np.zeros((len(names), 1))]))
+    departure = np.full((len(names), n_ts), n_ts)
+    for row, col_in, col_out in zip(rows, cols_in, cols_out):
+        departure[row, col_in:col_out] = col_out
+    fleet['sessions'] = (rows, cols_in, cols_out)
+    fleet['departure'] = departure
+    return fleet
+
+def _session_target(fleet, rows, energy_in):
+    """Energy at departure of sessions of the given vehicles, at least the arrival energy (-inf if none)."""
+    capacity = fleet['capacity'][rows]
+    target = np.where(np.isnan(fleet['leaving_soc'][rows]), -np.inf,
+                      np.maximum((fleet['leaving_soc'][rows] + fleet['added'][rows]) * capacity, energy_in))
+    target = np.where(fleet['session_added'][rows],
+                      energy_in + fleet['added'][rows] * capacity, target)
+    return target
+
+def fleet_envelopes(fleet):
+    '''
+    Compute the power and energy envelopes of a fleet.
+
+    Every plug-in session bounds the energy delivered to its vehicle between
+    charging as late and as early as possible, limited by the power and the
+    SOC limits. Vehicles with a departure requirement leave with exactly that
+    energy, so the fleet cannot use energy of vehicles which already left.
+    The energy of a vehicle at arrival follows from its previous session and
+    the demand while driving. Sessions which are still open at the end of the
+    horizon have no requirement.
+
+    Parameters
+    ----------
+    fleet : dict
+        fleet arrays as returned by fleet_arrays
+
+    Returns
+    -------
+    envelopes : dict
+        'energy_min' and 'energy_max' [kWh], the net energy delivered to the
+        fleet since the first timestep (battery side), and 'avail' [-], the
+        share of the fleet charging power which is plugged in, per timestep
+
+    '''
+    n_ts = fleet['avail'].shape[1]
+    hours = fleet['hours']
+    rows, cols_in, cols_out = fleet['sessions']
+    cap = fleet['capacity']
+    charge = fleet['power_charge'] * fleet['eff_charge']
+    discharge = fleet['power_discharge'] / np.maximum(fleet['eff_discharge'], 1e-3)
+    e_min = fleet['soc_min'] * cap
+    e_max = fleet['soc_max'] * cap
+
+    # energy consumed while driving, up to each timestep
+    demand_steps = fleet['demand'] * np.diff(hours)
+    demand = np.hstack([np.zeros((len(cap), 1)), np.cumsum(demand_steps, axis=1)])
+
+    # session rank per vehicle, the previous session sets the arrival energy
+    first = np.searchsorted(rows, rows)
+    rank = np.arange(len(rows)) - first
+    energy_last = fleet['soc_initial'] * cap
+    col_last = np.zeros(len(cap), dtype=int)
+
+    ts = np.arange(n_ts)
+    energy_min = np.zeros(n_ts)
+    energy_max = np.zeros(n_ts)
+    for r in range(rank.max() + 1 if len(rank) else 0):
+        s = rank == r
+        b, col_in, col_out = rows[s], cols_in[s], cols_out[s]
+        energy_in = energy_last[b] - (demand[b, col_in] - demand[b, col_last[b]])
+        energy_in = np.clip(energy_in, e_min[b], e_max[b])
+        target = np.where(col_out < n_ts, _session_target(fleet, b, energy_in), -np.inf)
+
+        # bounds are constant after departure and zero before arrival
+        k = np.minimum(ts[None, :], col_out[:, None])
+        since = hours[k] - hours[col_in][:, None]
+        until = hours[col_out][:, None] - hours[k]
+        duration = hours[col_out] - hours[col_in]
+        # vehicles with a requirement are charged up to it and leave with exactly that energy
+        leaving = np.clip(target - energy_in,
+                          np.maximum(-discharge[b] * duration, e_min[b] - energy_in),
+                          np.minimum(charge[b] * duration, e_max[b] - energy_in))[:, None]
+        fixed = np.isfinite(target)[:, None]
+        upper = np.minimum(charge[b, None] * since, (e_max[b] - energy_in)[:, None])
+        upper = np.where(fixed, np.minimum(upper, leaving), upper)
+        lower = np.maximum(-discharge[b, None] * since, (e_min[b] - energy_in)[:, None])
+        lower = np.where(fixed, np.maximum(lower, leaving - charge[b, None] * until), lower)
+        arrived = ts[None, :] >= col_in[:, None]
+        energy_min += (lower * arrived).sum(axis=0)
+        energy_max += (upper * arrived).sum(axis=0)
+
+        energy_last[b] = energy_in + np.where(fixed[:, 0], leaving[:, 0], lower[:, -1])
+        col_last[b] = np.minimum(col_out, n_ts)
+
+    power = fleet['power_charge'].sum()
+    avail = fleet['power_charge'] @ fleet['avail'] / power if power else np.zeros(n_ts)
+    return {'energy_min': energy_min, 'energy_max': energy_max, 'avail': avail}
+
+def _virtual_battery(name, vehicles, fleet, envelopes):
+    """Battery parameter and energy offset of the virtual battery of a fleet."""
+    power_charge = fleet['power_charge'].sum()
+    power_discharge = fleet['power_discharge'].sum()
+    # offset so that the stored energy is non-negative
+    offset = max(-envelopes['energy_min'].min(), 0)
+    capacity = max(offset + envelopes['energy_max'].max(), 1e-3)
+    def weighted(key, weights):
+        values = np.array([float(v.get(key, 0) or 0) for v in vehicles])
+        return float(values @ weights / weights.sum()) if weights.sum() else float(values.mean())
+    battery = {
+        'name': name,
+        'capacity': capacity,
+        'efficiency_charging': float((fleet['power_charge'] * fleet['eff_charge']).sum() / power_charge)
+                               if power_charge else 1,
+        'efficiency_discharging': float(power_discharge / (fleet['power_discharge']
+                                                           / fleet['eff_discharge']).sum())
+                                  if power_discharge else 1,
+        'power_charge': float(power_charge),
+        'power_discharge': float(power_discharge),
+        'maxS': float(sum(v.get('maxS', 0) for v in vehicles)),
+        'self_discharging': 0,
+        'soc_initial': offset / capacity,
+        'soc_max': 1,
+        'soc_min': 0,
+        'cycle_cost': weighted('cycle_cost', fleet['power_charge']),
+        'discharging_cost': weighted('discharging_cost', fleet['power_discharge']),
+        'battery_power': float(sum(v.get('battery_power', 0) for v in vehicles)),
+    }
+    return battery, offset
+
+def aggregate_ev_fleet(inputs, parameter, fleet=True):
+    '''
+    Replace the EVs of a fleet with one virtual battery per node.
+
+    Parameters
+    ----------
+    inputs : pandas.DataFrame
+        timeseries inputs of the optimization
+    parameter : dict
+        DOPER parameter dict
+    fleet : bool or list, optional
+        batteries in the fleet; True for all batteries with min_leaving_soc.
+        The default is True.
+
+    Returns
+    -------
+    inputs : pandas.DataFrame
+        inputs with availability and energy envelope columns of the virtual batteries
+    parameter : dict
+        parameter with the virtual batteries instead of the vehicles
+    fleets : dict
+        mapping of virtual battery name to its fleet arrays (see fleet_arrays)
+
+    '''
+    names = _fleet_vehicles(parameter, fleet)
+    if not parameter['system'].get('battery') or not names:
+        return inputs, parameter, {}
+
+    # one fleet per node
+    groups = {}
+    for name in names:
+        groups.setdefault(_asset_node(parameter, 'batteries', name), []).append(name)
+
+    new_parameter = copy.deepcopy(parameter)
+    batteries = {b['name']: b for b in new_parameter['batteries']}
+    existing = set(batteries)
+    new_columns = {}
+    fleets = {}
+    virtual = []
+    for node, group in groups.items():
+        name = _unique_name(FLEET_NAME if node is None else f'{FLEET_NAME}_{node}', existing)
+        existing.add(name)
+        vehicles = [batteries[b] for b in group]
+        arrays = fleet_arrays(inputs, vehicles)
+        envelopes = fleet_envelopes(arrays)
+        battery, offset = _virtual_battery(name, vehicles, arrays, envelopes)
+        virtual.append(battery)
+        fleets[name] = arrays
+
+        new_columns[f'battery_{name}_avail'] = envelopes['avail']
+        new_columns[f'battery_{name}_demand'] = 0.
+        new_columns[f'battery_{name}_energy_min'] = envelopes['energy_min'] + offset
+        new_columns[f'battery_{name}_energy_max'] = envelopes['energy_max'] + offset
+
+        # node location
+        if node is not None:
+            for n in new_parameter['network']['nodes']:
+                if n['node_id'] != node:
+                    continue
+                location = n['ders']['battery']
+                if isinstance(location, list):
+                    n['ders']['battery'] = [b for b in location if b not in group] + [name]
+                else:
+                    n['ders']['battery'] = name
+
+    new_parameter['batteries'] = [b for b in new_parameter['batteries'] if b['name'] not in names] \
+                                 + virtual
+    return pd.concat([inputs, pd.DataFrame(new_columns, index=inputs.index)], axis=1, copy=False), \
+           new_parameter, fleets
+
+def _fill_in_order(power, limit):
+    """Assign power to the limits in the given order."""
+    before = np.cumsum(limit) - limit
+    return np.minimum(limit, np.maximum(power - before, 0))
+
+def _fill_shared(power, limit, weight):
+    """Assign power proportional to weight, redistributing what exceeds the limits."""
+    share = np.zeros(len(limit))
+    open_ = (limit > 0) & (weight > 0)
+    while power > 1e-9 and open_.any():
+        add = np.minimum(power * weight * open_ / weight[open_].sum(), limit - share)
+        share += add
+        power -= add.sum()
+        open_ &= share < limit - 1e-9
+    return share
+
+def least_laxity_first(power, fleet):
+    '''
+    Split the net grid power of a fleet to its vehicles.
+
+    In every timestep, charging power goes to the plugged in vehicles with the
+    least laxity first, the time until departure minus the time needed to
+    reach the departure requirement at full power, as far as they would
+    otherwise miss it. The remaining power is shared by the headroom to the
+    requirement, as assumed by the fleet envelope. Discharging power is shared
+    by the energy the vehicles can give without making their requirement
+    unreachable, so that they keep their power available for longer. Power
+    the vehicles cannot take is not assigned.
+
+    Parameters
+    ----------
+    power : numpy.ndarray
+        net grid power of the fleet per timestep [kW]
+    fleet : dict
+        fleet arrays as returned by fleet_arrays
+
+    Returns
+    -------
+    vehicle_power : numpy.ndarray
+        net grid power per vehicle and timestep (n x ts) [kW]
+    energy : numpy.ndarray
+        stored energy per vehicle at the start of each timestep (n x ts) [kWh]
+
+    '''
+    n, n_ts = fleet['avail'].shape
+    hours = fleet['hours']
+    cap = fleet['capacity']
+    eff_c = np.maximum(fleet['eff_charge'], 1e-3)
+    eff_d = np.maximum(fleet['eff_discharge'], 1e-3)
+    charge = fleet['power_charge'] * eff_c
+    e_min = fleet['soc_min'] * cap
+    e_max = fleet['soc_max'] * cap
+
+    vehicle_power = np.zeros((n, n_ts))
+    energy = np.zeros((n, n_ts))
+    e = fleet['soc_initial'] * cap
+    target = np.full(n, -np.inf)
+    for k in range(n_ts):
+        dt = hours[k+1] - hours[k]
+        plugged = fleet['avail'][:, k] == 1
+        departure = fleet['departure'][:, k]
+
+        # requirement of sessions starting now
+        arriving = plugged & ((fleet['avail'][:, k-1] != 1) if k else True)
+        if arriving.any():
+            rows = np.nonzero(arriving)[0]
+            target[rows] = np.where(departure[rows] < n_ts,
+                                    np.minimum(_session_target(fleet, rows, e[rows]), e_max[rows]),
+                                    -np.inf)
+        until = hours[np.minimum(departure, n_ts)] - hours[k]
+        need = np.maximum(target - e, 0)
+        laxity = until - np.divide(need, charge, out=np.full(n, np.inf), where=charge > 0)
+
+        # charging up to the requirement and discharging keeping it reachable
+        full = np.where(np.isfinite(target), target, e_max)
+        charge_max = np.where(plugged, np.minimum(fleet['power_charge'],
+                                                  np.maximum(full - e, 0) / (eff_c * dt)), 0)
+        floor = np.maximum(e_min, target - charge * (until - dt))
+        discharge_max = np.where(plugged, np.minimum(fleet['power_discharge'],
+                                                     np.maximum(e - floor, 0) * eff_d / dt), 0)
+
+        p = power[k]
+        if p >= 0:
+            # vehicles which would miss their requirement otherwise, least laxity first
+            urgent = np.minimum(np.maximum(need - charge * (until - dt), 0) / (eff_c * dt), charge_max)
+            order = np.argsort(laxity, kind='stable')
+            share = np.zeros(n)
+            share[order] = _fill_in_order(p, urgent[order])
+            # remaining power shared by the remaining headroom
+            share += _fill_shared(p - share.sum(), charge_max - share, np.maximum(full - e, 0))
+        else:
+            # discharge shared by the energy above the requirement, so vehicles empty together
+            share = -_fill_shared(-p, discharge_max, np.maximum(e - floor, 0))
+        vehicle_power[:, k] = share
+
+        energy[:, k] = e
+        e = e + np.where(vehicle_power[:, k] >= 0, vehicle_power[:, k] * eff_c,
+                         vehicle_power[:, k] / eff_d) * dt - fleet['demand'][:, k] * dt
+    return vehicle_power, energy
+
+def disaggregate_ev_fleet(df, output_list, fleets):
+    '''
+    Split results of virtual fleet batteries to the vehicles.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        results dataframe from DOPER.write_ts_results
+    output_list : list
+        output instructions used to create df
+    fleets : dict
+        fleets as returned by aggregate_ev_fleet
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        results with net grid power, energy and SOC columns per vehicle
+
+    '''
+    labels = {o['data']: o['df_label'] for o in output_list if o.get('index') == 'batteries'}
+    if 'battery_net_grid_power' not in labels:
+        return df
+    new_columns = {}
+    for name, fleet in fleets.items():
+        col = labels['battery_net_grid_power'] % name
+        if col not in df.columns:
+            continue
+        vehicle_power, energy = least_laxity_first(df[col].to_numpy(dtype=float), fleet)
+        soc = energy / np.maximum(fleet['capacity'], 1e-3)[:, None]
+        for ii, vehicle in enumerate(fleet['names']):
+            new_columns[labels['battery_net_grid_power'] % vehicle] = vehicle_power[ii]
+            if 'battery_energy' in labels:
+                new_columns[labels['battery_energy'] % vehicle] = energy[ii]
+            if 'battery_soc' in labels:
+                new_columns[labels['battery_soc'] % vehicle] = soc[ii]
+    if not new_columns:
+        return df
+    return df.assign(**new_columns)
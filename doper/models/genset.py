@@ -11,7 +11,6 @@ import sys
 import logging
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary
 
 def get_root(f=None):
@@ -25,6 +24,7 @@ def get_root(f=None):
 root = get_root()
 
 from ..utility import pandas_to_dict, pyomo_read_parameter, get_root, extract_properties    
+from .bounds import fuel_flow_bound, fuel_reserves_bound
 
 
 def add_genset(model, inputs, parameter):
@@ -232,37 +232,55 @@ def add_genset(model, inputs, parameter):
     model.constraint_total_genset_fuel_consumption_source = Constraint(model.ts, model.fuels, \
                                                                 rule=total_genset_fuel_consumption_source, \
                                                                 doc='constraint total genset fuel consumption source')
-    # fuel imports are zero if not available    
+    # big-M of fuel outage constraints from genset capacities and fuel reserves
+    model.genset_fuel_import_bigM = Param(model.fuels, initialize=fuel_flow_bound(model), \
+                                          doc='fuel import big-M [kW]')
+    model.genset_fuel_reserves_bigM = Param(model.fuels, initialize=fuel_reserves_bound(model), \
+                                            doc='fuel from reserves big-M [kW]')
+
+    # fix fuel source by fuel availability instead of constraining it
+    for ts in model.ts:
+        for ff in model.fuels:
+            if model.fuel_available[ts] == 1:
+                model.genset_fuel_from_reserves_profile[ts, ff].fix(0)
+            elif model.fuel_available[ts] == 0:
+                model.genset_fuel_import_profile[ts, ff].fix(0)
+
+    # fuel imports are zero if not available (only partial availability, otherwise fixed)
     def genset_fuel_import_limit(model, ts, fuel):
-        return model.genset_fuel_import_profile[ts, fuel] <=  1e9 * model.fuel_available[ts]
+        if model.fuel_available[ts] in [0, 1]:
+            return Constraint.Skip
+        return model.genset_fuel_import_profile[ts, fuel] <=  model.genset_fuel_import_bigM[fuel] * model.fuel_available[ts]
     model.constraint_genset_fuel_import_limit = Constraint(model.ts, model.fuels, \
                                                                 rule=genset_fuel_import_limit, \
                                                                 doc='constraint total genset fuel import limit')
     # fuel from reserves disabled if available from utility import    
     def genset_fuel_reserves_limit(model, ts, fuel):
-        return model.genset_fuel_from_reserves_profile[ts, fuel] <=  1e9 * (1 - model.fuel_available[ts])
+        if model.fuel_available[ts] in [0, 1]:
+            return Constraint.Skip
+        return model.genset_fuel_from_reserves_profile[ts, fuel] <=  model.genset_fuel_reserves_bigM[fuel] * (1 - model.fuel_available[ts])
     model.constraint_genset_fuel_reserves_limit = Constraint(model.ts, model.fuels, \
                                                                 rule=genset_fuel_reserves_limit, \
                                                                 doc='constraint total genset fuel reserves limit')
     # total fuel reserves consumed must be less than reserves on hand
-    def total_genset_reserves_volume(model, ts, fuel):
+    def total_genset_reserves_volume(model, fuel):
         return model.fuel_reserves[fuel] >=  sum(model.genset_fuel_from_reserves_profile[ts, fuel] \
                                                                   for ts in model.ts)
-    model.constraint_total_genset_reserves_volume = Constraint(model.ts, model.fuels, \
+    model.constraint_total_genset_reserves_volume = Constraint(model.fuels, \
                                                                 rule=total_genset_reserves_volume, \
                                                                 doc='constraint total genset fuel consumption from reserves')
         
     # aggregate genset power output by node, works by default for single-node models
-    def total_genset_output(model, ts, gensets, nodes):
+    def total_genset_output(model, ts, nodes):
         return model.sum_genset_power[ts, nodes] ==  sum((model.genset_power[ts, genset] * model.genset_node_location[genset, nodes]) for genset in model.gensets)
-    model.constraint_total_genset_output = Constraint(model.ts, model.gensets, model.nodes, \
+    model.constraint_total_genset_output = Constraint(model.ts, model.nodes, \
                                                                     rule=total_genset_output, \
                                                                     doc='constraint total genset output power')
             
     # sum site-wide genset output
-    def site_total_genset_output(model, ts, nodes):
+    def site_total_genset_output(model, ts):
         return model.sum_genset_power_site[ts] ==  sum(model.sum_genset_power[ts, node] for node in model.nodes)
-    model.constraint_site_total_genset_output = Constraint(model.ts,  model.nodes, \
+    model.constraint_site_total_genset_output = Constraint(model.ts, \
                                                                     rule=site_total_genset_output, \
                                                                     doc='site total genset output power')
     
@@ -10,8 +10,7 @@ import os
 import sys
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary
+from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary, NonNegativeIntegers
 
 def get_root(f=None):
     try:
@@ -31,16 +30,16 @@ def add_loadControl(model, inputs, parameter):
     assert parameter['system']['load_control'] is True, \
         "Load Control is not enabled in system configuration"
     
+    # if no name for load circuit provided, use its number (without modifying the caller's parameter)
+    if any('name' not in circuit for circuit in parameter['load_control']):
+        parameter = dict(parameter, load_control=[dict({'name': f'{cc+1}'}, **circuit)
+                                                  for cc, circuit in enumerate(parameter['load_control'])])
+
     # list of required genset parameters
     loadParams =  ['name', 'cost', 'outageOnly']   
     # check that all load circuits have required parameters
     for cc in range(0, len(parameter['load_control'])):
         
-        # if no name for load circuit provided, overwrite with number
-        if 'name' not in parameter['load_control'][cc].keys():
-            parameter['load_control'][cc]['name'] = f'{cc+1}'
-        
-        
         for pp in loadParams:
             assert pp in  parameter['load_control'][cc].keys(), \
                 f'Load circuit {cc+1} missing required parameter: {pp}'
@@ -69,6 +68,10 @@ def add_loadControl(model, inputs, parameter):
     load_connected_dict = {circuit['name']: circuit.get('load_connected', 1) for circuit in parameter['load_control']}
     model.load_connected = Param(model.load_circuits, initialize=load_connected_dict, \
                                 doc='load circuit initial connection state (1=connected, 0=disconnected) [-]')
+    # optional number of identical units switched by a circuit (aggregated circuits)
+    load_units_dict = {circuit['name']: circuit.get('units', 1) for circuit in parameter['load_control']}
+    model.load_units = Param(model.load_circuits, initialize=load_units_dict, \
+                                doc='number of identical units of load circuit [-]')
         
     # read in load_shed_potential ts-data by circuit name
     # data should exist as a column with name 'load_shed_potential_{c}', where c is name of load control circuit
@@ -128,8 +131,11 @@ def add_loadControl(model, inputs, parameter):
                 
     
     # # Variables
+    def load_circuits_on_bounds(model, ts, load_circuit):
+        return (0, model.load_units[load_circuit])
     model.load_circuits_on = Var(model.ts, model.load_circuits, \
-                                              domain=Binary, doc='binary var indicating if load circuit is on [1/0]')    
+                                              domain=NonNegativeIntegers, bounds=load_circuits_on_bounds, \
+                                              doc='number of units of load circuit which are on, binary for single units [-]')
     model.load_shed_circuit = Var(model.ts, model.load_circuits, bounds=(0, None), \
                                   doc='load shed amount due to load control use for each load circuit [kW]')
     model.der_shed_load = Var(model.ts, model.load_circuits, bounds=(0, None), \
@@ -142,23 +148,31 @@ def add_loadControl(model, inputs, parameter):
     
     ## Constraints
     
-    # load circuit must be on for outage-only if grid available
+    # load circuit must be on for outage-only if grid available (fixed if fully available)
+    for ts in model.ts:
+        for cc in model.load_circuits:
+            if model.load_outageOnly[cc] * model.grid_available[ts] == 1:
+                model.load_circuits_on[ts, cc].fix(model.load_units[cc])
+
     def outage_shed_constraint(model, ts, load_circuit):
-        return model.load_circuits_on[ts, load_circuit] >=  model.load_outageOnly[load_circuit] * model.grid_available[ts]
+        if model.load_outageOnly[load_circuit] * model.grid_available[ts] in [0, 1]:
+            return Constraint.Skip
+        return model.load_circuits_on[ts, load_circuit] >=  model.load_outageOnly[load_circuit] * model.grid_available[ts] \
+            * model.load_units[load_circuit]
     model.constraint_outage_shed = Constraint(model.ts, model.load_circuits, \
                                                     rule=outage_shed_constraint, \
                                                     doc='constraint load shed for outage only')
         
     # load shed volume by circuit
     def circuit_shed_load(model, ts, load_circuit):
-        return model.load_shed_circuit[ts, load_circuit] ==  model.load_shed_potential[ts, load_circuit] * (1 - model.load_circuits_on[ts, load_circuit])
+        return model.load_shed_circuit[ts, load_circuit] ==  model.load_shed_potential[ts, load_circuit] * (model.load_units[load_circuit] - model.load_circuits_on[ts, load_circuit])
     model.constraint_circuit_shed_load = Constraint(model.ts, model.load_circuits, \
                                                     rule=circuit_shed_load, \
                                                     doc='constraint load shed volume by circuit')
     
     # total load shed across all circuits
     def total_shed_load(model, ts):
-        return model.load_shed_site[ts] ==  sum(model.load_shed_potential[ts, circuit] * (1 - model.load_circuits_on[ts, circuit]) \
+        return model.load_shed_site[ts] ==  sum(model.load_shed_potential[ts, circuit] * (model.load_units[circuit] - model.load_circuits_on[ts, circuit]) \
                                               for circuit in model.load_circuits)
     model.constraint_total_shed_load= Constraint(model.ts, \
                                                     rule=total_shed_load, \
@@ -6,6 +6,7 @@
 """"Distributed Optimal and Predictive Energy Resources
 Model construction module.
 """
+import logging
 from pyomo.environ import Objective, minimize
 
 from .basemodel import base_model
@@ -13,7 +14,7 @@ from .battery import add_battery
 from .ev import add_ev
 from .genset import add_genset
 from .loadControl import add_loadControl
-from ..utility import OBJECTIVE_TERMS
+from ..utility import OBJECTIVE_TERMS, find_duplicate_constraints
 
 
 def construct_model_function():
@@ -47,6 +48,11 @@ def construct_model_function():
         model.objective = Objective(rule=objective_function,
                                     sense=minimize,
                                     doc='objective function')
+
+        # report redundant formulation
+        if parameter.get('controller', {}).get('report_duplicates', False):
+            for name, count in find_duplicate_constraints(model).items():
+                logging.warning(f'{count} duplicate constraint rows in {name}')
         return model
 
     return control_model
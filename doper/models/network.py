@@ -12,9 +12,9 @@ import logging
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary
+from pyomo.environ import ConcreteModel, Set, Param, Var, Constraint, Binary, value
 from copy import deepcopy
+from itertools import product
 
 def get_root(f=None):
     try:
@@ -28,6 +28,7 @@ root = get_root()
 
 
 from ..utility import pandas_to_dict, pyomo_read_parameter, get_root, extract_properties
+from .bounds import pcc_bound
 
 
 def add_network(model, inputs, parameter):
@@ -67,6 +68,145 @@ def add_network(model, inputs, parameter):
     return model
     
 
+def lazy_rule(model, name, rule):
+    '''
+    returns the constraint rule, or a rule skipping all rows if lazy network
+    constraints are enabled. Skipped rows are added by add_violated_network_limits
+
+    Parameters
+    ----------
+    model : pyomo model
+        DOPER pyomo model with lazyNetworkConstraints setting.
+    name : str
+        name of the constraint component.
+    rule : function
+        constraint rule.
+
+    Returns
+    -------
+    rule : function
+        rule used to construct the constraint component.
+
+    '''
+    
+    if not model.lazyNetworkConstraints:
+        return rule
+    
+    model.lazyNetworkRules[name] = rule
+    def skip_rule(model, *index):
+        return Constraint.Skip
+    return skip_rule
+
+def _component_array(component, *sets):
+    '''
+    returns values of an indexed var or param as array with one axis per index set
+    '''
+    keys = product(*sets) if len(sets) > 1 else sets[0]
+    values = [value(component[k], exception=False) for k in keys]
+    return np.array([np.nan if v is None else v for v in values], dtype=float) \
+        .reshape([len(s) for s in sets])
+
+def network_limit_violations(model, tol=1e-6):
+    '''
+    finds the rows of lazy voltage and current limits which are violated by
+    the current solution of the model. Violations are evaluated on arrays of
+    the solution, without constructing the constraints
+
+    Parameters
+    ----------
+    model : pyomo model
+        solved DOPER pyomo model with powerflow equations.
+    tol : float, optional
+        tolerance of violation. The default is 1e-6.
+
+    Returns
+    -------
+    violations : dict
+        list of violated constraint indices by constraint name.
+
+    '''
+    
+    ts = list(model.ts)
+    nodes = list(model.nodes)
+    
+    # excess of each limit, positive if violated
+    excess = {}
+    voltReal = _component_array(model.voltage_real, ts, nodes)
+    if model.enableVoltageAngleConstraint:
+        voltImag = _component_array(model.voltage_imag, ts, nodes)
+        excess['constraint_pf_volt_limit_eq1'] = voltImag - \
+            ((math.sin(model.thetaMax)-math.sin(model.thetaMin)) / \
+             (math.cos(model.thetaMax)-math.cos(model.thetaMin)) * \
+             (voltReal-model.voltMin*math.cos(model.thetaMin)) \
+             + model.voltMin*math.sin(model.thetaMin))
+        excess['constraint_pf_volt_limit_eq2'] = voltImag - \
+            (math.sin(model.thetaMax)) / (math.cos(model.thetaMax)- 1) * (voltReal-model.voltMax)
+        excess['constraint_pf_volt_limit_eq3'] = voltImag - \
+            (-1 * math.sin(model.thetaMin)) / (math.cos(model.thetaMin)- 1) * (voltReal-model.voltMax)
+        excess['constraint_pf_volt_limit_eq4'] = voltImag - voltReal * math.tan(model.thetaMax)
+        excess['constraint_pf_volt_limit_eq5'] = voltReal * math.tan(model.thetaMin) - voltImag
+    else:
+        excess['constraint_ppf_volt_simple_limit_eq1'] = model.voltMin - voltReal
+        excess['constraint_ppf_volt_simple_limit_eq2'] = voltReal - model.voltMax
+    
+    sets = {2: [ts, nodes], 3: [ts, nodes, nodes]}
+    if model.curSqModel == 1:
+        segments = list(model.curEdges)
+        sets[4] = [ts, nodes, nodes, segments]
+        capacity = _component_array(model.line_capacity, nodes, nodes)
+        # segment vars are indexed (ts, segment, nodes, nodesN), constraints (ts, nodes, nodesN, segment)
+        for part in ['real', 'imag']:
+            segment = _component_array(getattr(model, f'{part}_branch_cur_seg'), ts, segments, nodes, nodes)
+            excess[f'constraint_cur_seg_cap_limit_{part}'] = \
+                np.moveaxis(segment, 1, 3) - (capacity / model.nEdges)[None, :, :, None]
+        excess['constraint_total_current_cap_eqn'] = \
+            _component_array(model.real_branch_cur_square, ts, nodes, nodes) + \
+            _component_array(model.imag_branch_cur_square, ts, nodes, nodes) - capacity[None, :, :] ** 2
+    
+    violations = {}
+    for name, values in excess.items():
+        if name not in model.lazyNetworkRules:
+            continue
+        rows = np.argwhere(values > tol)
+        if len(rows):
+            indexSets = sets[values.ndim]
+            violations[name] = [tuple(indexSets[ii][r] for ii, r in enumerate(row)) for row in rows]
+    return violations
+
+def add_violated_network_limits(model, tol=1e-6):
+    '''
+    adds the rows of lazy voltage and current limits which are violated by
+    the current solution of the model
+
+    Parameters
+    ----------
+    model : pyomo model
+        solved DOPER pyomo model with powerflow equations.
+    tol : float, optional
+        tolerance of violation. The default is 1e-6.
+
+    Returns
+    -------
+    added : int
+        number of added constraint rows.
+
+    '''
+    
+    if not getattr(model, 'lazyNetworkConstraints', False):
+        return 0
+    
+    added = 0
+    for name, indices in network_limit_violations(model, tol).items():
+        component = getattr(model, name)
+        rule = model.lazyNetworkRules[name]
+        for index in indices:
+            if index not in component:
+                component.add(index, rule(model, *index))
+                added += 1
+    if added:
+        logging.info(f'added {added} violated network limits')
+    return added
+
 def add_network_powerflow(model, inputs, parameter):
     '''
     this function adds full powerflow model to existing pyomo model
@@ -162,6 +302,11 @@ def add_network_powerflow(model, inputs, parameter):
     
     # logging.info(f'constrain voltage angle: {model.enableVoltageAngleConstraint}')
     
+    # generate voltage and current limits only where violated. default is False
+    model.lazyNetworkConstraints = pfSettings.get('lazyNetworkConstraints', False)
+    model.lazyMaxIterations = pfSettings.get('lazyMaxIterations', 20)
+    model.lazyNetworkRules = {}
+    
     # define number of segments for current-square linear approx
     if model.curSqModel == 1:
         model.nEdges = 3 # method 1
@@ -351,13 +496,17 @@ def add_network_powerflow(model, inputs, parameter):
     # equations
     
     # PCC import/export constraints   
+    model.pcc_import_bigM = Param(model.ts, initialize=pcc_bound(model, parameter['site']['import_max'], model.dynamic_import_max), \
+                                  doc='pcc import big-M [kW]')
+    model.pcc_export_bigM = Param(model.ts, initialize=pcc_bound(model, parameter['site']['export_max'], model.dynamic_export_max), \
+                                  doc='pcc export big-M [kW]')
     def pcc_import(model, ts, nodes):
-        return model.grid_import[ts, nodes] <= model.node_pcc[nodes] * parameter['site']['import_max']
+        return model.grid_import[ts, nodes] <= model.node_pcc[nodes] * model.pcc_import_bigM[ts]
     model.constraint_pcc_import = Constraint(model.ts, model.nodes, rule=pcc_import, \
                                                   doc='constraint pcc import')
                                                   
     def pcc_export(model, ts, nodes):
-        return model.grid_export[ts, nodes] <= model.node_pcc[nodes] * parameter['site']['export_max']
+        return model.grid_export[ts, nodes] <= model.node_pcc[nodes] * model.pcc_export_bigM[ts]
     model.constraint_pcc_export = Constraint(model.ts, model.nodes, rule=pcc_export, \
                                                   doc='constraint pcc export')
         
@@ -599,20 +748,20 @@ def add_network_powerflow(model, inputs, parameter):
         model.voltage_real[ts, model.slackBusName].fix(model.slackBusVoltage)
         model.voltage_imag[ts, model.slackBusName].fix(0)
     
-    def pf_real_eq1(model, ts, nodes, nodesN):
+    def pf_real_eq1(model, ts, nodes):
                 return  model.voltage_real[ts, nodes] == model.slackBusVoltage + (1/model.slackBusVoltage) * \
                    ( sum(model.realZBus[nodes, n]*(model.real_power_inj[ts, n] - model.real_power_abs[ts, n]) for n in model.nodesNoSlack) + \
                      sum(model.imagZBus[nodes, n]*(model.imag_power_inj[ts, n] - model.imag_power_abs[ts, n]) for n in model.nodesNoSlack) )
             
-    model.constraint_pf_real_eq1 = Constraint(model.ts, model.nodesNoSlack, model.nodesNoSlack, rule=pf_real_eq1, \
+    model.constraint_pf_real_eq1 = Constraint(model.ts, model.nodesNoSlack, rule=pf_real_eq1, \
                                                                   doc='real voltage constriant') 
         
-    def pf_imag_eq1(model, ts, nodes, nodesN):
-                return  model.voltage_imag[ts, nodes] == model.slackBusVoltage + (1/model.slackBusVoltage) * \
+    def pf_imag_eq1(model, ts, nodes):
+                return  model.voltage_imag[ts, nodes] == (1/model.slackBusVoltage) * \
                    ( sum(model.imagZBus[nodes, n]*(model.real_power_inj[ts, n] - model.real_power_abs[ts, n]) for n in model.nodesNoSlack) - \
                      sum(model.realZBus[nodes, n]*(model.imag_power_inj[ts, n] - model.imag_power_abs[ts, n]) for n in model.nodesNoSlack) )
             
-    model.constraint_pf_imag_eq1 = Constraint(model.ts, model.nodesNoSlack, model.nodesNoSlack, rule=pf_real_eq1, \
+    model.constraint_pf_imag_eq1 = Constraint(model.ts, model.nodesNoSlack, rule=pf_imag_eq1, \
                                                                   doc='imag voltage constriant') 
         
 
@@ -628,26 +777,26 @@ def add_network_powerflow(model, inputs, parameter):
         
     def pf_imag_branch_loss_eq(model, ts, nodes, nodesN):
                 return  model.imag_branch_loss[ts, nodes, nodesN] == model.enableLosses * \
-                    model.node_connection_UT[nodes, nodesN] * model.branch_imag_imp[nodes, nodesN] * \
+                    model.node_connection_UT[nodes, nodesN] * model.branch_img_imp[nodes, nodesN] * \
                     (model.real_branch_cur_square[ts, nodes, nodesN] + model.imag_branch_cur_square[ts, nodes, nodesN])
             
-    model.constraint_pf_imag_branch_loss_eq = Constraint(model.ts, model.nodes, model.nodesN, rule=pf_real_branch_loss_eq, \
+    model.constraint_pf_imag_branch_loss_eq = Constraint(model.ts, model.nodes, model.nodesN, rule=pf_imag_branch_loss_eq, \
                                                                   doc='imag losses constriant') 
         
-    def pf_real_eq2(model, ts, nodes):
+    def pf_real_eq2(model, ts):
                 return  sum(model.real_power_inj[ts, n] for n in model.nodes) == \
                     sum(model.real_power_abs[ts, n] for n in model.nodes) + \
                     sum(model.real_branch_loss[ts, n1, n2] for n1 in model.nodes for n2 in model.nodes)
             
-    model.constraint_pf_real_eq2 = Constraint(model.ts, model.nodes, rule=pf_real_eq2, \
+    model.constraint_pf_real_eq2 = Constraint(model.ts, rule=pf_real_eq2, \
                                                                   doc='powerflow real power constriant') 
         
-    def pf_imag_eq2(model, ts, nodes):
+    def pf_imag_eq2(model, ts):
                 return  sum(model.imag_power_inj[ts, n] for n in model.nodes) == \
                     sum(model.imag_power_abs[ts, n] for n in model.nodes) + \
                     sum(model.imag_branch_loss[ts, n1, n2] for n1 in model.nodes for n2 in model.nodes)
             
-    model.constraint_pf_imag_eq2 = Constraint(model.ts, model.nodes, rule=pf_imag_eq2, \
+    model.constraint_pf_imag_eq2 = Constraint(model.ts, rule=pf_imag_eq2, \
                                                                   doc='powerflow imag power constriant') 
     
     
@@ -694,7 +843,7 @@ def add_network_powerflow(model, inputs, parameter):
                 (model.voltage_real[ts, nodes]-model.voltMin*math.cos(model.thetaMin)) \
                 + model.voltMin*math.sin(model.thetaMin)
                 
-        model.constraint_pf_volt_limit_eq1= Constraint(model.ts, model.nodes,rule=pf_volt_limit_eq1, \
+        model.constraint_pf_volt_limit_eq1= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_pf_volt_limit_eq1', pf_volt_limit_eq1), \
                                                                       doc='bus voltage limit constriant 1')
             
         def pf_volt_limit_eq2(model, ts, nodes):
@@ -703,7 +852,7 @@ def add_network_powerflow(model, inputs, parameter):
                 (math.cos(model.thetaMax)- 1) * \
                 (model.voltage_real[ts, nodes]-model.voltMax)
                 
-        model.constraint_pf_volt_limit_eq2= Constraint(model.ts, model.nodes,rule=pf_volt_limit_eq2, \
+        model.constraint_pf_volt_limit_eq2= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_pf_volt_limit_eq2', pf_volt_limit_eq2), \
                                                                       doc='bus voltage limit constriant 2')
             
         def pf_volt_limit_eq3(model, ts, nodes):
@@ -712,21 +861,21 @@ def add_network_powerflow(model, inputs, parameter):
                 (math.cos(model.thetaMin)- 1) * \
                 (model.voltage_real[ts, nodes]-model.voltMax)
                 
-        model.constraint_pf_volt_limit_eq3= Constraint(model.ts, model.nodes,rule=pf_volt_limit_eq3, \
+        model.constraint_pf_volt_limit_eq3= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_pf_volt_limit_eq3', pf_volt_limit_eq3), \
                                                                       doc='bus voltage limit constriant 3')
             
         def pf_volt_limit_eq4(model, ts, nodes):
             return model.voltage_imag[ts, nodes] <= \
                 model.voltage_real[ts, nodes] * math.tan(model.thetaMax)
                 
-        model.constraint_pf_volt_limit_eq4= Constraint(model.ts, model.nodes,rule=pf_volt_limit_eq4, \
+        model.constraint_pf_volt_limit_eq4= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_pf_volt_limit_eq4', pf_volt_limit_eq4), \
                                                                       doc='bus voltage limit constriant 4')
             
         def pf_volt_limit_eq5(model, ts, nodes):
             return model.voltage_imag[ts, nodes] >= \
                 model.voltage_real[ts, nodes] * math.tan(model.thetaMin)
                 
-        model.constraint_pf_volt_limit_eq5= Constraint(model.ts, model.nodes,rule=pf_volt_limit_eq5, \
+        model.constraint_pf_volt_limit_eq5= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_pf_volt_limit_eq5', pf_volt_limit_eq5), \
                                                                       doc='bus voltage limit constriant 5')
             
     else:
@@ -736,13 +885,13 @@ def add_network_powerflow(model, inputs, parameter):
         def pf_volt_simple_limit_eq1(model, ts, nodes):
             return  model.voltage_real[ts, nodes] >= model.voltMin
                 
-        model.constraint_ppf_volt_simple_limit_eq1= Constraint(model.ts, model.nodes,rule=pf_volt_simple_limit_eq1, \
+        model.constraint_ppf_volt_simple_limit_eq1= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_ppf_volt_simple_limit_eq1', pf_volt_simple_limit_eq1), \
                                                                       doc='simple bus voltage limit constriant 1')
             
         def pf_volt_simple_limit_eq2(model, ts, nodes):
             return  model.voltage_real[ts, nodes] <= model.voltMax
                 
-        model.constraint_ppf_volt_simple_limit_eq2= Constraint(model.ts, model.nodes,rule=pf_volt_simple_limit_eq2, \
+        model.constraint_ppf_volt_simple_limit_eq2= Constraint(model.ts, model.nodes,rule=lazy_rule(model, 'constraint_ppf_volt_simple_limit_eq2', pf_volt_simple_limit_eq2), \
                                                                       doc='simple bus voltage limit constriant 2')
         
         
@@ -806,12 +955,12 @@ def add_network_powerflow(model, inputs, parameter):
         def cur_seg_cap_limit_real(model, ts, nodes, nodesN, segment):
             return model.real_branch_cur_seg[ts, segment, nodes, nodesN] <= \
                 model.line_capacity[nodes, nodesN] / model.nEdges
-        model.constraint_cur_seg_cap_limit_real= Constraint(model.ts, model.nodes, model.nodes, model.curEdges, rule=cur_seg_cap_limit_real, \
+        model.constraint_cur_seg_cap_limit_real= Constraint(model.ts, model.nodes, model.nodes, model.curEdges, rule=lazy_rule(model, 'constraint_cur_seg_cap_limit_real', cur_seg_cap_limit_real), \
                                                                       doc='real current segments cap limits')
         def cur_seg_cap_limit_imag(model, ts, nodes, nodesN, segment):
             return model.imag_branch_cur_seg[ts, segment, nodes, nodesN] <= \
                 model.line_capacity[nodes, nodesN] / model.nEdges
-        model.constraint_cur_seg_cap_limit_imag= Constraint(model.ts, model.nodes, model.nodes, model.curEdges, rule=cur_seg_cap_limit_imag, \
+        model.constraint_cur_seg_cap_limit_imag= Constraint(model.ts, model.nodes, model.nodes, model.curEdges, rule=lazy_rule(model, 'constraint_cur_seg_cap_limit_imag', cur_seg_cap_limit_imag), \
                                                                       doc='imag current segments cap limits')
             
         # current squared linear approximation              
@@ -836,7 +985,7 @@ def add_network_powerflow(model, inputs, parameter):
         def total_current_cap_eqn(model, ts, nodes, nodesN):
             return model.real_branch_cur_square[ts, nodes, nodesN] + model.imag_branch_cur_square[ts, nodes, nodesN] <= \
                 model.line_capacity[nodes, nodesN] ** 2
-        model.constraint_total_current_cap_eqn= Constraint(model.ts, model.nodes, model.nodes,  rule=total_current_cap_eqn, \
+        model.constraint_total_current_cap_eqn= Constraint(model.ts, model.nodes, model.nodes,  rule=lazy_rule(model, 'constraint_total_current_cap_eqn', total_current_cap_eqn), \
                                                                       doc='total apparent current capacity constraint')            
                         
                         
@@ -1111,31 +1260,35 @@ def add_network_simple(model, inputs, parameter):
     # equations
     
     # PCC import/export constraints   
+    model.pcc_import_bigM = Param(model.ts, initialize=pcc_bound(model, parameter['site']['import_max'], model.dynamic_import_max), \
+                                  doc='pcc import big-M [kW]')
+    model.pcc_export_bigM = Param(model.ts, initialize=pcc_bound(model, parameter['site']['export_max'], model.dynamic_export_max), \
+                                  doc='pcc export big-M [kW]')
     def pcc_import(model, ts, nodes):
-        return model.grid_import[ts, nodes] <= model.node_pcc[nodes] * parameter['site']['import_max']
+        return model.grid_import[ts, nodes] <= model.node_pcc[nodes] * model.pcc_import_bigM[ts]
     model.constraint_pcc_import = Constraint(model.ts, model.nodes, rule=pcc_import, \
                                                   doc='constraint pcc import')
                                                   
     def pcc_export(model, ts, nodes):
-        return model.grid_export[ts, nodes] <= model.node_pcc[nodes] * parameter['site']['export_max']
+        return model.grid_export[ts, nodes] <= model.node_pcc[nodes] * model.pcc_export_bigM[ts]
     model.constraint_pcc_export = Constraint(model.ts, model.nodes, rule=pcc_export, \
                                                   doc='constraint pcc export')
         
     # sum power exchanges in/out of node
-    def node_power_in(model, ts, nodes, nodesN):
+    def node_power_in(model, ts, nodes):
         return model.powerExchangeIn[ts, nodes] == sum(model.powerExchangeLineIn[ts, nodes, nodesN] for nodesN in model.nodes)
-    model.contraints_node_power_in = Constraint(model.ts, model.nodes, model.nodesN, rule=node_power_in, \
+    model.contraints_node_power_in = Constraint(model.ts, model.nodes, rule=node_power_in, \
                                                 doc = 'constraint sum power flow into node')
         
-    def node_power_out(model, ts, nodes, nodesN):
+    def node_power_out(model, ts, nodes):
         return model.powerExchangeOut[ts, nodes] == sum(model.powerExchangeLineOut[ts, nodes, nodesN] for nodesN in model.nodes)
-    model.contraints_node_power_out = Constraint(model.ts, model.nodes, model.nodesN, rule=node_power_out, \
+    model.contraints_node_power_out = Constraint(model.ts, model.nodes, rule=node_power_out, \
                                                 doc = 'constraint sum power flow out of node')
     
         
-    def node_power_loss(model, ts, nodes, nodesN):
+    def node_power_loss(model, ts, nodes):
         return model.powerExchangeLosses[ts, nodes] == sum(model.powerExchangeLineLosses[ts, nodes, nodesN] for nodesN in model.nodes)
-    model.contraints_node_power_loss = Constraint(model.ts, model.nodes, model.nodesN, rule=node_power_loss, \
+    model.contraints_node_power_loss = Constraint(model.ts, model.nodes, rule=node_power_loss, \
                                                 doc = 'constraint sum power flow lost at node from power exchange')
     
     # power into line, must equal power out minus losses
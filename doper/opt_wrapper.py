@@ -8,7 +8,6 @@ Controller wrapper module.
 """
 
 import os
-import io
 import time
 import json
 import traceback
@@ -18,6 +17,8 @@ from fmlc import eFMU
 
 from .computetariff import compute_periods
 from .data.tariff import get_tariff
+from .data.transport import encode_frame, decode_frame
+from .data.runlog import RunLog
 from .utility import (update_nested_dict, resolve_wrapper_callable, build_objectives_dict,
                       init_expected_states, log_state_comparison,
                       apply_state_thresholds, update_expected_states_from_result)
@@ -34,6 +35,8 @@ class DoperWrapper(eFMU):
             "config": None,
             "timeout": None,
             "debug": None,
+            "output-format": None, # 'json' (default), 'columnar' or 'feather'
+            "output-columns": None, # list of output-data columns, all if None
         }
         self.output = {
             "output-data": None,
@@ -50,20 +53,32 @@ class DoperWrapper(eFMU):
         self.parameter = None
         self.res = None
         self.smart_der = None
+        self.run_log = None
         self.sp_processor = None
         self.fb_processor = None
         self.expected_states = None
         self.state_log = pd.DataFrame()
 
     def _to_forecast_df(self, fc):
-        """Convert forecast JSON into dataframe."""
-        df = pd.read_json(io.StringIO(fc))
+        """Convert forecast (JSON or binary columnar) into dataframe."""
+        df = decode_frame(fc)
         df.index = pd.to_datetime(df.index)
         df = df.sort_index()
         return df
 
-    def log_results(self):
-        """Function to log opt inputs."""
+    def log_results(self, results=None, parameter=None):
+        """Function to log opt inputs, and the results if given (see doper.replay)."""
+        if self.parameter['controller'].get('log_format') == 'runlog':
+            # batched in the background, see doper.data.runlog
+            if self.run_log is None or self.run_log.path != self.parameter['controller']['log_dir']:
+                if self.run_log is not None:
+                    self.run_log.close()
+                self.run_log = RunLog(self.parameter['controller']['log_dir'])
+            self.run_log.append(self.parameter['controller']['instance_id'],
+                                self.parameter if parameter is None else parameter,
+                                self.data, results)
+            return
+
         # make dir
         log_dir = os.path.join(self.parameter['controller']['log_dir'],
                                str(self.parameter['controller']['instance_id']))
@@ -72,8 +87,14 @@ class DoperWrapper(eFMU):
         # log
         fname = str(self.data.index[0]).replace(' ', '').replace(':', '')
         with open(os.path.join(log_dir, fname+'.txt'), 'w', encoding='utf8') as f:
-            json.dump(self.parameter, f)
+            if parameter is None:
+                json.dump(self.parameter, f)
+            else:
+                f.write(parameter)
         self.data.to_csv(os.path.join(log_dir, fname+'.csv'))
+        if results is not None:
+            with open(os.path.join(log_dir, fname+'_result.json'), 'w', encoding='utf8') as f:
+                json.dump(results, f)
 
     def compute(self):
         """Main compute."""
@@ -89,6 +110,8 @@ class DoperWrapper(eFMU):
         model = None
         setpoints = {}
         ext_logs = {}
+        process_outputs = True
+        parameter_log = None
 
         msg += self.check_data(self.input["input-data"], True)
 
@@ -130,7 +153,9 @@ class DoperWrapper(eFMU):
                     self.init = False
 
                 # parse state_inputs before applying (needed for comparison logging)
-                state_inputs = json.loads(self.input["state-inputs"])
+                state_inputs = self.input["state-inputs"]
+                if isinstance(state_inputs, str):
+                    state_inputs = json.loads(state_inputs)
 
                 # update states from state_inputs
                 update_nested_dict(self.parameter, state_inputs)
@@ -158,14 +183,20 @@ class DoperWrapper(eFMU):
                 )
 
                 if not msg:
+                    # parameter as solved, the expected states are merged in after the solve
+                    parameter_log = json.dumps(self.parameter)
+
                     # run doper
                     printing = self.parameter['controller']['printing']
                     solver_options = self.parameter['controller']['solver_options']
+                    process_outputs = 'first_step' \
+                        if self.parameter['controller'].get('first_step_results') else True
                     self.res = self.smart_der.do_optimization(self.data,
                                                               parameter=self.parameter,
                                                               options=solver_options,
                                                               tee=printing,
-                                                              print_error=printing)
+                                                              print_error=printing,
+                                                              process_outputs=process_outputs)
                     duration, objective, df, model, result, termination, parameter = self.res
                     objectives = build_objectives_dict(model, self.parameter, objective)
 
@@ -180,19 +211,26 @@ class DoperWrapper(eFMU):
 
                 # store outputs
                 if isinstance(df, pd.DataFrame):
-                    data = pd.concat([df, data], axis=1)
+                    # first-step results are not merged with the inputs
+                    if process_outputs is True:
+                        data = pd.concat([df, data], axis=1)
+                    else:
+                        data = df
 
                     # process setpoints
                     if self.sp_processor:
                         setpoints, log = self.sp_processor(data, self.parameter)
                         ext_logs[self.sp_processor.__module__] = log
 
-                    data = data.to_json()
+                    data = encode_frame(data, self.input.get("output-format") or 'json',
+                                        self.input.get("output-columns"))
 
                 # Store if error or timeout
                 opt_timeout = duration > self.parameter['controller']['log_overtime']
-                if (not objective) or opt_timeout:
-                    self.log_results()
+                if (not objective) or opt_timeout or self.parameter['controller'].get('log_all'):
+                    self.log_results({'objective': objective, 'termination': str(termination),
+                                      'duration': duration, 'setpoints': setpoints},
+                                     parameter=parameter_log)
 
         except Exception as e:
             msg += str(e)
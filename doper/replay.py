@@ -0,0 +1,324 @@
+# Distributed Optimal and Predictive Energy Resources (DOPER) Copyright (c) 2019
+# The Regents of the University of California, through Lawrence Berkeley
+# National Laboratory (subject to receipt of any required approvals
+# from the U.S. Dept. of Energy). All rights reserved.
+
+"""Distributed Optimal and Predictive Energy Resources
+Replay module.
+
+Re-runs logged optimizations and compares them against the recorded results,
+to validate DOPER upgrades on production cases. A case is a parameter file
+(`.txt` written by DoperWrapper.log_results or `.json` written by
+DOPER.dump_model) with the inputs of the same name (`.csv`) and, if recorded,
+the results (`_result.json`: objective, termination, duration, setpoints).
+Run logs (see doper.data.runlog) are read as well, with one scan for the
+requested time range. All cases are replayed in parallel processes:
+
+    python -m doper.replay ./logs --workers 8 --report report.csv
+    python -m doper.replay ./logs --start 2024-01-01 --end 2024-01-07
+
+The exit code is 1 if any case regressed. Timings are compared as well, run
+with --workers 1 when they matter, parallel solves slow each other down.
+"""
+
+import os
+import sys
+import copy
+import json
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .data.runlog import RunLog
+
+RESULT_SUFFIX = '_result.json'
+PARAMETER_EXTENSIONS = ['.txt', '.json']
+
+# default tolerances of the comparison
+OBJECTIVE_RTOL = 1e-3 # relative to the recorded objective (at least 1)
+SETPOINT_ATOL = 0.1 # kW
+DURATION_THRESHOLD = 1.25 # slower than threshold times the recorded duration
+
+def find_cases(log_dir, start=None, end=None):
+    '''
+        Finds all logged cases below a directory.
+
+        Input
+        -----
+            log_dir (str): The log directory, e.g. the controller log_dir.
+            start, end (str): Time range of run log cases, see RunLog.read. (default=None)
+
+        Returns
+        -------
+            cases (list): Dicts with name, parameter_path, data_path and result_path
+                (None if no results were recorded), sorted by name. Run log cases
+                hold the parameter, data and recorded results instead of paths.
+    '''
+    cases = []
+    run_log = RunLog(log_dir)
+    runs, inputs = run_log.read(start, end)
+    parameters = {}
+    for run, row in runs.iterrows():
+        if row['parameter_hash'] not in parameters:
+            parameters[row['parameter_hash']] = run_log.parameter(row['parameter_hash'])
+        cases.append({
+            'name': run,
+            'parameter': parameters[row['parameter_hash']],
+            'data': inputs[run],
+            'recorded': json.loads(row['results']) or None,
+        })
+    for root, _, files in os.walk(log_dir):
+        for f in files:
+            stem, ext = os.path.splitext(f)
+            if ext != '.csv':
+                continue
+            parameter_path = None
+            for parameter_ext in PARAMETER_EXTENSIONS:
+                if stem + parameter_ext in files:
+                    parameter_path = os.path.join(root, stem + parameter_ext)
+                    break
+            if not parameter_path:
+                continue
+            result_path = os.path.join(root, stem + RESULT_SUFFIX)
+            cases.append({
+                'name': os.path.relpath(os.path.join(root, stem), log_dir),
+                'parameter_path': parameter_path,
+                'data_path': os.path.join(root, f),
+                'result_path': result_path if os.path.exists(result_path) else None,
+            })
+    return sorted(cases, key=lambda c: c['name'])
+
+def load_case(case):
+    '''
+        Loads a logged case, as DOPER.load_model.
+
+        Returns
+        -------
+            parameter (dict): Configuration dictionary for the optimization.
+            data (pandas.DataFrame): The input dataframe for the optimization.
+            recorded (dict): The recorded results, None if not recorded.
+    '''
+    if 'data' in case:
+        # read from a run log
+        return copy.deepcopy(case['parameter']), case['data'], case['recorded']
+    with open(case['parameter_path'], 'r', encoding='utf-8') as f:
+        parameter = json.loads(f.read())
+    data = pd.read_csv(case['data_path'], index_col=0, float_precision='round_trip')
+    data.index = pd.to_datetime(data.index)
+    return parameter, data, load_recorded(case)
+
+def load_recorded(case):
+    '''
+        Loads only the recorded results of a logged case.
+
+        Returns
+        -------
+            recorded (dict): The recorded results, None if not recorded.
+    '''
+    if 'data' in case:
+        return case['recorded']
+    if not case.get('result_path'):
+        return None
+    with open(case['result_path'], 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+def replay_case(case, solver_dir=None, solver_options=None, network=False):
+    '''
+        Re-runs one case as DoperWrapper does: optimization with the logged
+        controller settings, then the setpoint processor. Run in a worker process.
+
+        Input
+        -----
+            case (dict): The case, see find_cases.
+            solver_dir (str): Solver directory, the logged one if it exists, else the
+                DOPER solvers. (default=None)
+            solver_options (dict): Solver options, the logged ones if None. (default=None)
+            network (bool): Add the network equations to the model. (default=False)
+
+        Returns
+        -------
+            results (dict): objective, termination, duration and setpoints, or error.
+    '''
+    from .wrapper import make_doper
+    from .utility import resolve_wrapper_callable
+    try:
+        parameter, data, _ = load_case(case)
+        controller = parameter['controller']
+        if solver_dir or not os.path.isdir(str(controller.get('solver_path'))):
+            controller['solver_path'] = solver_dir
+        smart = make_doper(parameter)
+        if network:
+            from .models.network import add_network
+            control_model = smart._model
+            smart._model = lambda inputs, parameter: add_network(control_model(inputs, parameter),
+                                                                  inputs, parameter)
+        process_outputs = 'first_step' if controller.get('first_step_results') else True
+        res = smart.do_optimization(data, parameter=smart.parameter,
+                                    options=controller.get('solver_options', {}) \
+                                        if solver_options is None else solver_options,
+                                    print_error=False, process_outputs=process_outputs)
+        duration, objective, df, _, _, termination, _ = res
+
+        setpoints = {}
+        sp_processor = resolve_wrapper_callable(controller.get('sp_processor'),
+                                                spec_name='sp_processor')
+        if sp_processor and isinstance(df, pd.DataFrame) and not df.empty:
+            if process_outputs is True:
+                df = pd.concat([df, data], axis=1)
+            setpoints, _ = sp_processor(df, smart.parameter)
+        return {'objective': objective, 'termination': str(termination), 'duration': duration,
+                'setpoints': {k: float(v) for k, v in setpoints.items()}}
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+
+def compare_case(recorded, replayed, objective_rtol=OBJECTIVE_RTOL,
+                 setpoint_atol=SETPOINT_ATOL, duration_threshold=DURATION_THRESHOLD):
+    '''
+        Compares a replayed case against the recorded results.
+
+        Returns
+        -------
+            row (dict): Recorded and replayed values, differences and the list
+                of regressions ('error', 'termination', 'objective', 'setpoints', 'slower').
+    '''
+    recorded = recorded or {}
+    row = {
+        'termination_recorded': recorded.get('termination'),
+        'termination': replayed.get('termination'),
+        'objective_recorded': recorded.get('objective'),
+        'objective': replayed.get('objective'),
+        'objective_diff': np.nan,
+        'setpoint_max_diff': np.nan,
+        'duration_recorded': recorded.get('duration'),
+        'duration': replayed.get('duration'),
+        'duration_ratio': np.nan,
+        'error': replayed.get('error'),
+    }
+    regressions = []
+    if row['error']:
+        regressions.append('error')
+    if recorded and not row['error']:
+        if row['termination'] != row['termination_recorded']:
+            regressions.append('termination')
+        old, new = row['objective_recorded'], row['objective']
+        if old is not None and new is not None:
+            row['objective_diff'] = (new - old) / max(1, abs(old))
+            if abs(row['objective_diff']) > objective_rtol:
+                regressions.append('objective')
+        elif (old is None) != (new is None):
+            regressions.append('objective')
+        old, new = recorded.get('setpoints') or {}, replayed.get('setpoints') or {}
+        if old or new:
+            diffs = [abs(new[k] - old[k]) if k in old and k in new else np.inf
+                     for k in set(old) | set(new)]
+            row['setpoint_max_diff'] = max(diffs)
+            if row['setpoint_max_diff'] > setpoint_atol:
+                regressions.append('setpoints')
+        if row['duration_recorded'] and row['duration'] is not None:
+            row['duration_ratio'] = row['duration'] / row['duration_recorded']
+            # ignore changes below 0.1 s
+            if row['duration_ratio'] > duration_threshold \
+                    and row['duration'] - row['duration_recorded'] > 0.1:
+                regressions.append('slower')
+    row['regressions'] = ','.join(regressions)
+    return row
+
+def replay_logs(log_dir, workers=None, start=None, end=None, solver_dir=None,
+                solver_options=None, network=False, objective_rtol=OBJECTIVE_RTOL, setpoint_atol=SETPOINT_ATOL,
+                duration_threshold=DURATION_THRESHOLD):
+    '''
+        Replays all cases of a log directory in parallel and compares them
+        against the recorded results.
+
+        Input
+        -----
+            log_dir (str): The log directory.
+            workers (int): Number of worker processes, all cores if None. (default=None)
+            start, end (str): Time range of run log cases, see RunLog.read. (default=None)
+            solver_dir, solver_options, network: See replay_case.
+            objective_rtol (float): Tolerance of the objective, relative to the recorded
+                objective (at least 1). (default=OBJECTIVE_RTOL)
+            setpoint_atol (float): Tolerance of the setpoints. (default=SETPOINT_ATOL)
+            duration_threshold (float): Report cases slower than threshold times the
+                recorded duration. (default=DURATION_THRESHOLD)
+
+        Returns
+        -------
+            report (pandas.DataFrame): One row per case, indexed by case name.
+    '''
+    cases = find_cases(log_dir, start, end)
+    if not cases:
+        return pd.DataFrame()
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = [pool.submit(replay_case, case, solver_dir, solver_options, network)
+                   for case in cases]
+        rows = []
+        for case, future in zip(cases, futures):
+            row = {'case': case['name']}
+            try:
+                replayed = future.result()
+            except Exception as e:
+                # worker died
+                replayed = {'error': f'{type(e).__name__}: {e}'}
+            recorded = load_recorded(case)
+            row.update(compare_case(recorded, replayed, objective_rtol, setpoint_atol,
+                                    duration_threshold))
+            row['recorded'] = recorded is not None
+            rows.append(row)
+    return pd.DataFrame(rows).set_index('case')
+
+def summarize(report):
+    """Text summary of a replay report."""
+    if report.empty:
+        return 'No cases found.'
+    lines = [f'{len(report)} cases replayed, {int(report["recorded"].sum())} with recorded results.']
+    regressed = report[report['regressions'] != '']
+    for kind in ['error', 'termination', 'objective', 'setpoints', 'slower']:
+        n = regressed['regressions'].str.split(',').apply(lambda r, k=kind: k in r).sum()
+        if n:
+            lines.append(f'  {kind}: {n}')
+    ratio = report['duration_ratio'].dropna()
+    if not ratio.empty:
+        lines.append(f'Duration ratio (replayed/recorded): median {ratio.median():.2f}, '
+                     f'max {ratio.max():.2f}.')
+    if regressed.empty:
+        lines.append('No regressions.')
+    else:
+        lines.append(f'{len(regressed)} cases regressed:')
+        for name, row in regressed.iterrows():
+            lines.append(f'  {name}: {row["regressions"]}'
+                         + (f' ({row["error"]})' if row['error'] else ''))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay logged DOPER optimizations.')
+    parser.add_argument('log_dir', help='log directory, searched recursively')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes')
+    parser.add_argument('--start', default=None, help='start of the run log time range')
+    parser.add_argument('--end', default=None, help='end of the run log time range')
+    parser.add_argument('--report', default=None, help='write the report to this CSV file')
+    parser.add_argument('--solver-dir', default=None, help='solver directory')
+    parser.add_argument('--solver-options', default=None, help='solver options as JSON')
+    parser.add_argument('--network', action='store_true', help='add the network equations')
+    parser.add_argument('--objective-rtol', type=float, default=OBJECTIVE_RTOL)
+    parser.add_argument('--setpoint-atol', type=float, default=SETPOINT_ATOL)
+    parser.add_argument('--duration-threshold', type=float, default=DURATION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = replay_logs(args.log_dir, workers=args.workers, start=args.start, end=args.end,
+                         solver_dir=args.solver_dir,
+                         solver_options=json.loads(args.solver_options) \
+                             if args.solver_options else None,
+                         network=args.network, objective_rtol=args.objective_rtol,
+                         setpoint_atol=args.setpoint_atol,
+                         duration_threshold=args.duration_threshold)
+    if args.report and not report.empty:
+        report.to_csv(args.report)
+    print(summarize(report))
+    return 1 if not report.empty and (report['regressions'] != '').any() else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,6 +26,8 @@ from .examples.example import (default_parameter,
                                parameter_add_genset,
                                parameter_add_battery,
                                parameter_add_loadcontrol)
+from .models.aggregation import unit_scale
+from .models.evfleet import least_laxity_first
 
 # Canonical objective term registry: (weight_key, model_var_name, sign)
 # sign=+1 cost, sign=-1 revenue. Add new objectives here only.
@@ -74,7 +76,8 @@ def fix_bug_pyomo():
             except Exception as e:
                 print(f'WARNING: pyomo solver bug was not fixed by doper due to: {e}')
         elif '[solver_exec, "-v", "exit"]' in pyomo_asl:
-            pass
+            # already fixed, no reload needed
+            return
         else:
             raise ValueError('The snippet [solver_exec, "-v"] does not exist' + \
                 f' in Pyomo ASL.py at {path_pyomo_asl}.')
@@ -127,25 +130,52 @@ def pandas_to_dict(df, columns=None, convertTs=False):
     """
     d = {}
 
+    index = df.index
     if convertTs:
         # convert timestamp index to unix time
-        df.index = df.index.view(np.int64)/1e9
+        index = index.view(np.int64)/1e9
 
     if isinstance(df, pd.DataFrame):
-        df = df.copy(deep=True)
-        if columns:
-            df.columns = columns
-        for c in df.columns:
-            for k,v in df[c].items():
-                d[k, c] = int(v) if v % 1 == 0 else float(v)
+        labels = columns if columns else df.columns
+        for c, label in zip(df.columns, labels):
+            for k,v in zip(index, df[c].to_numpy()):
+                d[k, label] = int(v) if v % 1 == 0 else float(v)
     elif isinstance(df, pd.Series):
-        for k,v in df.items():
+        for k,v in zip(index, df.to_numpy()):
             d[k] = int(v) if v % 1 == 0 else float(v)
     else:
         print('The data must be a pd.DataFrame (for multiindex) or pd.Series (single index).')
     return d
 
 
+def freeze_inputs(data):
+    """Consolidate the optimization inputs into a single read-only buffer.
+
+    Numeric columns are stored as one column-major float64 array which is
+    marked as read-only, so the model builders can share it without
+    defensive copies. Other columns (e.g. ``date_time``) are kept as they are.
+    Adding columns to the returned frame does not modify ``data``.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Input data of the optimization.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Frame with the same index and columns backed by the frozen buffer.
+    """
+    numeric = [c for c in data.columns if pd.api.types.is_numeric_dtype(data[c])]
+    values = np.asfortranarray(data[numeric].to_numpy(dtype=float))
+    values.flags.writeable = False
+    frozen = pd.DataFrame(values, index=data.index, columns=numeric, copy=False)
+    for i, c in enumerate(data.columns):
+        if c not in frozen.columns:
+            frozen.insert(i, c, data[c])
+    return frozen
+
+
 def unpack_ts_input(inputs, colName, default=None, required=True, as_string=False):
     '''
     function attempts to unpack timeseries inputs using:
@@ -209,6 +239,11 @@ def pyomo_read_parameter(temp):
         d[k] = v
     return d
 
+def fix_disabled(*variables, val=0):
+    """Fix all indices of Pyomo variables, so they are written as constants."""
+    for var in variables:
+        var.fix(val)
+
 def get_solver(solver, solver_dir=None):
     '''
         Utility to return the solverpath readable for Pyomo.
@@ -254,6 +289,67 @@ def check_solver(solver='cbc'):
         
     logging.info(f'The solver was installed.')
 
+_solver_setup = {}
+
+def setup_solver(solver='cbc'):
+    '''
+    Fix the pyomo solver bug and check the solver installation. This runs
+    once per process (on the first optimization, not at import) and later
+    calls return the cached solver path.
+
+    Parameters
+    ----------
+    solver : str, optional
+        Name of the default solver to check. (default='cbc')
+
+    Returns
+    -------
+    str
+        Path of the solver executable.
+    '''
+    if solver not in _solver_setup:
+        if not _solver_setup:
+            fix_bug_pyomo()
+        check_solver(solver)
+        _solver_setup[solver] = get_solver(solver)
+    return _solver_setup[solver]
+
+def find_duplicate_constraints(model):
+    '''
+    Find linear constraint rows which are identical to another row of the
+    model, e.g. from constraints indexed over sets their body does not use.
+
+    Parameters
+    ----------
+    model : pyomo.environ.ConcreteModel
+        constructed pyomo model
+
+    Returns
+    -------
+    duplicates : dict
+        number of duplicate rows by constraint component name
+
+    '''
+    from pyomo.environ import Constraint, value
+    from pyomo.repn import generate_standard_repn
+
+    seen = set()
+    duplicates = {}
+    for con in model.component_data_objects(Constraint, active=True):
+        repn = generate_standard_repn(con.body, quadratic=False)
+        if not repn.is_linear() or not repn.linear_vars:
+            continue
+        terms = tuple(sorted((id(v), c) for v, c in zip(repn.linear_vars, repn.linear_coefs)))
+        key = (None if con.lower is None else value(con.lower) - value(repn.constant),
+               None if con.upper is None else value(con.upper) - value(repn.constant),
+               terms)
+        if key in seen:
+            name = con.parent_component().name
+            duplicates[name] = duplicates.get(name, 0) + 1
+        else:
+            seen.add(key)
+    return duplicates
+
 def extract_properties(parameter, tech_name, prop_name, set_list=None):
     """Extract a single property from every item in a technology list.
 
@@ -906,6 +1002,9 @@ def update_expected_states_from_result(model, parameter):
     - ``soc_initial``: predicted SOC at the second timestep (start of next horizon)
     - ``battery_power``: net cell-side power at the first timestep
 
+    Vehicles of EV fleets take their states from the least laxity first split
+    of the virtual fleet battery.
+
     Parameters
     ----------
     model : pyomo.environ.ConcreteModel
@@ -928,9 +1027,32 @@ def update_expected_states_from_result(model, parameter):
     ts_first = ts_list[0]
     ts_second = ts_list[1] if len(ts_list) > 1 else ts_list[0]
 
+    # aggregated batteries are split equally to their units
+    asset_groups = getattr(model, 'asset_groups', None) or {}
+    # fleet vehicles are split from the virtual fleet battery by least laxity first
+    vehicle_states = {}
+    for fleet_name, fleet in (getattr(model, 'ev_fleets', None) or {}).items():
+        try:
+            power = np.array([model.battery_net_grid_power[t, fleet_name].value
+                              for t in model.ts], dtype=float)
+            vehicle_power, energy = least_laxity_first(power, fleet)
+        except Exception:  # pylint: disable=broad-except
+            continue
+        col = 1 if energy.shape[1] > 1 else 0
+        soc = energy[:, col] / np.maximum(fleet['capacity'], 1e-3)
+        # net cell-side power of the vehicles
+        cell_power = np.where(vehicle_power[:, 0] >= 0, vehicle_power[:, 0] * fleet['eff_charge'],
+                              vehicle_power[:, 0] / np.maximum(fleet['eff_discharge'], 1e-3))
+        for ii, vehicle in enumerate(fleet['names']):
+            vehicle_states[vehicle] = {'soc_initial': float(soc[ii]),
+                                       'battery_power': float(cell_power[ii])}
+
     battery_states = []
     for bat in parameter['batteries']:
-        bat_name = bat.get('name', '')
+        if bat.get('name', '') in vehicle_states:
+            battery_states.append(vehicle_states[bat['name']])
+            continue
+        bat_name, n_units = unit_scale(asset_groups, 'batteries', bat.get('name', ''))
         state = {}
 
         # soc_initial for next run = predicted SOC at the second timestep
@@ -948,7 +1070,7 @@ def update_expected_states_from_result(model, parameter):
                 charge = model.battery_charge_power[ts_first, bat_name].value
                 discharge = model.battery_discharge_power[ts_first, bat_name].value
                 if charge is not None and discharge is not None:
-                    state['battery_power'] = charge - discharge
+                    state['battery_power'] = (charge - discharge) / n_units
             except Exception:  # pylint: disable=broad-except
                 pass
 
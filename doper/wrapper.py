@@ -17,20 +17,18 @@ import json
 import copy
 import logging
 from time import time
+import numpy as np
 import pandas as pd
 import pyutilib.subprocess.GlobalData
 
 from .models.make_model import construct_model_function
-from .utility import fix_bug_pyomo, check_solver, pyomo_read_parameter
-from .utility import make_config, get_solver
+from .models.aggregation import aggregate_assets, disaggregate_results
+from .models.evfleet import aggregate_ev_fleet, disaggregate_ev_fleet, least_laxity_first
+from .models.network import add_violated_network_limits, network_limit_violations
+from .utility import setup_solver, pyomo_read_parameter
+from .utility import make_config, get_solver, freeze_inputs
 from .utility import default_output_list, generate_summary_metrics
 
-# Fix bug in pyomo when intializing solver (timeout after 5s)
-fix_bug_pyomo()
-
-# Check if solver was properly installed
-check_solver()
-
 from pyomo.opt import SolverFactory, TerminationCondition
 
 def get_root(f=None):
@@ -46,6 +44,28 @@ root = get_root()
 
 logger = logging.getLogger(__name__)
 
+class FirstStepResult:
+    """Battery setpoints of the first timestep, read directly from the solved model."""
+    __slots__ = ('timestamp', 'batteries', 'net_grid_power', 'df_label')
+
+    def __init__(self, timestamp, batteries, net_grid_power, df_label):
+        self.timestamp = timestamp
+        self.batteries = batteries
+        self.net_grid_power = net_grid_power
+        self.df_label = df_label
+
+    def to_frame(self):
+        '''
+            Single-row dataframe with the columns of DOPER.write_ts_results,
+            as used by the setpoint processor.
+
+            Returns
+            -------
+                df (pandas.DataFrame): The first timestep of the results.
+        '''
+        return pd.DataFrame([self.net_grid_power], index=pd.DatetimeIndex([self.timestamp]),
+                            columns=[self.df_label % b for b in self.batteries])
+
 class DOPER:
     """wrapper class for DOPER"""
     def __init__(self, model=None, parameter=None, solver_name=None, solver_path='ipopt',
@@ -88,6 +108,8 @@ class DOPER:
         self.model = None
         self.results_df = None
         self.summary = None
+        self.asset_groups = {}
+        self.ev_fleets = {}
 
     def signal_handling_toggle(self):
         '''
@@ -106,7 +128,20 @@ class DOPER:
             -----
                 data (pandas.DataFrame): The input dataframe for the optimization.
         '''
-        self.model = self._model(data, self.parameter)
+        parameter = self.parameter
+        self.asset_groups = {}
+        self.ev_fleets = {}
+        ev_fleet = (parameter or {}).get('controller', {}).get('ev_fleet', False)
+        if ev_fleet:
+            # replace EV fleets with virtual batteries
+            data, parameter, self.ev_fleets = aggregate_ev_fleet(data, parameter, ev_fleet)
+        aggregate = (parameter or {}).get('controller', {}).get('aggregate_assets', False)
+        if aggregate:
+            # merge identical assets into scaled assets
+            data, parameter, self.asset_groups = aggregate_assets(data, parameter, aggregate)
+        self.model = self._model(data, parameter)
+        self.model.asset_groups = self.asset_groups
+        self.model.ev_fleets = self.ev_fleets
         self.model_loaded = True
 
     def write_ts_results(self):
@@ -206,10 +241,53 @@ class DOPER:
         if 'Tariff Energy Period [-]' in df.columns:
             df['Tariff Energy [$/kWh]'] = \
                 df[['Tariff Energy Period [-]']].replace(pyomo_read_parameter(model.tariff_energy))
+
+        # split aggregated assets to units
+        if self.asset_groups:
+            df = disaggregate_results(df, output_list, self.asset_groups)
+        # split virtual fleet batteries to vehicles
+        if self.ev_fleets:
+            df = disaggregate_ev_fleet(df, output_list, self.ev_fleets)
         self.results_df = df
         return df
 
-    def dump_model(self, log_path='./', log_name='doper_data1'):
+    def write_first_step_results(self):
+        '''
+            Reads the net grid power of every battery in the first timestep from the
+            solved model, without building the full timeseries results. Aggregated
+            assets and EV fleets are split to their units.
+
+            Returns
+            -------
+                result (FirstStepResult): The first-timestep battery results.
+        '''
+        model = self.model
+        ts = model.ts.first()
+        df_label = 'Battery %s Net Grid Power [kW]'
+        for outputItem in self.output_list or []:
+            if outputItem['data'] == 'battery_net_grid_power':
+                df_label = outputItem['df_label']
+        if not hasattr(model, 'batteries'):
+            return FirstStepResult(pd.to_datetime(ts, unit='s'), (), np.zeros(0), df_label)
+
+        net_power = model.battery_net_grid_power
+        batteries = []
+        values = []
+        for b in model.batteries:
+            if b in self.ev_fleets:
+                # the fleet split depends on the whole fleet trajectory
+                fleet = self.ev_fleets[b]
+                power = np.array([net_power[t, b].value for t in model.ts])
+                batteries += fleet['names']
+                values += list(least_laxity_first(power, fleet)[0][:, 0])
+                continue
+            group = self.asset_groups.get('batteries', {}).get(b, [b])
+            batteries += group
+            values += [net_power[ts, b].value / len(group)] * len(group)
+        return FirstStepResult(pd.to_datetime(ts, unit='s'), tuple(batteries),
+                               np.array(values, dtype=float), df_label)
+
+    def dump_model(self, log_path='./', log_name='doper_data1', results=None, run_log=None):
         '''
             Dump optimization inputs.
 
@@ -217,11 +295,18 @@ class DOPER:
             -----
                 log_path (str): Directory to save dump files. (default='./')
                 log_name (str): Base name for dump files. (default='doper_data1')
+                results (dict): Recorded results to compare replays against (see doper.replay),
+                    e.g. objective, termination, duration and setpoints. (default=None)
+                run_log (doper.data.runlog.RunLog): Append to this run log instead of writing
+                    files, log_name is the instance id. (default=None)
 
             Returns
             -------
-                dict: Paths of generated files.
+                dict: Paths of generated files, or the run id if run_log is given.
         '''
+        if run_log is not None:
+            return {'run': run_log.append(log_name, self.parameter, self.data, results)}
+
         os.makedirs(log_path, exist_ok=True)
 
         parameter_path = os.path.join(log_path, f'{log_name}.json')
@@ -233,8 +318,15 @@ class DOPER:
 
         # input data
         self.data.to_csv(data_path)
+        paths = {'parameter_path': parameter_path, 'data_path': data_path}
 
-        return {'parameter_path': parameter_path, 'data_path': data_path}
+        # results
+        if results is not None:
+            paths['result_path'] = os.path.join(log_path, f'{log_name}_result.json')
+            with open(paths['result_path'], 'w', encoding='utf-8') as f:
+                f.write(json.dumps(results, default=str))
+
+        return paths
 
     def load_model(self, log_path='./', log_name='doper_data1'):
         '''
@@ -257,7 +349,7 @@ class DOPER:
             self.parameter = json.loads(f.read())
 
         # input data
-        self.data = pd.read_csv(data_path, index_col=0)
+        self.data = pd.read_csv(data_path, index_col=0, float_precision='round_trip')
         self.data.index = pd.to_datetime(self.data.index)
 
         return {'parameter_path': parameter_path, 'data_path': data_path}
@@ -269,6 +361,11 @@ class DOPER:
         '''
             Integrated function to conduct the optimization for control purposes.
 
+            The inputs are not copied: data is consolidated once into a read-only buffer
+            (see utility.freeze_inputs) which the model builders share, and parameter is
+            used as is. Neither is modified by DOPER, and parameter must not be modified
+            by the caller while the results are processed.
+
             Input
             -----
                 data (pandas.DataFrame): The input dataframe for the optimization.
@@ -279,7 +376,9 @@ class DOPER:
                 options (dict): Options to be set for solver. (default={})
                 print_error (bool): Log error messages. (default=True)
                 other_valid_terminations (list): Valid Pyomo termination status to load solutions.
-                process_outputs (bool): Process the outputs from Pyomo. (default=True)
+                process_outputs (bool or str): Process the outputs from Pyomo; 'first_step' only
+                    extracts the first-timestep battery net grid power, call write_ts_results
+                    for the full results. (default=True)
 
             Returns
             -------
@@ -292,11 +391,12 @@ class DOPER:
         '''
         if parameter:
             # Update parameter, if supplied
-            self.parameter = copy.deepcopy(parameter)
-        self.data = copy.deepcopy(data)
+            self.parameter = parameter
+        self.data = freeze_inputs(data)
         #if not self.model_loaded:
         # Instantiate the model, if not already
         self.initialize_model(self.data)
+        setup_solver()
         with SolverFactory(self.solver_name, executable=self.solver_path) as solver:
             t_start = time()
 
@@ -305,8 +405,38 @@ class DOPER:
                 solver.options[k] = options[k]
 
             # run optimization
-            result = solver.solve(self.model, load_solutions=False, tee=tee,
-                                  keepfiles=keepfiles, report_timing=report_timing)
+            # with lazy network limits, violated limits are added and the model is re-solved
+            lazy = getattr(self.model, 'lazyNetworkConstraints', False)
+            max_iterations = getattr(self.model, 'lazyMaxIterations', 0)
+            solve_options = {}
+            loaded = False
+            limits_violated = False
+            load_error = None
+            for iteration in range(max_iterations + 1):
+                # fixed variables are written as constants, skip constraints without variables
+                result = solver.solve(self.model, load_solutions=False, tee=tee,
+                                      keepfiles=keepfiles, report_timing=report_timing,
+                                      skip_trivial_constraints=True, **solve_options)
+                loaded = False
+                if not lazy or result.solver.termination_condition != TerminationCondition.optimal:
+                    break
+                try:
+                    self.model.solutions.load_from(result)
+                except Exception as e:
+                    load_error = e
+                    break
+                loaded = True
+                if iteration == max_iterations:
+                    # no re-solve left, only check the limits
+                    limits_violated = any(index not in getattr(self.model, name)
+                                          for name, indices in network_limit_violations(self.model).items()
+                                          for index in indices)
+                    break
+                if not add_violated_network_limits(self.model):
+                    break
+                # start next solve from the current solution
+                if solver.warm_start_capable():
+                    solve_options['warmstart'] = True
             
             # check termination
             termination = result.solver.termination_condition
@@ -314,7 +444,13 @@ class DOPER:
                               and 'cbc' in str(result.solver).lower() \
                               and not 'objective' in result.solver.message:
                 termination = TerminationCondition.infeasible # CBC does not report infeasible
-            if termination != TerminationCondition.optimal and print_error:
+            if limits_violated:
+                # the solution breaks network limits which were not added
+                termination = TerminationCondition.maxIterations
+                if print_error:
+                    logger.warning('Network limits still violated after '
+                                   f'{max_iterations} iterations.')
+            elif termination != TerminationCondition.optimal and print_error:
                 logger.warning(f'Solver did not report optimality:\n{result.solver}')
 
             # outputs
@@ -323,11 +459,19 @@ class DOPER:
             self.summary = None
             if termination in ([TerminationCondition.optimal] + other_valid_terminations):
                 try:
-                    # load solution
-                    self.model.solutions.load_from(result)
+                    # load solution, unless loaded to check lazy network limits
+                    if load_error is not None:
+                        raise load_error
+                    if not loaded:
+                        self.model.solutions.load_from(result)
 
                     # process outputs
-                    if process_outputs:
+                    if process_outputs == 'first_step':
+                        # only battery setpoints, the full results are built on demand
+                        objective = self.model.objective()
+                        self.results_df = None
+                        df = self.write_first_step_results().to_frame()
+                    elif process_outputs:
                         objective = self.model.objective()
                         df = self.write_ts_results()
                         self.summary = generate_summary_metrics(self.model)
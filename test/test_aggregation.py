@@ -0,0 +1,208 @@
+"""Unit tests for doper.models.aggregation."""
+
+import copy
+import unittest
+import numpy as np
+
+from doper import DOPER, get_solver
+from doper.models.make_model import construct_model_function
+from doper.models.aggregation import (find_identical_assets, aggregate_assets,
+                                      disaggregate_results)
+import doper.examples as example
+from doper.utility import default_output_list, update_expected_states_from_result
+
+
+def _make_parameter(n_units=4):
+    """Helper: battery parameter with n identical units and one distinct unit."""
+    parameter = example.parameter_add_battery()
+    unit = parameter['batteries'][0]
+    parameter['batteries'] = []
+    for i in range(n_units):
+        bat = copy.deepcopy(unit)
+        bat['name'] = f'rack{i}'
+        parameter['batteries'].append(bat)
+    other = copy.deepcopy(unit)
+    other['name'] = 'other'
+    other['capacity'] = 100
+    parameter['batteries'].append(other)
+    return parameter
+
+def _make_loadcontrol(n_units=3):
+    """Helper: n identical unnamed circuits, import limit forces partial shedding."""
+    parameter = example.parameter_add_loadcontrol()
+    parameter['objective']['weight_load_shed'] = 1
+    data = example.ts_inputs_load_shed(parameter)
+    unit = parameter['load_control'][0]
+    del unit['name']
+    unit['cost'] = 1
+    parameter['load_control'] = [copy.deepcopy(unit) for _ in range(n_units)]
+    for i in range(n_units):
+        data[f'load_shed_potential_{i+1}'] = 0.1 * data['load_demand']
+    data['import_max'] = (0.85 * data['load_demand'] - data['generation_pv']).clip(lower=0)
+    return parameter, data
+
+def _run(parameter, data):
+    """Helper: run optimization and return (objective, df, model)."""
+    smart = DOPER(model=construct_model_function(), parameter=parameter,
+                  solver_path=get_solver('cbc'),
+                  output_list=default_output_list(parameter))
+    _, objective, df, model, _, _, _ = smart.do_optimization(data)
+    return objective, df, model
+
+
+class TestFindIdenticalAssets(unittest.TestCase):
+    """Tests for find_identical_assets and aggregate_assets."""
+
+    def setUp(self):
+        self.parameter = _make_parameter()
+        self.data = example.ts_inputs(self.parameter, load='B90', scale_load=150, scale_pv=100)
+
+    def test_groups(self):
+        groups = find_identical_assets(self.data, self.parameter, 'batteries')
+        self.assertEqual(groups, [['rack0', 'rack1', 'rack2', 'rack3'], ['other']])
+
+    def test_different_profile_not_grouped(self):
+        self.data['battery_rack1_avail'] = 1
+        self.data['battery_rack1_demand'] = 0
+        self.data.loc[self.data.index[10], 'battery_rack1_avail'] = 0
+        groups = find_identical_assets(self.data, self.parameter, 'batteries')
+        self.assertIn(['rack1'], groups)
+
+    def test_aggregate_scales_parameter(self):
+        _, parameter, groups = aggregate_assets(self.data, self.parameter)
+        self.assertEqual(groups, {'batteries': {'rack0_x4': ['rack0', 'rack1', 'rack2', 'rack3']}})
+        names = [b['name'] for b in parameter['batteries']]
+        self.assertEqual(names, ['rack0_x4', 'other'])
+        self.assertEqual(parameter['batteries'][0]['capacity'], 4 * 200)
+        self.assertEqual(parameter['batteries'][0]['power_charge'], 4 * 50)
+        # original parameter is unchanged
+        self.assertEqual(len(self.parameter['batteries']), 5)
+
+    def test_no_identical_assets(self):
+        parameter = example.parameter_add_battery()
+        data, new_parameter, groups = aggregate_assets(self.data, parameter)
+        self.assertEqual(groups, {})
+        self.assertIs(new_parameter, parameter)
+        self.assertIs(data, self.data)
+
+    def test_unique_name(self):
+        self.parameter['batteries'][-1]['name'] = 'rack0_x4'
+        _, parameter, groups = aggregate_assets(self.data, self.parameter)
+        names = [b['name'] for b in parameter['batteries']]
+        self.assertEqual(len(set(names)), len(names))
+        self.assertEqual(list(groups['batteries']), ['rack0_x4_1'])
+
+    def test_unnamed_load_circuits(self):
+        parameter, data = _make_loadcontrol()
+        groups = find_identical_assets(data, parameter, 'load_control')
+        self.assertEqual(groups, [['1', '2', '3']])
+        _, new_parameter, _ = aggregate_assets(data, parameter)
+        self.assertEqual(new_parameter['load_control'][0]['units'], 3)
+        self.assertEqual(new_parameter['load_control'][0]['load_connected'], 3)
+
+    def test_disaggregate(self):
+        output_list = default_output_list(self.parameter)
+        groups = {'batteries': {'rack0_x4': ['rack0', 'rack1', 'rack2', 'rack3']}}
+        df = self.data[[]].copy()
+        df['Battery rack0_x4 Net Grid Power [kW]'] = 40.0
+        df = disaggregate_results(df, output_list, groups)
+        self.assertNotIn('Battery rack0_x4 Net Grid Power [kW]', df.columns)
+        for i in range(4):
+            self.assertTrue(np.allclose(df[f'Battery rack{i} Net Grid Power [kW]'], 10.0))
+
+    def test_disaggregate_load_circuits(self):
+        output_list = [
+            {'data': 'load_circuits_on', 'df_label': 'Circuit %s On [-]', 'index': 'load_circuits'},
+            {'data': 'load_shed_circuit', 'df_label': 'Circuit %s Shed [kW]', 'index': 'load_circuits'},
+            {'data': 'der_shed_load', 'df_label': 'Circuit %s Switched Off [-]', 'index': 'load_circuits'}]
+        groups = {'load_control': {'1_x3': ['1', '2', '3']}}
+        df = self.data[[]].iloc[:2].copy()
+        df['Circuit 1_x3 On [-]'] = [3., 1.]
+        df['Circuit 1_x3 Shed [kW]'] = [0., 20.]
+        df['Circuit 1_x3 Switched Off [-]'] = [0., 2.]
+        df = disaggregate_results(df, output_list, groups)
+        self.assertEqual(list(df['Circuit 1 On [-]']), [1, 1])
+        self.assertEqual(list(df['Circuit 2 On [-]']), [1, 0])
+        self.assertEqual(list(df['Circuit 3 Shed [kW]']), [0, 10])
+        self.assertEqual(list(df['Circuit 1 Switched Off [-]']), [0, 0])
+        self.assertEqual(list(df['Circuit 2 Switched Off [-]']), [0, 1])
+
+
+class TestAggregatedOptimization(unittest.TestCase):
+    """Aggregated and detailed model give the same results."""
+
+    setUpComplete = False
+
+    def setUp(self):
+        if not self.__class__.setUpComplete:
+            parameter = _make_parameter()
+            data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+            self.__class__.obj_full, self.__class__.df_full, _ = _run(parameter, data)
+            parameter['controller']['aggregate_assets'] = True
+            self.__class__.parameter = parameter
+            self.__class__.obj_agg, self.__class__.df_agg, self.__class__.model = \
+                _run(parameter, data)
+            self.__class__.setUpComplete = True
+
+    def test_objective(self):
+        self.assertAlmostEqual(self.obj_agg, self.obj_full, delta=abs(self.obj_full) * 1e-3)
+
+    def test_fewer_binaries(self):
+        self.assertEqual(len(self.model.batteries), 2)
+
+    def test_unit_columns(self):
+        for i in range(4):
+            self.assertIn(f'Battery rack{i} Net Grid Power [kW]', self.df_agg.columns)
+        self.assertTrue(np.allclose(self.df_agg['Battery rack0 Net Grid Power [kW]'],
+                                    self.df_agg['Battery rack3 Net Grid Power [kW]']))
+
+    def test_site_totals(self):
+        units = [f'Battery rack{i} Net Grid Power [kW]' for i in range(4)] \
+            + ['Battery other Net Grid Power [kW]']
+        net = self.df_agg['Battery Charging Power [kW]'] - self.df_agg['Battery Discharging Power [kW]']
+        self.assertTrue(np.allclose(self.df_agg[units].sum(axis=1), net, atol=1e-3))
+
+    def test_expected_states(self):
+        states = update_expected_states_from_result(self.model, self.parameter)
+        self.assertEqual(len(states['batteries']), 5)
+        self.assertEqual(states['batteries'][0], states['batteries'][3])
+
+
+class TestFirstStepResults(unittest.TestCase):
+    """First-step results match the first row of the full results."""
+
+    def test_first_step(self):
+        parameter = _make_parameter()
+        parameter['controller']['aggregate_assets'] = True
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        smart = DOPER(model=construct_model_function(), parameter=parameter,
+                      solver_path=get_solver('cbc'),
+                      output_list=default_output_list(parameter))
+        _, objective, df, _, _, _, _ = smart.do_optimization(data, process_outputs='first_step')
+        self.assertIsNotNone(objective)
+        self.assertEqual(len(df), 1)
+        self.assertIsNone(smart.results_df)
+        full = smart.write_ts_results()
+        self.assertEqual(df.index[0], full.index[0])
+        for col in df.columns:
+            self.assertAlmostEqual(df[col].iloc[0], full[col].iloc[0], places=6)
+        self.assertEqual(len(df.columns), 5)
+
+
+class TestAggregatedLoadControl(unittest.TestCase):
+    """Aggregated load circuits give the same objective as the detailed model."""
+
+    def test_objective(self):
+        parameter, data = _make_loadcontrol()
+        obj_full, _, _ = _run(parameter, data)
+        parameter['controller']['aggregate_assets'] = ['load_control']
+        obj_agg, _, model = _run(parameter, data)
+        self.assertEqual(len(model.load_circuits), 1)
+        # units of the group are shed individually
+        units_on = [round(v.value) for v in model.load_circuits_on.values()]
+        self.assertIn(1, units_on)
+        self.assertAlmostEqual(obj_agg, obj_full, delta=abs(obj_full) * 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
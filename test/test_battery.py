@@ -1,13 +1,16 @@
 import os
 import sys
+import copy
 import unittest
 from pyomo.environ import Objective, minimize
 
-from doper import DOPER, get_solver, get_root
+from doper import DOPER, get_solver, get_root, get_tariff
+from doper.computetariff import compute_periods
 from doper.models.basemodel import base_model
 from doper.models.battery import add_battery
 import doper.examples as example
-from doper.utility import default_output_list
+from doper.models.make_model import construct_model_function
+from doper.utility import default_output_list, freeze_inputs
 
 class TestBaseModel(unittest.TestCase):
     '''
@@ -399,5 +402,52 @@ class TestBatteryPowerInit(unittest.TestCase):
                              msg='optimization did not complete with non-zero battery_power')
 
 
+class TestInputsUnchanged(unittest.TestCase):
+    '''
+    DOPER shares the inputs with the model builders instead of copying them.
+    '''
+
+    def test_inputs_unchanged(self):
+        parameter = example.test_default_parameter()
+        parameter = example.test_parameter_add_battery(parameter)
+        parameter['batteries'][0]['soc_final'] = True
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        parameter_in = copy.deepcopy(parameter)
+        data_in = data.copy(deep=True)
+
+        smartDER = DOPER(model=construct_model_function(),
+                         parameter=parameter,
+                         solver_path=get_solver('cbc'),
+                         output_list=default_output_list(parameter))
+        res = smartDER.do_optimization(data, parameter=parameter)
+        self.assertIsNotNone(res[1])
+        self.assertEqual(parameter, parameter_in)
+        self.assertTrue(data.equals(data_in))
+        self.assertEqual(list(data.columns), list(data_in.columns))
+        # final SOC defaults to the initial SOC
+        b = parameter['batteries'][0]
+        self.assertEqual(smartDER.model.bat_soc_end[b['name']], b['soc_initial'])
+
+    def test_periods_inputs_unchanged(self):
+        parameter = example.test_default_parameter()
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        data_in = data.copy(deep=True)
+        periods, _ = compute_periods(data, get_tariff('e19-2020'), parameter)
+        self.assertIn('tariff_energy_map', periods.columns)
+        self.assertTrue(periods.index.equals(data_in.index))
+        self.assertTrue(data.equals(data_in))
+        self.assertEqual(list(data.columns), list(data_in.columns))
+
+    def test_frozen_buffer(self):
+        parameter = example.test_default_parameter()
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        frozen = freeze_inputs(data)
+        self.assertEqual(list(frozen.columns), list(data.columns))
+        self.assertTrue(frozen.equals(data.astype({c: float for c in frozen.columns
+                                                   if frozen[c].dtype == float})))
+        with self.assertRaises(ValueError):
+            frozen.loc[frozen.index[0], 'load_demand'] = 0
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+"""Unit tests for doper.models.bounds."""
+
+import unittest
+
+from doper.models.basemodel import base_model
+from doper.models.genset import add_genset
+from doper.models.bounds import (grid_import_bound, grid_export_bound,
+                                 fuel_flow_bound, fuel_reserves_bound)
+import doper.examples as example
+
+
+class TestGridBounds(unittest.TestCase):
+    """Tests for the grid import/export big-M."""
+
+    def setUp(self):
+        self.parameter = example.parameter_add_battery()
+        self.data = example.ts_inputs(self.parameter, load='B90', scale_load=150, scale_pv=100)
+        self.model = base_model(self.data, self.parameter)
+
+    def test_import_bound(self):
+        bound = grid_import_bound(self.model, self.parameter)
+        for ts in self.model.ts:
+            load = self.model.load_input[ts, self.model.nodes.at(1)]
+            self.assertAlmostEqual(bound[ts], load + 50)
+            self.assertLessEqual(bound[ts], self.model.dynamic_import_max[ts])
+
+    def test_export_bound(self):
+        bound = grid_export_bound(self.model, self.parameter)
+        for ts in self.model.ts:
+            pv = self.model.generation_pv[ts, self.model.nodes.at(1)]
+            self.assertAlmostEqual(bound[ts], pv + 50)
+
+    def test_model_params(self):
+        bound = grid_import_bound(self.model, self.parameter)
+        for ts in self.model.ts:
+            self.assertAlmostEqual(self.model.grid_import_bigM[ts], bound[ts])
+
+    def test_hvac_not_tightened(self):
+        self.parameter['system']['hvac_control'] = True
+        bound = grid_import_bound(self.model, self.parameter)
+        for ts in self.model.ts:
+            self.assertEqual(bound[ts], self.model.dynamic_import_max[ts])
+
+
+class TestFuelBounds(unittest.TestCase):
+    """Tests for the fuel outage big-M."""
+
+    def setUp(self):
+        parameter = example.parameter_add_genset()
+        data = example.ts_inputs_fueloutage(parameter)
+        model = base_model(data, parameter)
+        self.model = add_genset(model, data, parameter)
+
+    def test_fuel_flow(self):
+        bound = fuel_flow_bound(self.model)
+        self.assertAlmostEqual(bound['ng'], 60 * 0.25)
+        self.assertAlmostEqual(bound['diesel'], 80 * 0.30)
+
+    def test_fuel_reserves(self):
+        bound = fuel_reserves_bound(self.model)
+        # no ng reserves
+        self.assertEqual(bound['ng'], 0)
+        self.assertAlmostEqual(bound['diesel'], 80 * 0.30)
+        self.assertAlmostEqual(self.model.genset_fuel_reserves_bigM['diesel'], 80 * 0.30)
+
+
+if __name__ == '__main__':
+    unittest.main()
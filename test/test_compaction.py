@@ -0,0 +1,76 @@
+"""Unit tests for compact constraint indexing and the duplicate-constraint detector."""
+
+import unittest
+from pyomo.environ import Constraint
+
+import doper.examples as example
+from doper.models.make_model import construct_model_function
+from doper.models.basemodel import base_model
+from doper.models.battery import add_battery
+from doper.models.genset import add_genset
+from doper.models.network import add_network
+from doper.utility import find_duplicate_constraints
+
+
+class TestCompactFormulation(unittest.TestCase):
+    """Constraints are only indexed over sets their body uses."""
+
+    @classmethod
+    def setUpClass(cls):
+        parameter = example.parameter_add_loadcontrol(
+            example.parameter_add_genset(example.parameter_add_battery()))
+        data = example.ts_inputs_load_shed(parameter)
+        cls.model = construct_model_function()(data, parameter)
+
+    def test_no_duplicates(self):
+        self.assertEqual(find_duplicate_constraints(self.model), {})
+
+    def test_reserves_volume(self):
+        self.assertEqual(len(self.model.constraint_total_genset_reserves_volume),
+                         len(self.model.fuels))
+
+    def test_site_totals(self):
+        n = len(self.model.ts)
+        self.assertEqual(len(self.model.constraint_site_total_battery_charge), n)
+        self.assertEqual(len(self.model.constraint_site_total_battery_discharge), n)
+        self.assertEqual(len(self.model.constraint_site_total_genset_output), n)
+        self.assertEqual(len(self.model.constraint_total_genset_output),
+                         n * len(self.model.nodes))
+
+    def test_detector(self):
+        def rule(model, ts, battery):
+            return model.battery_agg_soc[ts] <= 1
+        self.model.constraint_dummy = Constraint(self.model.ts, self.model.batteries, rule=rule)
+        try:
+            duplicates = find_duplicate_constraints(self.model)
+        finally:
+            self.model.del_component(self.model.constraint_dummy)
+        # one battery; each row duplicates nothing but itself
+        self.assertEqual(duplicates, {})
+        self.model.constraint_dummy = Constraint(self.model.ts, [0, 1], rule=rule)
+        try:
+            duplicates = find_duplicate_constraints(self.model)
+        finally:
+            self.model.del_component(self.model.constraint_dummy)
+        self.assertEqual(duplicates, {'constraint_dummy': len(self.model.ts)})
+
+
+class TestCompactMultinode(unittest.TestCase):
+    """Multi-node models are free of duplicate constraint rows."""
+
+    def test_no_duplicates(self):
+        parameter = example.parameter_add_network_test()
+        parameter = example.parameter_add_battery_multinode_test(parameter)
+        parameter = example.parameter_add_genset_multinode_test(parameter)
+        data = example.ts_inputs_multinode_test(parameter)
+        model = base_model(data, parameter)
+        model = add_battery(model, data, parameter)
+        model = add_genset(model, data, parameter)
+        model = add_network(model, data, parameter)
+        self.assertEqual(find_duplicate_constraints(model), {})
+        self.assertEqual(len(model.contraints_node_power_in),
+                         len(model.ts) * len(model.nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ from pyomo.environ import Objective, minimize
 from doper import DOPER, get_solver
 from doper.models.basemodel import base_model
 from doper.models.battery import add_battery
-from doper.models.ev import add_ev, _get_sessions, _get_departures
+from doper.models.ev import add_ev, _get_sessions, _get_departures, _get_edges
 import doper.examples as example
 from doper.utility import default_output_list
 
@@ -120,6 +120,14 @@ class TestEvHelpers(unittest.TestCase):
         ts    = [0, 1, 2]
         self.assertEqual(_get_departures(avail, ts), [2])
 
+    def test_edges_fleet(self):
+        avail = [[1, 1, 0, 0, 1, 1, 0],
+                 [0, 0, 0, 0, 0, 0, 0],
+                 [0, 0, 1, 1, 0, 1, 0]]
+        rows, ts_in, ts_out = _get_edges(avail)
+        self.assertEqual(list(zip(rows, ts_in, ts_out)),
+                         [(0, 0, 2), (0, 4, 6), (2, 2, 4), (2, 5, 6)])
+
 
 class TestEvModelVariables(unittest.TestCase):
     """Check that add_ev adds expected Pyomo variables to the model."""
@@ -221,7 +229,7 @@ class TestEvMinLeavingSocFalse(unittest.TestCase):
             self.__class__.setUpComplete = True
 
     def test_no_min_leaving_energy_constraints(self):
-        names = [c for c in dir(self.model) if 'constraint_ev_min_leaving' in c]
+        names = list(self.model.constraint_ev_min_leaving_energy) + list(self.model.constraint_ev_min_leaving_soc)
         self.assertEqual(len(names), 0,
                          msg='Unexpected leaving-SOC constraints found when min_leaving_soc=False')
 
@@ -389,7 +397,7 @@ class TestEvStartsUnplugged(unittest.TestCase):
             self.__class__.setUpComplete = True
 
     def test_constraint_added_for_mid_horizon_session(self):
-        names = [c for c in dir(self.model) if 'constraint_ev_min_leaving' in c]
+        names = list(self.model.constraint_ev_min_leaving_energy) + list(self.model.constraint_ev_min_leaving_soc)
         self.assertGreater(len(names), 0,
                            msg='Leaving-SOC constraint should exist for mid-horizon plug-in/plug-out')
 
@@ -413,7 +421,7 @@ class TestEvNoStateChange(unittest.TestCase):
             self.__class__.setUpComplete = True
 
     def test_no_leaving_soc_constraints_when_no_state_change(self):
-        names = [c for c in dir(self.model) if 'constraint_ev_min_leaving' in c]
+        names = list(self.model.constraint_ev_min_leaving_energy) + list(self.model.constraint_ev_min_leaving_soc)
         self.assertEqual(len(names), 0,
                          msg='No leaving-SOC constraints should exist when EV never unplugs')
 
@@ -0,0 +1,171 @@
+"""Unit tests for doper.models.evfleet."""
+
+import copy
+import unittest
+import numpy as np
+import pandas as pd
+
+from doper import DOPER, get_solver
+from doper.models.make_model import construct_model_function
+from doper.models.evfleet import (fleet_arrays, fleet_envelopes, aggregate_ev_fleet,
+                                  least_laxity_first)
+import doper.examples as example
+from doper.utility import (default_output_list, update_expected_states_from_result,
+                           update_nested_dict)
+
+
+def _make_fleet(n_repeat=1):
+    """Helper: example fleet with departure requirements, repeated n_repeat times."""
+    parameter = example.parameter_add_evfleet()
+    parameter['system']['ev'] = True
+    data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+    n = len(data)
+    vehicles = []
+    for r in range(n_repeat):
+        for i, vehicle in enumerate(parameter['batteries']):
+            vehicle = copy.deepcopy(vehicle)
+            vehicle['name'] = f'{vehicle["name"]}_{r}' if n_repeat > 1 else vehicle['name']
+            vehicle['min_leaving_soc'] = 0.9
+            avail = np.ones(n)
+            avail[60+i*20:120+i*30] = 0
+            data[f'battery_{vehicle["name"]}_avail'] = avail
+            data[f'battery_{vehicle["name"]}_demand'] = 1 - avail
+            vehicles.append(vehicle)
+    parameter['batteries'] = vehicles
+    return parameter, data
+
+def _run(parameter, data):
+    """Helper: run optimization and return (objective, df, smart)."""
+    smart = DOPER(model=construct_model_function(), parameter=parameter,
+                  solver_path=get_solver('cbc'),
+                  output_list=default_output_list(parameter))
+    _, objective, df, _, _, _, _ = smart.do_optimization(data)
+    return objective, df, smart
+
+
+class TestFleetEnvelopes(unittest.TestCase):
+    """Tests for fleet_envelopes."""
+
+    def setUp(self):
+        index = pd.date_range('2020-01-01', periods=6, freq='h')
+        self.data = pd.DataFrame({'battery_EV_avail': [1, 1, 1, 1, 0, 0],
+                                  'battery_EV_demand': 0}, index=index)
+        self.vehicle = {'name': 'EV', 'capacity': 40, 'power_charge': 10, 'power_discharge': 10,
+                        'efficiency_charging': 1, 'efficiency_discharging': 1,
+                        'soc_initial': 0.25, 'soc_min': 0, 'soc_max': 1, 'min_leaving_soc': 0.75}
+
+    def test_single_session(self):
+        envelopes = fleet_envelopes(fleet_arrays(self.data, [self.vehicle]))
+        # 20 kWh needed at departure, charging 10 kW and discharging to empty
+        self.assertTrue(np.allclose(envelopes['energy_max'], [0, 10, 20, 20, 20, 20]))
+        self.assertTrue(np.allclose(envelopes['energy_min'], [0, -10, 0, 10, 20, 20]))
+        self.assertTrue(np.allclose(envelopes['avail'], [1, 1, 1, 1, 0, 0]))
+
+    def test_open_session(self):
+        self.data['battery_EV_avail'] = 1
+        envelopes = fleet_envelopes(fleet_arrays(self.data, [self.vehicle]))
+        # no requirement at the end of the horizon
+        self.assertTrue(np.allclose(envelopes['energy_max'], [0, 10, 20, 30, 30, 30]))
+        self.assertTrue(np.allclose(envelopes['energy_min'], [0, -10, -10, -10, -10, -10]))
+
+    def test_least_laxity_first(self):
+        other = dict(self.vehicle, name='EV2', soc_initial=0.5)
+        self.data['battery_EV2_avail'] = 1
+        fleet = fleet_arrays(self.data, [self.vehicle, other])
+        power, energy = least_laxity_first(np.array([2, 0, 10, 10, 0, 0]), fleet)
+        # headroom is shared until the leaving vehicle runs out of laxity
+        self.assertTrue(np.allclose(power[:, 0], [1, 1]))
+        self.assertTrue(np.allclose(power[:, 2:4], [[9.5, 9.5], [0.5, 0.5]]))
+        self.assertAlmostEqual(energy[0, 4], 0.75 * 40)
+
+
+class TestAggregateEvFleet(unittest.TestCase):
+    """Tests for aggregate_ev_fleet."""
+
+    def test_size_independent(self):
+        sizes = []
+        for n_repeat in [1, 10]:
+            parameter, data = _make_fleet(n_repeat)
+            inputs, parameter_agg, fleets = aggregate_ev_fleet(data, parameter)
+            self.assertEqual([b['name'] for b in parameter_agg['batteries']], ['ev_fleet'])
+            self.assertEqual(len(fleets['ev_fleet']['names']), 3 * n_repeat)
+            sizes.append(inputs['battery_ev_fleet_energy_max'].max())
+        self.assertAlmostEqual(sizes[1], 10 * sizes[0])
+
+    def test_unchanged_without_fleet(self):
+        parameter, data = _make_fleet()
+        for b in parameter['batteries']:
+            b['min_leaving_soc'] = False
+        inputs, parameter_agg, fleets = aggregate_ev_fleet(data, parameter)
+        self.assertEqual(fleets, {})
+        self.assertIs(parameter_agg, parameter)
+
+
+class TestFleetOptimization(unittest.TestCase):
+    """Virtual fleet battery is dispatched to the vehicles."""
+
+    setUpComplete = False
+
+    def setUp(self):
+        if not self.__class__.setUpComplete:
+            parameter, data = _make_fleet()
+            self.__class__.obj_full, _, _ = _run(parameter, data)
+            parameter['controller']['ev_fleet'] = True
+            self.__class__.obj_fleet, self.__class__.df, smart = _run(parameter, data)
+            self.__class__.model = smart.model
+            self.__class__.first_step = smart.write_first_step_results().to_frame()
+            self.__class__.fleet = smart.ev_fleets['ev_fleet']
+            self.__class__.setUpComplete = True
+
+    def test_single_battery(self):
+        self.assertEqual(list(self.model.batteries), ['ev_fleet'])
+
+    def test_vehicle_columns(self):
+        cols = [f'Battery EV{i} Net Grid Power [kW]' for i in (1, 2, 3)]
+        self.assertTrue(np.allclose(self.df[cols].sum(axis=1),
+                                    self.df['Battery ev_fleet Net Grid Power [kW]'], atol=1e-3))
+
+    def test_departure_requirement(self):
+        power = self.df['Battery ev_fleet Net Grid Power [kW]'].to_numpy()
+        _, energy = least_laxity_first(power, self.fleet)
+        rows, _, cols_out = self.fleet['sessions']
+        for row, col in zip(rows, cols_out):
+            if col < energy.shape[1]:
+                self.assertGreaterEqual(energy[row, col], 0.9 * self.fleet['capacity'][row] - 1e-3)
+
+    def test_first_step(self):
+        cols = [f'Battery EV{i} Net Grid Power [kW]' for i in (1, 2, 3)]
+        self.assertEqual(list(self.first_step.columns), cols)
+        self.assertTrue(np.allclose(self.first_step.iloc[0], self.df[cols].iloc[0]))
+
+    def test_objective(self):
+        self.assertAlmostEqual(self.obj_fleet, self.obj_full, delta=abs(self.obj_full) * 0.05)
+
+
+class TestFleetExpectedStates(unittest.TestCase):
+    """Vehicle states carry over between consecutive runs of a fleet."""
+
+    def _soc(self, df, smart):
+        power = df['Battery ev_fleet Net Grid Power [kW]'].to_numpy()
+        fleet = smart.ev_fleets['ev_fleet']
+        return least_laxity_first(power, fleet)[1] / fleet['capacity'][:, None]
+
+    def test_two_ticks(self):
+        parameter, data = _make_fleet()
+        parameter['controller']['ev_fleet'] = True
+        _, df, smart = _run(parameter, data)
+        soc = self._soc(df, smart)
+        states = update_expected_states_from_result(smart.model, parameter)
+        self.assertEqual(len(states['batteries']), 3)
+        for i, state in enumerate(states['batteries']):
+            self.assertEqual(set(state), {'soc_initial', 'battery_power'})
+            self.assertAlmostEqual(state['soc_initial'], soc[i, 1], places=6)
+        # next tick starts from the expected states
+        update_nested_dict(parameter, states)
+        _, df2, smart = _run(parameter, data.iloc[1:])
+        self.assertTrue(np.allclose(self._soc(df2, smart)[:, 0], soc[:, 1]))
+        states = update_expected_states_from_result(smart.model, parameter)
+        self.assertTrue(all(states['batteries']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 DOPER install test module.
 """
 
+import sys
 import subprocess as sp
 
 def test_install():
@@ -19,3 +20,14 @@ def test_tariff():
     import doper
     tariff = doper.get_tariff('e19-2020')
     assert tariff['name'].startswith('PG&E E-19')
+
+def test_import_lazy():
+    """
+    This is a test to verify that importing DOPER does not load the optional
+    plotting and forecast dependencies or set up the solver.
+    """
+    code = ('import sys, doper; '
+            'print(sorted(m for m in ("matplotlib", "pygrib", "pvlib") if m in sys.modules)); '
+            'print(doper.utility._solver_setup)')
+    out = sp.check_output([sys.executable, '-c', code], text=True).splitlines()
+    assert out[-2:] == ['[]', '{}']
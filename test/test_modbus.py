@@ -0,0 +1,348 @@
+import json
+import time
+import numpy as np
+import pandas as pd
+import socket
+import asyncio
+import threading
+import unittest
+
+from pymodbus.server import ModbusTcpServer
+from pymodbus.datastore import ModbusServerContext, ModbusDeviceContext, ModbusSequentialDataBlock
+
+import doper.data.modbus as modbus_io
+from doper.data.modbus_client import communication_scada
+
+
+class ModbusTestServer:
+    '''
+    Modbus TCP server in a background thread, counting the requests.
+    '''
+
+    def __init__(self, values, devices=(1,), delay=0):
+        self.delay = delay
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.requests = 0
+        self.connections = 0
+        blocks = {d: ModbusDeviceContext(hr=ModbusSequentialDataBlock(1, list(values)),
+                                         ir=ModbusSequentialDataBlock(1, list(values)))
+                  for d in devices}
+        self.context = ModbusServerContext(devices=blocks, single=False)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),),
+                                       daemon=True)
+        self.thread.start()
+        time.sleep(0.2)
+
+    async def run(self):
+        self.server = ModbusTcpServer(self.context, address=('127.0.0.1', self.port),
+                                      trace_pdu=self.trace, trace_connect=self.connect)
+        await self.server.serve_forever()
+
+    def trace(self, sending, pdu):
+        if not sending:
+            self.requests += 1
+            # slow device
+            time.sleep(self.delay)
+        return pdu
+
+    def connect(self, connected):
+        self.connections += int(connected)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.shutdown(), self.loop).result(5)
+
+
+def make_channels(port, specs):
+    return [{'name': f'ch{i}', 'address': f'127.0.0.1:{port}:{device}:9600', 'register': register,
+             'mode': mode, 'default': -1, 'order': order}
+            for i, (device, register, mode, order) in enumerate(specs)]
+
+
+class TestModbusClient(unittest.TestCase):
+    '''
+    unit tests for the Modbus client of the SCADA communication.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ModbusTestServer([(i * 7919) % 65536 for i in range(300)], devices=(1, 2))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def get_scada(self, channels, **inputs):
+        scada = communication_scada()
+        scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'}, **inputs)
+        scada.pmb_debug = None
+        requests = self.server.requests
+        res = scada.get_scada()
+        return res, self.server.requests - requests, scada
+
+    def test_plan_reads(self):
+        reads = [('a', 10, 1), ('a', 11, 2), ('b', 12, 1), ('a', 16, 1), ('a', 30, 2),
+                 ('a', 31, 1)]
+        blocks = modbus_io.plan_reads(reads, max_block=125, max_gap=4)
+        self.assertEqual([b[:3] for b in blocks], [('a', 10, 7), ('a', 30, 2), ('b', 12, 1)])
+        self.assertEqual(blocks[0][3], [(0, 0, 1), (1, 1, 2), (3, 6, 1)])
+        blocks = modbus_io.plan_reads(reads, max_block=4, max_gap=0)
+        self.assertEqual([b[:3] for b in blocks],
+                         [('a', 10, 3), ('a', 16, 1), ('a', 30, 2), ('b', 12, 1)])
+
+    def test_decode_values(self):
+        registers = [(i * 7919) % 65536 for i in range(40)]
+        for data_type in ['int16', 'uint16', 'int32', 'uint32', 'float32', 'float64']:
+            for order in [['big', 'big'], ['big', 'little'], ['little', 'big'],
+                          ['little', 'little']]:
+                n = modbus_io.register_count(data_type)
+                offsets = list(range(0, 40 - n, 3))
+                values = modbus_io.decode_values(registers, offsets, data_type, order)
+                expected = [modbus_io.decode_registers(registers[o:o+n], data_type, order)
+                            for o in offsets]
+                np.testing.assert_array_equal(values, expected, err_msg=f'{data_type} {order}')
+        values = modbus_io.decode_values(registers, [0, 1], 'uint16', scale=[0.1, 10])
+        np.testing.assert_allclose(values, [0, 79190])
+
+    def test_block_reads(self):
+        specs = [(1, 10, 'int', ['big', 'little']), (1, 11, 'uint', ['big', 'little']),
+                 (1, 12, 'float', ['big', 'little']), (1, 14, 'float', ['big', 'big']),
+                 (1, 16, 'float', ['little', 'big']), (1, 20, 'int', ['little', 'little']),
+                 (2, 10, 'uint', ['big', 'little']), (1, -1, 'int', ['big', 'little'])]
+        channels = make_channels(self.server.port, specs)
+        res, requests, _ = self.get_scada(channels)
+        legacy, legacy_requests, _ = self.get_scada(channels, **{'block-size': 1})
+        self.assertEqual(list(res.index), [c['name'] for c in channels])
+        self.assertEqual(res['value'].tolist(), legacy['value'].tolist())
+        self.assertTrue((res['valid'].iloc[:-1] == 1).all())
+        self.assertEqual(res['value'].iloc[-1], -1)
+        self.assertEqual(requests, 2) # one block per device
+        self.assertEqual(legacy_requests, 7)
+
+    def test_block_fallback(self):
+        # the gap reaches past the mapped registers
+        channels = make_channels(self.server.port, [(1, 280, 'int', ['big', 'little']),
+                                                    (1, 298, 'int', ['big', 'little'])])
+        channels[1]['register'] = 310
+        res, _, scada = self.get_scada(channels, **{'max-gap': 100})
+        self.assertEqual(res['valid'].tolist(), [1, 0])
+        self.assertEqual(len(scada.single_reads), 2)
+
+    def test_block_fallback_async(self):
+        # channels of the failed block are read one by one on the next call
+        channels = make_channels(self.server.port, [(1, 280, 'int', ['big', 'little']),
+                                                    (1, 298, 'int', ['big', 'little'])])
+        channels[1]['register'] = 310
+        res, _, scada = self.get_scada(channels, **{'max-gap': 100, 'async': True})
+        self.assertEqual(res['valid'].tolist(), [1, 0])
+        self.assertEqual(len(scada.single_reads), 2)
+        res2 = scada.get_scada()
+        scada.close()
+        self.assertEqual(res2['valid'].tolist(), [1, 0])
+        self.assertEqual(res2['value'].iloc[0], res['value'].iloc[0])
+
+    def test_poll_interval(self):
+        channels = make_channels(self.server.port, [(1, 10, 'int', ['big', 'little']),
+                                                    (1, 11, 'int', ['big', 'little']),
+                                                    (1, 200, 'int', ['big', 'little'])])
+        channels[0]['poll_interval'] = 60
+        scada = communication_scada()
+        scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'})
+        scada.pmb_debug = None
+        res = scada.get_scada()
+        self.assertEqual(res['age'].tolist(), [0, 0, 0])
+
+        # channel 0 from the cache, channel 1 read
+        requests = self.server.requests
+        res2 = scada.get_scada()
+        self.assertEqual(self.server.requests - requests, 2)
+        self.assertEqual(res2['value'].tolist(), res['value'].tolist())
+        self.assertGreater(res2['age'].iloc[0], 0)
+        self.assertEqual(res2['age'].iloc[1], 0)
+
+        # due again
+        key = ('ch0', channels[0]['address'], 10)
+        scada.read_cache[key] = (scada.read_cache[key][0], time.time() - 60)
+        requests = self.server.requests
+        self.assertEqual(scada.get_scada()['age'].iloc[0], 0)
+        self.assertEqual(self.server.requests - requests, 2)
+
+    def test_max_age(self):
+        channels = make_channels(self.server.port, [(1, 10, 'int', ['big', 'little'])])
+        channels[0]['max_age'] = 60
+        scada = communication_scada()
+        scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'})
+        scada.pmb_debug = None
+        value = scada.get_scada()['value'].iloc[0]
+
+        # register not readable, cached value served
+        channels[0]['register'] = 400
+        scada.input['channels'] = json.dumps(channels)
+        key = ('ch0', channels[0]['address'], 400)
+        scada.read_cache[key] = scada.read_cache[('ch0', channels[0]['address'], 10)]
+        res = scada.get_scada()
+        self.assertEqual((res['value'].iloc[0], res['valid'].iloc[0]), (value, 1))
+        self.assertIn('WARNING', res['error'].iloc[0])
+        scada.read_cache[key] = (scada.read_cache[key][0], time.time() - 61)
+        self.assertEqual(scada.get_scada()['valid'].iloc[0], 0)
+
+    def set_scada(self, scada, channels, values):
+        scada.input.update({'channels': json.dumps(channels), 'mode': 'set-scada',
+                            'input-data': pd.DataFrame({'name': list(values),
+                                                        'value': list(values.values())}).to_json()})
+        scada.pmb_debug = None
+        requests = self.server.requests
+        res = scada.set_scada()
+        return res, self.server.requests - requests
+
+    def test_write(self):
+        specs = [(1, 100, 'int', ['big', 'little']), (1, 101, 'uint', ['big', 'little']),
+                 (1, 102, 'float', ['little', 'big']), (2, 100, 'float', ['big', 'little']),
+                 (1, 110, 'int', ['big', 'little'])]
+        channels = make_channels(self.server.port, specs)
+        values = {'ch0': -5, 'ch1': 7, 'ch2': 2.5, 'ch3': -1.25, 'ch4': 3}
+        scada = communication_scada()
+        res, requests = self.set_scada(scada, channels, values)
+        self.assertTrue((res['valid'] == 1).all())
+        self.assertEqual(requests, 3) # adjacent registers of device 1, 110 and device 2
+        read, _, _ = self.get_scada(channels)
+        self.assertEqual(read['value'].tolist(), list(values.values()))
+
+        # scaled
+        for c in channels:
+            c['scale'] = 0.1
+        res, _ = self.set_scada(scada, channels, values)
+        read, _, _ = self.get_scada(channels)
+        np.testing.assert_allclose(read['value'], list(values.values()), rtol=1e-6)
+        channels[0]['scale'] = 1
+        read, _, _ = self.get_scada(channels)
+        self.assertEqual(read['value'].iloc[0], -50)
+        # channel tables exported by pandas have null for unset values
+        channels[0]['scale'] = None
+        channels = json.loads(pd.DataFrame(channels).to_json(orient='records'))
+        read, _, _ = self.get_scada(channels)
+        self.assertEqual(read['value'].iloc[0], -50)
+        res, _ = self.set_scada(scada, channels, {**values, 'ch0': -7})
+        self.assertTrue((res['valid'] == 1).all())
+        read, _, _ = self.get_scada(channels)
+        self.assertEqual(read['value'].iloc[0], -7)
+
+        # missing input
+        res, _ = self.set_scada(scada, channels, {'ch0': 1})
+        self.assertEqual(res['valid'].tolist(), [1, 0, 0, 0, 0])
+
+    def test_write_deadband(self):
+        channels = make_channels(self.server.port, [(1, 120, 'int', ['big', 'little']),
+                                                    (1, 121, 'int', ['big', 'little'])])
+        channels[1]['deadband'] = 5
+        # null deadband of ch0 falls back to the input
+        channels = json.loads(pd.DataFrame(channels).to_json(orient='records'))
+        scada = communication_scada()
+        scada.input['deadband'] = 0
+        res, requests = self.set_scada(scada, channels, {'ch0': 1, 'ch1': 1})
+        self.assertEqual((requests, res['written'].tolist()), (1, [1, 1]))
+        res, requests = self.set_scada(scada, channels, {'ch0': 1, 'ch1': 3})
+        self.assertEqual((requests, res['written'].tolist()), (0, [0, 0]))
+        self.assertTrue((res['valid'] == 1).all())
+        res, requests = self.set_scada(scada, channels, {'ch0': 2, 'ch1': 7})
+        self.assertEqual((requests, res['written'].tolist()), (1, [1, 1]))
+        scada.input['refresh-interval'] = 0
+        res, requests = self.set_scada(scada, channels, {'ch0': 2, 'ch1': 7})
+        self.assertEqual((requests, res['written'].tolist()), (1, [1, 1]))
+
+    def test_pool(self):
+        channels = make_channels(self.server.port, [(1, 10, 'int', ['big', 'little'])])
+        for inputs, connections in [({}, 1), ({'async': True}, 1), ({'idle-timeout': 0}, 3)]:
+            scada = communication_scada()
+            scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'}, **inputs)
+            scada.pmb_debug = None
+            before = self.server.connections
+            for _ in range(3):
+                self.assertEqual(scada.get_scada()['valid'].iloc[0], 1)
+            self.assertEqual(self.server.connections - before, connections, msg=str(inputs))
+
+            # reconnect
+            if scada.pool is not None:
+                [client.close() for client, _ in scada.pool.clients.values()]
+                if scada.loop:
+                    scada.loop.run_until_complete(asyncio.sleep(0.1))
+                self.assertEqual(scada.get_scada()['valid'].iloc[0], 1)
+            scada.close()
+            self.assertIsNone(scada.pool)
+
+    def test_pool_timeout(self):
+        # clients of timed out requests are not kept, a late response would be taken
+        # as the response of the next request
+        server = ModbusTestServer(range(100), delay=0.8)
+        try:
+            channels = make_channels(server.port, [(1, 10, 'int', ['big', 'little'])])
+            for inputs in [{}, {'async': True}]:
+                scada = communication_scada()
+                scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'},
+                                   **inputs)
+                scada.pmb_debug = None
+                server.delay = 0.8
+                self.assertEqual(scada.get_scada()['valid'].iloc[0], 0)
+                self.assertEqual(scada.pool.clients, {}, msg=str(inputs))
+                server.delay = 0
+                time.sleep(1)
+                res = scada.get_scada()
+                scada.close()
+                self.assertEqual(res['value'].tolist(), [10])
+        finally:
+            server.stop()
+
+
+class TestModbusAsync(unittest.TestCase):
+    '''
+    unit tests for concurrent polling of several Modbus connections.
+    '''
+
+    def setUp(self):
+        self.servers = [ModbusTestServer(range(100), delay=0.3) for _ in range(3)]
+
+    def tearDown(self):
+        [server.stop() for server in self.servers]
+
+    def get_scada(self, channels, **inputs):
+        scada = communication_scada()
+        scada.input.update({'channels': json.dumps(channels), 'mode': 'get-scada'}, **inputs)
+        scada.pmb_debug = None
+        st = time.time()
+        res = scada.get_scada()
+        return res, time.time() - st
+
+    def test_concurrent(self):
+        channels = []
+        for server in self.servers:
+            channels += make_channels(server.port, [(1, 10, 'int', ['big', 'little']),
+                                                    (1, 12, 'float', ['big', 'little']),
+                                                    (1, 50, 'uint', ['big', 'little'])])
+        for i, c in enumerate(channels):
+            c['name'] = f'ch{i}'
+        res, duration = self.get_scada(channels, **{'async': True, 'device-timeout': 2})
+        legacy, legacy_duration = self.get_scada(channels)
+        self.assertEqual(res['value'].tolist(), legacy['value'].tolist())
+        self.assertTrue((res['valid'] == 1).all())
+        # two blocks per server, servers polled at the same time
+        self.assertGreater(legacy_duration, 6 * 0.3)
+        self.assertLess(duration, 4 * 0.3)
+
+    def test_unavailable(self):
+        port = self.servers[0].port
+        self.servers[0].stop()
+        self.servers = self.servers[1:]
+        channels = make_channels(port, [(1, 10, 'int', ['big', 'little'])]) \
+            + make_channels(self.servers[0].port, [(1, 10, 'int', ['big', 'little'])])
+        channels[1]['name'] = 'ch1'
+        res, duration = self.get_scada(channels, **{'async': True, 'device-timeout': 1})
+        self.assertEqual(res['valid'].tolist(), [0, 1])
+        self.assertIn('ERROR', res['error'].iloc[0])
+        self.assertEqual(res['value'].iloc[0], -1)
+        self.assertLess(duration, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import socket
+import unittest
+import pandas as pd
+
+import doper.data.modbus as modbus_io
+from doper.data.modbus_server import SnapshotServer, server_scada
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def make_channels(port, specs):
+    return [{'name': f'ch{i}', 'address': f'127.0.0.1:{port}:{device}:9600', 'register': register,
+             'mode': mode, 'access': access, 'default': default, 'slave_id': device}
+            for i, (device, register, mode, access, default) in enumerate(specs)]
+
+
+class TestSnapshotServer(unittest.TestCase):
+    '''
+    unit tests for the in-process Modbus server of the SCADA server.
+    '''
+
+    def setUp(self):
+        self.port = free_port()
+        self.channels = make_channels(self.port, [(1, 0, 'float', 'r', 1.5),
+                                                  (1, 2, 'int', 'r', -3),
+                                                  (1, 3, 'float', 'w', 0),
+                                                  (2, 10, 'int', 'w', 7)])
+        self.server = SnapshotServer(pd.DataFrame(self.channels))
+        self.client = modbus_io.modbus_client(ip='127.0.0.1', port=self.port)
+        self.client.connect()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def read(self, register, data_type, device=1):
+        count = modbus_io.register_count(data_type)
+        res = self.client.read_holding_registers(register, count=count, device_id=device)
+        return modbus_io.decode_registers(res.registers, data_type, order=['big', 'big'])
+
+    def test_defaults(self):
+        self.assertEqual(self.read(0, 'float32'), 1.5)
+        self.assertEqual(self.read(2, 'int16'), -3)
+        self.assertEqual(self.read(10, 'int16', device=2), 7)
+
+    def test_update(self):
+        self.assertEqual(self.server.update({'ch0': 2.25, 'ch1': -3, 'unknown': 1}), 1)
+        self.assertEqual(self.read(0, 'float32'), 2.25)
+        self.assertEqual(self.server.update({'ch0': 2.25}), 0)
+
+    def test_client_write(self):
+        payload = modbus_io.encode_registers(-8.5, 'float32', order=['big', 'big'])
+        self.client.write_registers(3, payload, device_id=1)
+        self.client.write_register(10, 42, device_id=2)
+        self.assertEqual(self.server.read(['ch2', 'ch3']), {'ch2': -8.5, 'ch3': 42})
+        self.assertFalse(self.server.context.dirty)
+
+    def test_illegal_address(self):
+        res = self.client.read_holding_registers(100, count=2, device_id=1)
+        self.assertTrue(res.isError())
+
+
+class TestServerScada(unittest.TestCase):
+    '''
+    unit tests for the SCADA server with the in-process Modbus server.
+    '''
+
+    def test_compute(self):
+        port = free_port()
+        channels = make_channels(port, [(1, 0, 'float', 'r', 0), (1, 2, 'int', 'w', 5)])
+        scada = server_scada()
+        scada.check_data = lambda data, init: ''
+        scada.input.update({'channels': json.dumps(channels), 'input-data':
+                            json.dumps([{'name': 'ch0', 'value': 12.5}, {'name': 'ch1', 'value': 1}])})
+        try:
+            self.assertEqual(scada.compute(), '')
+            self.assertEqual(scada.output['output-data'], {'ch1': 5})
+            client = modbus_io.modbus_client(ip='127.0.0.1', port=port)
+            client.connect()
+            res = client.read_holding_registers(0, count=2, device_id=1)
+            self.assertEqual(modbus_io.decode_registers(res.registers, 'float32', ['big', 'big']),
+                             12.5)
+            client.write_register(2, 9, device_id=1)
+            client.close()
+            server = scada.modbus
+            self.assertEqual(scada.compute(), '')
+            self.assertEqual(scada.output['output-data'], {'ch1': 9})
+            self.assertIs(scada.modbus, server)
+        finally:
+            scada.close()
+
+    def test_diff_sync(self):
+        port = free_port()
+        channels = make_channels(port, [(1, 0, 'float', 'r', 0), (1, 2, 'float', 'r', 0),
+                                        (1, 4, 'int', 'w', 5)])
+        scada = server_scada()
+        scada.check_data = lambda data, init: ''
+        scada.input['channels'] = json.dumps(channels)
+        try:
+            sent = []
+            for values in [[1, 2], [1, 3], [1, 3]]:
+                scada.input['input-data'] = json.dumps([{'name': f'ch{i}', 'value': v}
+                                                        for i, v in enumerate(values)])
+                self.assertEqual(scada.compute(), '')
+                if len(sent) == 0:
+                    parsed = scada.channels
+                    update = scada.modbus.update
+                    scada.modbus.update = lambda values: sent.append(values) or update(values)
+                self.assertIs(scada.channels, parsed)
+            self.assertEqual(sent, [{'ch1': 3}, {}])
+            self.assertEqual(scada.modbus.read(['ch0', 'ch1']), {'ch0': 1, 'ch1': 3})
+
+            # changed channels restart the server
+            server = scada.modbus
+            scada.input['channels'] = json.dumps(channels[:2])
+            self.assertEqual(scada.compute(), '')
+            self.assertIsNot(scada.modbus, server)
+            self.assertEqual(scada.output['output-data'], {})
+        finally:
+            scada.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,13 @@ sys.path.append('../src')
 from doper import DOPER, get_solver, get_root
 from doper.models.basemodel import base_model
 from doper.models.battery import add_battery
-from doper.models.network import add_network
+from doper.models.network import add_network, add_violated_network_limits
 import doper.examples as example
-from doper.utility import default_output_list
+from doper.utility import default_output_list, find_duplicate_constraints
 
 
-from pyomo.environ import Objective, minimize
+from pyomo.environ import Objective, minimize, value
+from pyomo.repn import generate_standard_repn
 
 def create_test_parameter():
     '''
@@ -374,6 +375,109 @@ class TestBaseModel(unittest.TestCase):
     def test_pyomo_has_current_square(self):
         self.assertTrue(hasattr(self.model, 'real_branch_cur_square'), msg='pyomo model is missing key var: real_branch_cur_square')
 
+    # check that real and imag powerflow equations are distinct
+    def test_no_duplicate_constraints(self):
+        self.assertEqual(find_duplicate_constraints(self.model), {}, msg='duplicate constraint rows in powerflow model')
+
+    # check that the imag voltages follow the imag linearisation (no slack voltage offset)
+    def test_imag_voltage(self):
+        m = self.model
+        v0 = value(m.slackBusVoltage)
+        for ts in list(m.ts)[:24]:
+            for node in m.nodesNoSlack:
+                expected = (1/v0) * \
+                    (sum(value(m.imagZBus[node, n]) * value(m.real_power_inj[ts, n] - m.real_power_abs[ts, n]) for n in m.nodesNoSlack) \
+                     - sum(value(m.realZBus[node, n]) * value(m.imag_power_inj[ts, n] - m.imag_power_abs[ts, n]) for n in m.nodesNoSlack))
+                self.assertAlmostEqual(value(m.voltage_imag[ts, node]), expected, places=6, msg=f'imag voltage at {node}')
+                self.assertLess(abs(value(m.voltage_imag[ts, node])), 0.5 * v0, msg=f'imag voltage offset at {node}')
+
+    # check that the imag branch losses use the imag impedance
+    def test_imag_branch_loss(self):
+        m = self.model
+        ts = list(m.ts)[0]
+        checked = 0
+        for n1 in m.nodes:
+            for n2 in m.nodesN:
+                if not value(m.node_connection_UT[n1, n2]):
+                    continue
+                repn = generate_standard_repn(m.constraint_pf_imag_branch_loss_eq[ts, n1, n2].body)
+                coef = {id(v): c for v, c in zip(repn.linear_vars, repn.linear_coefs)}
+                loss = coef[id(m.imag_branch_loss[ts, n1, n2])]
+                current = coef[id(m.real_branch_cur_square[ts, n1, n2])]
+                self.assertAlmostEqual(-current / loss, value(m.branch_img_imp[n1, n2]), places=9,
+                                       msg=f'imag loss impedance of {n1}-{n2}')
+                self.assertNotAlmostEqual(value(m.branch_img_imp[n1, n2]), value(m.branch_real_imp[n1, n2]), places=9)
+                checked += 1
+        self.assertGreater(checked, 0, msg='no imag branch losses checked')
+
+
+class TestLazyNetworkConstraints(unittest.TestCase):
+    '''
+    unit tests for lazy generation of voltage and current limits.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        def control_model(inputs, parameter):
+            model = base_model(inputs, parameter)
+            model = add_network(model, inputs, parameter)
+            model.objective = Objective(expr=model.sum_energy_cost + model.sum_demand_cost,
+                                        sense=minimize, doc='objective function')
+            return model
+
+        cls.objective = {}
+        for lazy in [False, True]:
+            parameter = create_test_parameter()
+            parameter['network']['settings']['lazyNetworkConstraints'] = lazy
+            data = create_test_input(parameter)
+            smartDER = DOPER(model=control_model,
+                             parameter=parameter,
+                             solver_path=get_solver('cbc', solver_dir=os.path.join(get_root(), 'solvers')),
+                             output_list=default_output_list(parameter))
+            res = smartDER.do_optimization(data)
+            cls.objective[lazy] = res[1]
+        cls.model = res[3]
+
+        # limits which are violated after all iterations
+        parameter = create_test_parameter()
+        parameter['network']['settings'].update(lazyNetworkConstraints=True, lazyMaxIterations=0,
+                                                voltMax=0.9999)
+        smartDER = DOPER(model=control_model,
+                         parameter=parameter,
+                         solver_path=get_solver('cbc', solver_dir=os.path.join(get_root(), 'solvers')),
+                         output_list=default_output_list(parameter))
+        cls.exhausted = smartDER.do_optimization(create_test_input(parameter), print_error=False)
+
+    def test_objective(self):
+        self.assertAlmostEqual(self.objective[True], self.objective[False],
+                               delta=abs(self.objective[False]) * 1e-6)
+
+    def test_iterations_exhausted(self):
+        # the solution breaks limits which were not added, it is not reported as optimal
+        self.assertEqual(str(self.exhausted[5]), 'maxIterations')
+        self.assertIsNone(self.exhausted[1])
+        self.assertTrue(self.exhausted[2].empty)
+
+    def test_limits_not_generated(self):
+        # no limit binds in the test network
+        self.assertEqual(len(self.model.constraint_pf_volt_limit_eq1), 0)
+        self.assertEqual(len(self.model.constraint_total_current_cap_eqn), 0)
+        self.assertEqual(add_violated_network_limits(self.model), 0)
+
+    def test_add_violated(self):
+        voltMax = self.model.voltMax
+        try:
+            # all voltages violate a lower upper limit
+            self.model.voltMax = 0.5
+            added = add_violated_network_limits(self.model)
+            self.assertEqual(len(self.model.constraint_pf_volt_limit_eq2),
+                             len(self.model.ts) * len(self.model.nodes))
+            self.assertGreaterEqual(added, len(self.model.constraint_pf_volt_limit_eq2))
+            # rows are only added once
+            self.assertEqual(add_violated_network_limits(self.model), 0)
+        finally:
+            self.model.voltMax = voltMax
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""Unit tests for fixing disabled and unavailable model components."""
+
+import unittest
+
+from doper import DOPER, get_solver
+from doper.models.make_model import construct_model_function
+from doper.models.basemodel import base_model
+from doper.models.battery import add_battery
+from doper.models.genset import add_genset
+import doper.examples as example
+from doper.utility import default_output_list
+
+
+class TestDisabledComponents(unittest.TestCase):
+    """Variables of disabled technologies are fixed to 0."""
+
+    def setUp(self):
+        parameter = example.default_parameter()
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        self.model = base_model(data, parameter)
+
+    def test_power_exchange_fixed(self):
+        for var in [self.model.powerExchangeOut, self.model.powerExchangeIn,
+                    self.model.powerExchangeLosses]:
+            self.assertTrue(all(v.fixed and v.value == 0 for v in var.values()))
+
+    def test_disabled_techs_fixed(self):
+        for var in [self.model.sum_battery_charge_grid_power, self.model.sum_genset_power,
+                    self.model.load_shed, self.model.building_load_dynamic]:
+            self.assertTrue(all(v.fixed and v.value == 0 for v in var.values()))
+
+    def test_outage_constraints_skipped(self):
+        self.assertEqual(len(self.model.constraint_outage_import), 0)
+
+
+class TestUnavailableComponents(unittest.TestCase):
+    """Variables are fixed by grid, battery and fuel availability."""
+
+    def setUp(self):
+        parameter = example.parameter_add_genset(example.parameter_add_battery())
+        data = example.ts_inputs_planned_outage(parameter)
+        data = example.ts_inputs_fueloutage(parameter, data)
+        data['battery_libat01_avail'] = 1
+        data['battery_libat01_demand'] = 0
+        data.loc[data.index[:10], 'battery_libat01_avail'] = 0
+        self.parameter = parameter
+        self.data = data
+        model = base_model(data, parameter)
+        model = add_battery(model, data, parameter)
+        self.model = add_genset(model, data, parameter)
+
+    def test_grid_outage(self):
+        ts_out = self.model.ts.at(len(self.model.ts))
+        ts_in = self.model.ts.at(1)
+        self.assertTrue(self.model.grid_import[ts_out, self.model.nodes.at(1)].fixed)
+        self.assertTrue(self.model.grid_importXORexport[ts_out].fixed)
+        self.assertFalse(self.model.grid_import[ts_in, self.model.nodes.at(1)].fixed)
+
+    def test_battery_unavailable(self):
+        ts = self.model.ts.at(1)
+        self.assertTrue(self.model.battery_chargeXORdischarge[ts, 'libat01'].fixed)
+        self.assertNotIn((ts, 'libat01'), self.model.constraint_battery_charge_XOR_discharge)
+        ts = self.model.ts.at(len(self.model.ts))
+        self.assertFalse(self.model.battery_chargeXORdischarge[ts, 'libat01'].fixed)
+
+    def test_fuel_source(self):
+        ts = self.model.ts.at(1)
+        self.assertTrue(self.model.genset_fuel_from_reserves_profile[ts, 'diesel'].fixed)
+        self.assertFalse(self.model.genset_fuel_import_profile[ts, 'diesel'].fixed)
+        ts = self.model.ts.at(len(self.model.ts))
+        self.assertTrue(self.model.genset_fuel_import_profile[ts, 'diesel'].fixed)
+
+    def test_solve(self):
+        smart = DOPER(model=construct_model_function(), parameter=self.parameter,
+                      solver_path=get_solver('cbc'),
+                      output_list=default_output_list(self.parameter))
+        _, objective, df, _, _, _, _ = smart.do_optimization(self.data)
+        self.assertIsNotNone(objective)
+        self.assertEqual(df['Import Power [kW]'].iloc[-1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
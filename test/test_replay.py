@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import doper.examples as example
+from doper.wrapper import make_doper
+from doper.data.setpoint_processor import battery_setpoint_processor
+from doper.data.runlog import RunLog
+from doper.replay import (find_cases, load_recorded, replay_case, replay_logs, compare_case,
+                          summarize)
+
+
+class TestReplay(unittest.TestCase):
+    '''
+    unit tests for replaying logged optimizations.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.log_dir = tempfile.mkdtemp()
+        parameter = example.parameter_add_battery(example.default_parameter())
+        parameter['controller']['solver_path'] = None
+        data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+        data = data.iloc[::12]
+        smart = make_doper(parameter)
+        duration, objective, df, _, _, termination, _ = smart.do_optimization(data)
+        setpoints, _ = battery_setpoint_processor(df.join(data), smart.parameter)
+        cls.results = {'objective': objective, 'termination': str(termination),
+                       'duration': duration, 'setpoints': setpoints}
+
+        # recorded, changed objective, without results, broken inputs
+        smart.dump_model(os.path.join(cls.log_dir, '1'), 'case1', results=cls.results)
+        smart.dump_model(os.path.join(cls.log_dir, '1'), 'case2',
+                         results=dict(cls.results, objective=objective*1.1))
+        smart.dump_model(os.path.join(cls.log_dir, '2'), 'case3')
+        smart.dump_model(os.path.join(cls.log_dir, '2'), 'case4', results=cls.results)
+        with open(os.path.join(cls.log_dir, '2', 'case4.csv'), 'w', encoding='utf8') as f:
+            f.write('broken\n')
+        cls.run_log_dir = tempfile.mkdtemp()
+        with RunLog(cls.run_log_dir) as run_log:
+            smart.dump_model(log_name='3', results=cls.results, run_log=run_log)
+        # timings on a busy test machine vary, see test_compare
+        cls.report = replay_logs(cls.log_dir, workers=2, duration_threshold=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.log_dir)
+        shutil.rmtree(cls.run_log_dir)
+
+    def test_find_cases(self):
+        cases = find_cases(self.log_dir)
+        self.assertEqual([c['name'] for c in cases],
+                         [os.path.join('1', 'case1'), os.path.join('1', 'case2'),
+                          os.path.join('2', 'case3'), os.path.join('2', 'case4')])
+        self.assertIsNone(cases[2]['result_path'])
+        # recorded results are read without the inputs
+        self.assertEqual(load_recorded(cases[3])['objective'], self.results['objective'])
+        self.assertIsNone(load_recorded(cases[2]))
+
+    def test_replay(self):
+        replayed = replay_case(find_cases(self.log_dir)[0])
+        self.assertEqual(replayed['termination'], 'optimal')
+        self.assertAlmostEqual(replayed['objective'], self.results['objective'], 3)
+        self.assertEqual(replayed['setpoints'].keys(), self.results['setpoints'].keys())
+
+    def test_report(self):
+        regressions = self.report['regressions'].to_dict()
+        self.assertEqual(regressions[os.path.join('1', 'case1')], '')
+        self.assertEqual(regressions[os.path.join('1', 'case2')], 'objective')
+        self.assertEqual(regressions[os.path.join('2', 'case3')], '')
+        self.assertEqual(regressions[os.path.join('2', 'case4')], 'error')
+        self.assertFalse(self.report.loc[os.path.join('2', 'case3'), 'recorded'])
+        self.assertTrue(self.report.loc[os.path.join('2', 'case4'), 'recorded'])
+        self.assertIn('2 cases regressed', summarize(self.report))
+
+    def test_run_log(self):
+        report = replay_logs(self.run_log_dir, workers=1, start='2019-01-01',
+                             duration_threshold=100)
+        self.assertEqual(list(report.index), ['3/2019-01-01 00:00:00'])
+        self.assertEqual(report['regressions'].iloc[0], '')
+        self.assertTrue(replay_logs(self.run_log_dir, start='2019-01-02').empty)
+
+    def test_compare(self):
+        recorded = dict(self.results, duration=1)
+        row = compare_case(recorded, dict(self.results, duration=2, termination='infeasible',
+                                          setpoints={}))
+        self.assertEqual(row['regressions'], 'termination,setpoints,slower')
+        self.assertEqual(row['duration_ratio'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
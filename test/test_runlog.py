@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import doper.examples as example
+from doper.data.runlog import RunLog, parameter_hash
+
+
+class TestRunLog(unittest.TestCase):
+    '''
+    unit tests for the run log store.
+    '''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.parameter = example.parameter_add_battery(example.default_parameter())
+        day = example.ts_inputs(self.parameter, load='B90', scale_load=150, scale_pv=100)
+        self.inputs = {}
+        for days in range(3):
+            for hour in [0, 6, 12]:
+                data = day.iloc[hour*12:hour*12+97:12].copy()
+                data.index = data.index + pd.Timedelta(days=days)
+                self.inputs[(days, hour)] = data
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _fill(self, **kwargs):
+        runs = {}
+        with RunLog(self.path, **kwargs) as run_log:
+            for (days, hour), data in self.inputs.items():
+                for instance_id in ['1', '2']:
+                    results = {'objective': days + hour / 24, 'termination': 'optimal',
+                               'duration': 0.1, 'setpoints': {'battery': hour}}
+                    run = run_log.append(instance_id, self.parameter, data, results)
+                    runs[run] = data
+        return runs
+
+    def test_roundtrip(self):
+        runs = self._fill(batch_size=4)
+        read_runs, inputs = RunLog(self.path).read()
+        self.assertEqual(sorted(read_runs.index), sorted(runs))
+        for run, data in runs.items():
+            pd.testing.assert_frame_equal(inputs[run], data, check_freq=False)
+        run = read_runs.loc['2/2019-01-02 06:00:00']
+        self.assertEqual(run['instance_id'], '2')
+        self.assertEqual(run['objective'], 1.25)
+        self.assertEqual(run['termination'], 'optimal')
+
+        # one parameter file, date and instance partitions
+        self.assertEqual(os.listdir(os.path.join(self.path, 'parameters')),
+                         [parameter_hash(self.parameter) + '.json'])
+        self.assertEqual(RunLog(self.path).parameter(run['parameter_hash']),
+                         json.loads(json.dumps(self.parameter)))
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['date=2019-01-01', 'date=2019-01-02', 'date=2019-01-03', 'parameters'])
+
+    def test_time_range(self):
+        self._fill()
+        run_log = RunLog(self.path)
+        runs = run_log.read_runs('2019-01-02 06:00', '2019-01-03 00:00', instance_id='1')
+        self.assertEqual(list(runs.index), ['1/2019-01-02 06:00:00', '1/2019-01-02 12:00:00',
+                                            '1/2019-01-03 00:00:00'])
+        self.assertEqual(len(run_log.segments('2019-01-02 06:00', '2019-01-02 12:00')), 2)
+        self.assertTrue(run_log.read('2020-01-01')[0].empty)
+
+    def test_batches(self):
+        run_log = RunLog(self.path, batch_size=2, background=False)
+        for hour in [0, 6, 12]:
+            run_log.append('1', self.parameter, self.inputs[(0, hour)])
+        self.assertEqual(len(run_log.segments()), 1)
+        run_log.close()
+        self.assertEqual(len(run_log.segments()), 2)
+        self.assertEqual(len(run_log.read_runs()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
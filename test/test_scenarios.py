@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+
+from doper import DOPER, get_solver
+from doper.models.make_model import construct_model_function
+from doper.models.network import add_network
+from doper.examples.scenarios import make_scenario, make_edges
+from doper.utility import default_output_list
+
+
+def _solve(parameter, data):
+    """Helper: run optimization, with network equations for multi-node scenarios."""
+    control_model = construct_model_function()
+    if 'network' in parameter:
+        def network_model(inputs, parameter):
+            return add_network(control_model(inputs, parameter), inputs, parameter)
+        model = network_model
+    else:
+        model = control_model
+    smart = DOPER(model=model, parameter=parameter, solver_path=get_solver('cbc'),
+                  output_list=default_output_list(parameter))
+    return smart.do_optimization(data)
+
+
+class TestScenarios(unittest.TestCase):
+    '''
+    unit tests for the synthetic scenario generator.
+    '''
+
+    def test_reproducible(self):
+        kwargs = dict(nodes=6, batteries=3, evs=4, gensets=1, load_circuits=2, horizon=12)
+        parameter1, data1 = make_scenario(seed=3, **kwargs)
+        parameter2, data2 = make_scenario(seed=3, **kwargs)
+        self.assertEqual(parameter1, parameter2)
+        self.assertTrue(data1.equals(data2))
+        _, data3 = make_scenario(seed=4, **kwargs)
+        self.assertFalse(data1.equals(data3))
+
+    def test_size(self):
+        parameter, data = make_scenario(batteries=4, evs=6, gensets=2, load_circuits=3,
+                                        horizon=48, timestep=15)
+        self.assertEqual(len(data), 48*4+1)
+        self.assertEqual(len(parameter['batteries']), 10)
+        self.assertEqual(len(parameter['gensets']), 2)
+        self.assertEqual(len(parameter['load_control']), 3)
+        for i in range(6):
+            avail = data[f'battery_ev{i}_avail']
+            # plugged in overnight, away during the day
+            self.assertEqual(avail.iloc[0], 1)
+            self.assertEqual(avail.between_time('12:00', '13:00').max(), 0)
+            self.assertTrue((data[f'battery_ev{i}_demand'][avail == 1] == 0).all())
+
+    def test_topology(self):
+        rng = np.random.default_rng(0)
+        edges = make_edges(30, 'radial', rng)
+        self.assertEqual(len(edges), 29)
+        self.assertEqual(sorted(child for _, child in edges), list(range(1, 30)))
+        self.assertTrue(all(parent < child for parent, child in edges))
+        meshed = make_edges(30, 'meshed', rng)
+        self.assertEqual(len(meshed), 29 + 6)
+        self.assertEqual(len(set(meshed)), len(meshed))
+
+    def test_network_consistent(self):
+        parameter, data = make_scenario(nodes=8, topology='meshed', batteries=5, evs=3,
+                                        gensets=2, load_circuits=4)
+        nodes = parameter['network']['nodes']
+        lines = {line['line_id'] for line in parameter['network']['lines']}
+        self.assertEqual([n['slack'] for n in nodes].count(True), 1)
+        placed = {'battery': [], 'genset': [], 'load_control': []}
+        for node in nodes:
+            self.assertIn(node['load_id'], data.columns)
+            self.assertIn(node['ders']['pv_id'], data.columns)
+            for connection in node['connections']:
+                self.assertIn(connection['line'], lines)
+            for kind in placed:
+                placed[kind] += node['ders'][kind] or []
+        self.assertEqual(sorted(placed['battery']),
+                         sorted(b['name'] for b in parameter['batteries']))
+        self.assertEqual(sorted(placed['genset']),
+                         sorted(g['name'] for g in parameter['gensets']))
+        for name in placed['load_control']:
+            self.assertIn(f'load_shed_potential_{name}', data.columns)
+
+    def test_solve(self):
+        for kwargs in [dict(evs=5, gensets=1, load_circuits=2, timestep=15),
+                       dict(nodes=5, batteries=3, evs=2, timestep=30),
+                       dict(nodes=5, batteries=3, powerflow=True, timestep=60)]:
+            res = _solve(*make_scenario(**kwargs))
+            self.assertEqual(str(res[5]), 'optimal', msg=str(kwargs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+import doper.examples as example
+from doper.data.transport import encode_frame, decode_frame
+
+
+class TestTransport(unittest.TestCase):
+    '''
+    unit tests for the timeseries transport of DoperWrapper.
+    '''
+
+    def setUp(self):
+        parameter = example.default_parameter()
+        self.data = example.ts_inputs(parameter, load='B90', scale_load=150, scale_pv=100)
+
+    def test_columnar_roundtrip(self):
+        payload = encode_frame(self.data, 'columnar')
+        self.assertIsInstance(payload, bytes)
+        df = decode_frame(payload)
+        pd.testing.assert_frame_equal(df, self.data, check_freq=False)
+
+    def test_columnar_types(self):
+        index = pd.date_range('2020-01-01', periods=3, freq='h', tz='US/Pacific')
+        data = pd.DataFrame({'a': [1, 2, 3], 'b': [True, False, True], 'c': ['x', 'y', 'z'],
+                             'd': index}, index=index)
+        df = decode_frame(encode_frame(data, 'columnar'))
+        pd.testing.assert_frame_equal(df, data, check_freq=False)
+
+    def test_columnar_smaller(self):
+        self.assertLess(len(encode_frame(self.data, 'columnar')),
+                        len(encode_frame(self.data, 'json')))
+
+    def test_json(self):
+        payload = encode_frame(self.data, 'json')
+        self.assertEqual(payload, self.data.to_json())
+        df = decode_frame(payload)
+        self.assertTrue(np.allclose(df['load_demand'], self.data['load_demand']))
+
+    def test_columns(self):
+        df = decode_frame(encode_frame(self.data, 'columnar', ['oat', 'load_demand', 'missing']))
+        self.assertEqual(list(df.columns), ['oat', 'load_demand'])
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow') is None, 'pyarrow not installed')
+    def test_feather_roundtrip(self):
+        df = decode_frame(encode_frame(self.data, 'feather'))
+        pd.testing.assert_frame_equal(df, self.data, check_freq=False)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            encode_frame(self.data, 'xml')
+        with self.assertRaises(ValueError):
+            decode_frame(b'not a payload')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from doper.data.weatherForecast import get_hrrr_forecast, HRRRCache
+
+
+class HRRRStandIn:
+    '''
+    Local HTTP stand-in for the NOMADS HRRR filter, serving one recorded payload per
+    forecast hour and counting concurrent requests.
+    '''
+
+    def __init__(self, delay=0, failures=None):
+        self.delay = delay
+        self.failures = dict(failures or {}) # hour: number of failed responses
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/filter_hrrr_2d.pl'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle(self, request):
+        hour = int(re.search('wrfsfcf([0-9]+)', request.path).group(1))
+        with self.lock:
+            self.requests.append(hour)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            failed = self.failures.get(hour, 0) > 0
+            if failed:
+                self.failures[hour] -= 1
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if failed:
+            request.send_response(503)
+            request.end_headers()
+            return
+        payload = json.dumps({'lat': 37.87, 'lon': -122.25, 'hour': hour}).encode()
+        request.send_response(200)
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def decode_payload(lat, lon, fname):
+    # recorded payloads are the nearest grid point, as get_nearest_data
+    with open(fname, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+class TestHRRRForecast(unittest.TestCase):
+    '''
+    unit tests for the HRRR forecast download.
+    '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dt = pd.Timestamp('2024-06-01 12:30')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def forecast(self, stand_in, **kwargs):
+        return get_hrrr_forecast(37.87, -122.25, self.dt, max_hour=7, tmp_dir=self.tmp_dir,
+                                 url=stand_in.url, decoder=decode_payload, sleep=0.01, **kwargs)
+
+    def test_concurrent(self):
+        stand_in = HRRRStandIn(delay=0.2)
+        try:
+            st = time.time()
+            res = self.forecast(stand_in, max_workers=4)
+            duration = time.time() - st
+        finally:
+            stand_in.stop()
+        self.assertEqual(list(res['hour']), list(range(2, 10)))
+        self.assertEqual(res.index[0], pd.Timestamp('2024-06-01 12:00'))
+        self.assertEqual(len(res.index.unique()), 8)
+        self.assertEqual(stand_in.max_active, 4)
+        self.assertLess(duration, 8 * 0.2)
+        self.assertTrue((res['duration'] >= 0.2).all())
+        # temporary files are removed
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_sequential(self):
+        stand_in = HRRRStandIn()
+        try:
+            res = self.forecast(stand_in, max_workers=1)
+        finally:
+            stand_in.stop()
+        self.assertEqual(stand_in.max_active, 1)
+        self.assertEqual(stand_in.requests, list(range(2, 10)))
+        self.assertEqual(list(res['hour']), list(range(2, 10)))
+
+    def test_retry(self):
+        stand_in = HRRRStandIn(failures={3: 2, 5: 5})
+        try:
+            res = self.forecast(stand_in, max_retry=3)
+        finally:
+            stand_in.stop()
+        self.assertEqual(stand_in.requests.count(3), 3)
+        self.assertEqual(stand_in.requests.count(5), 3)
+        self.assertEqual(res['hour'].iloc[1], 3)
+        # no forecast received after the last retry
+        self.assertTrue(pd.isnull(res['hour'].iloc[3]))
+        self.assertFalse(res['duration'].isnull().any())
+
+
+class TestHRRRCache(unittest.TestCase):
+    '''
+    unit tests for the on-disk cache of HRRR downloads.
+    '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def forecast(self, stand_in, lat, dt, cache):
+        return get_hrrr_forecast(lat, -122.25, pd.Timestamp(dt), max_hour=3,
+                                 tmp_dir=self.tmp_dir, url=stand_in.url,
+                                 decoder=decode_payload, sleep=0.01, cache=cache)
+
+    def test_shared(self):
+        stand_in = HRRRStandIn(failures={4: 3})
+        try:
+            res = self.forecast(stand_in, 37.87, '2024-06-01 12:30', HRRRCache(self.cache_dir))
+            self.assertEqual(len(stand_in.requests), 3 + 3)
+            # other instance and co-located site, only the failed hour is fetched
+            cache = HRRRCache(self.cache_dir)
+            res2 = self.forecast(stand_in, 37.5, '2024-06-01 12:45', cache)
+            self.assertEqual(stand_in.requests[6:], [4])
+            self.assertEqual((cache.hits, cache.misses), (3, 1))
+            pd.testing.assert_frame_equal(res.drop(columns='duration').iloc[[0, 1, 3]],
+                                          res2.drop(columns='duration').iloc[[0, 1, 3]])
+            # next cycle, other site
+            self.forecast(stand_in, 37.87, '2024-06-01 13:00', cache)
+            self.forecast(stand_in, 39.5, '2024-06-01 13:00', cache)
+            self.assertEqual(len(stand_in.requests), 7 + 4 + 4)
+        finally:
+            stand_in.stop()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 12)
+        self.assertEqual(os.listdir(self.tmp_dir), ['cache'])
+
+    def test_decode_error(self):
+        stand_in = HRRRStandIn()
+        def broken(lat, lon, fname):
+            res = decode_payload(lat, lon, fname)
+            if res['hour'] == 3:
+                raise ValueError('truncated download')
+            return res
+        try:
+            with self.assertRaises(ValueError):
+                get_hrrr_forecast(37.87, -122.25, pd.Timestamp('2024-06-01 12:30'), max_hour=3,
+                                  tmp_dir=self.tmp_dir, url=stand_in.url, decoder=broken,
+                                  sleep=0.01, cache=HRRRCache(self.cache_dir), max_workers=1)
+            # the broken download is not cached
+            self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+            res = self.forecast(stand_in, 37.87, '2024-06-01 12:30', HRRRCache(self.cache_dir))
+        finally:
+            stand_in.stop()
+        self.assertEqual(stand_in.requests, [2, 3, 4, 5, 3])
+        self.assertEqual(list(res['hour']), [2, 3, 4, 5])
+
+    def test_evict(self):
+        cache = HRRRCache(self.cache_dir, max_size=0.0025, max_age=3600)
+        now = time.time()
+        for i, age in enumerate([7200, 300, 200, 100]):
+            fname = os.path.join(self.cache_dir, f'{i}.grib2')
+            with open(fname, 'wb') as f:
+                f.write(b'x' * 1000)
+            os.utime(fname, (now-age, now-age))
+        self.assertIsNotNone(cache.get('1'))
+        cache.evict()
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['1.grib2', '3.grib2'])
+        self.assertIsNone(cache.get('0'))
+
+
+if __name__ == '__main__':
+    unittest.main()